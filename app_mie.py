@@ -1,11 +1,13 @@
 # app_mie.py
+import mie_diagnostico   # primero: marca el inicio para el reporte de arranque
 import streamlit as st
 from datetime import datetime, date, time
 from io import BytesIO
-import pandas as pd
 import time as time_mod
 import json
 import hashlib
+import asyncio
+import html
 
 # =======================================================
 #   CONFIGURACIÓN GENERAL (DEBE IR ANTES DE CUALQUIER st.*)
@@ -310,6 +312,7 @@ if not st.session_state["auth_ok"]:
             else:
                 st.error("Contraseña incorrecta.")
 
+    mie_diagnostico.marcar_arranque("login")
     st.stop()
 
 # ==========================
@@ -317,18 +320,59 @@ if not st.session_state["auth_ok"]:
 # ==========================
 from mie_backend import (
     insertar_mie,
-    insertar_foto,
-    subir_foto_a_bucket,
-    listar_mie,
+    registrar_fotos,
+    listar_mie_pagina,
     obtener_mie_detalle,
     obtener_fotos_mie,
+    materializar_fotos,
     cerrar_mie_con_remediacion,
-    obtener_todos_mie,
     actualizar_mie_completo,
     reemplazar_fotos_antes,   # 👈 NUEVO: reemplazar fotos ANTES
+    escrituras_pendientes,
+    escrituras_recientes,
+    reintentar_escritura,
+    COLUMNAS_HISTORIAL,
+    COLUMNAS_PDF,
+    COLUMNAS_ESTADISTICAS,
+    COLUMNAS_EXPORTAR,
 )
 
-from mie_pdf_email import generar_mie_pdf
+import mie_backend_async as backend_async
+from config import FOTO_THUMB_PX, FOTO_MEDIUM_PX
+
+# pandas (snapshot, Estadísticas, Exportar), plotly y reportlab (PDF) se
+# importan dentro del modo que los usa: no pesan en el arranque.
+mie_diagnostico.marcar_arranque("backend")
+
+
+def _mostrar_foto(f, caption=None, width=None):
+    """
+    Muestra una FotoMIE. Con URL firmada va un <img> que el navegador baja
+    directo del bucket (con su Cache-Control); si no, los bytes por st.image.
+    """
+    if f.url:
+        estilo = f"width:{width}px;max-width:100%" if width else "width:100%"
+        pie = f"<figcaption>{html.escape(caption)}</figcaption>" if caption else ""
+        st.markdown(
+            f'<figure style="margin:0 0 1rem 0"><img src="{html.escape(f.url)}" '
+            f'loading="lazy" style="{estilo}">{pie}</figure>',
+            unsafe_allow_html=True,
+        )
+    elif width:
+        st.image(f.data, caption=caption, width=width)
+    else:
+        st.image(f.data, caption=caption, use_container_width=True)
+
+
+def _barra_progreso_fotos():
+    """Barra de progreso para subidas de fotos (callback para el backend)."""
+    barra = st.progress(0.0, text="Subiendo fotos…")
+
+    def _progreso(hechas, total, nombre):
+        barra.progress(hechas / total, text=f"Subiendo fotos… {hechas}/{total} ({nombre})")
+
+    return _progreso
+
 
 # =======================================================
 #   APP
@@ -340,6 +384,56 @@ modo = st.sidebar.radio(
     ["Nuevo MIA", "Historial", "Estadísticas", "Exportar MIA"]
 )
 
+# Escrituras diferidas: lo guardado que todavía no llegó a BigQuery
+_pendientes = escrituras_pendientes()
+_fallidas = [p for p in _pendientes if p["estado"] == "FALLIDA"]
+_en_cola = [p for p in _pendientes if p["estado"] != "FALLIDA"]
+if _en_cola:
+    _con_error = [p for p in _en_cola if p["ultimo_error"]]
+    st.sidebar.warning(
+        f"⏳ {len(_en_cola)} cambio(s) guardándose en BigQuery"
+        + (f" ({len(_con_error)} reintentando)" if _con_error else "")
+    )
+    if _con_error:
+        with st.sidebar.expander("Ver errores", expanded=False):
+            for p in _con_error:
+                st.caption(f"MIA {p['mie_id']} ({p['tipo']}, intento {p['intentos']}): {p['ultimo_error']}")
+if _fallidas:
+    # Agotaron los reintentos: no se aplican solas (ni los cambios posteriores de ese MIA)
+    st.sidebar.error(f"❌ {len(_fallidas)} cambio(s) no se pudieron guardar en BigQuery")
+    with st.sidebar.expander("Ver cambios fallidos", expanded=True):
+        for p in _fallidas:
+            st.caption(f"MIA {p['mie_id']} ({p['tipo']}, {p['intentos']} intentos): {p['ultimo_error']}")
+            if st.button("🔁 Reintentar", key=f"reintentar_{p['id']}"):
+                reintentar_escritura(p["id"])
+                st.rerun()
+
+# Estado de cada escritura, también las ya confirmadas (mientras el journal las retiene)
+_recientes = escrituras_recientes()
+if _recientes:
+    with st.sidebar.expander("🧾 Últimas escrituras", expanded=False):
+        for p in _recientes:
+            icono = {"CONFIRMADA": "✅", "FALLIDA": "❌"}.get(p["estado"], "⏳")
+            hora = (p["confirmada"] or p["creada"]).strftime("%d/%m %H:%M:%S")
+            st.caption(f"{icono} MIA {p['mie_id']} · {p['tipo']} · {p['estado'].lower()} {hora}")
+
+# Diagnóstico: costo / latencia de las consultas hechas por este proceso
+with st.sidebar.expander("🩺 Diagnóstico de consultas", expanded=False):
+    resumen_diag = mie_diagnostico.resumen_por_sitio()
+    if not resumen_diag:
+        st.caption("Todavía no hay consultas registradas.")
+    else:
+        st.caption("Por sitio (ordenado por bytes facturados)")
+        st.dataframe(resumen_diag, hide_index=True, use_container_width=True)
+        st.caption("Últimas consultas")
+        st.dataframe(
+            mie_diagnostico.ultimos_registros(30),
+            hide_index=True,
+            use_container_width=True,
+        )
+    st.caption("Arranque de la instancia (ms desde el inicio)")
+    st.dataframe(mie_diagnostico.arranque(), hide_index=True, use_container_width=True)
+
 # =======================================================
 #  MODO 1 - NUEVO MIA
 # =======================================================
@@ -689,22 +783,21 @@ if modo == "Nuevo MIA":
                     aprobador_apellido=st.session_state.get("aprob_apellido_nuevo") or None,
                     aprobador_nombre=st.session_state.get("aprob_nombre_nuevo") or None,
                     fecha_hora_aprobacion=fecha_hora_aprobacion,
+                    clave_idempotencia=submit_key,
                 )
 
             # marcar como enviado (para evitar reintentos inmediatos)
             st.session_state["last_submit_key"] = submit_key
             st.session_state["last_submit_ts"] = now
 
+            # Mismo formulario ya enviado (recarga u otra pestaña): vuelve el
+            # MIA existente y las fotos que ya tiene no se duplican
             st.success(f"✅ MIA guardado. CÓDIGO: {codigo}")
+            if escrituras_pendientes(mie_id):
+                st.caption("⏳ Se está registrando en BigQuery en segundo plano; ya se puede seguir trabajando.")
 
             if fotos:
-                for archivo in fotos:
-                    nombre_destino = (
-                        f"{codigo}/ANTES/"
-                        f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{archivo.name}"
-                    )
-                    blob_name = subir_foto_a_bucket(archivo, nombre_destino)
-                    insertar_foto(mie_id, "ANTES", blob_name)
+                registrar_fotos(mie_id, "ANTES", fotos, progreso=_barra_progreso_fotos())
 
             st.session_state["ultimo_mie_id"] = mie_id
             st.session_state["ultimo_codigo_mie"] = codigo
@@ -726,8 +819,12 @@ if modo == "Nuevo MIA":
         mie_id_envio = st.session_state["ultimo_mie_id"]
 
         try:
-            detalle_envio = obtener_mie_detalle(mie_id_envio)
-            fotos_envio = obtener_fotos_mie(mie_id_envio)
+            from mie_pdf_email import generar_mie_pdf
+
+            detalle_envio = obtener_mie_detalle(mie_id_envio, COLUMNAS_PDF)
+            fotos_envio = materializar_fotos(
+                obtener_fotos_mie(mie_id_envio, ancho_max=FOTO_MEDIUM_PX), usar_url=False
+            )
             pdf_bytes = generar_mie_pdf(detalle_envio, fotos_envio)
         except Exception as e:
             st.error(f"⚠️ Error generando PDF: {e}")
@@ -749,9 +846,71 @@ if modo == "Nuevo MIA":
 elif modo == "Historial":
     st.header("Historial de MIA")
 
-    registros = listar_mie()
+    if "edit_mie_id" not in st.session_state:
+        st.session_state["edit_mie_id"] = None
+
+    def _ancho_fotos(id_mie):
+        # En edición las fotos se ven como miniaturas; en lectura (y PDF) alcanza la rendition media
+        return FOTO_THUMB_PX if st.session_state["edit_mie_id"] == id_mie else FOTO_MEDIUM_PX
+
+    # Búsqueda (filtros del lado del servidor) + paginado por cursor
+    with st.expander("🔎 Buscar MIA", expanded=False):
+        bf1, bf2, bf3 = st.columns(3)
+        with bf1:
+            filtro_codigo = st.text_input("Código (empieza con)", key="hist_f_codigo").strip()
+        with bf2:
+            filtro_inst = st.text_input("Instalación / pozo", key="hist_f_inst").strip()
+        with bf3:
+            filtro_estado = st.selectbox("Estado", ["(Todos)", "ABIERTO", "CERRADO"], key="hist_f_estado")
+        bf4, bf5 = st.columns(2)
+        with bf4:
+            filtro_desde = st.date_input("Evento desde", value=None, key="hist_f_desde")
+        with bf5:
+            filtro_hasta = st.date_input("Evento hasta", value=None, key="hist_f_hasta")
+
+    filtros = {
+        "codigo_prefijo": filtro_codigo or None,
+        "instalacion": filtro_inst or None,
+        "estado": None if filtro_estado == "(Todos)" else filtro_estado,
+        "desde": filtro_desde,
+        "hasta": filtro_hasta,
+    }
+
+    def _ir_a_pagina(cursores):
+        # Otra página = otras opciones: se descarta la selección anterior
+        st.session_state["hist_cursores"] = cursores
+        st.session_state["hist_opciones"] = {}
+        st.session_state.pop("hist_sel_mie", None)
+
+    # Pila de cursores: el último es el de la página actual (None = primera)
+    if st.session_state.get("hist_filtros") != filtros:
+        st.session_state["hist_filtros"] = filtros
+        _ir_a_pagina([None])
+    cursores = st.session_state["hist_cursores"]
+    pagina = dict(filtros, cursor=cursores[-1])
+
+    # Si en el rerun anterior ya había un MIA elegido, listado + detalle + fotos
+    # se piden juntos (una sola ronda de espera en vez de tres).
+    opciones_prev = st.session_state.get("hist_opciones", {})
+    mie_id_prev = opciones_prev.get(st.session_state.get("hist_sel_mie"))
+
+    if mie_id_prev is not None:
+        (registros, siguiente), detalle, fotos = asyncio.run(
+            backend_async.cargar_historial(
+                mie_id_prev,
+                ancho_max=_ancho_fotos(mie_id_prev),
+                columnas=COLUMNAS_HISTORIAL,
+                pagina=pagina,
+            )
+        )
+    else:
+        (registros, siguiente), detalle, fotos = listar_mie_pagina(**pagina), None, None
+
     if not registros:
-        st.info("No hay MIA registrados.")
+        if any(filtros.values()):
+            st.info("No hay MIA que coincidan con la búsqueda.")
+        else:
+            st.info("No hay MIA registrados.")
         st.stop()
 
     opciones = {}
@@ -759,19 +918,39 @@ elif modo == "Historial":
         nombre = getattr(r, "nombre_instalacion", None) or r.pozo or "(sin instalación)"
         label = f"{r.codigo_mie} - {nombre} ({r.estado})"
         opciones[label] = r.mie_id
+    st.session_state["hist_opciones"] = opciones
+
+    p1, p2, p3 = st.columns([1, 1, 6])
+    with p1:
+        if st.button("◀ Más recientes", key="hist_pag_ant", disabled=len(cursores) == 1):
+            _ir_a_pagina(cursores[:-1])
+            st.rerun()
+    with p2:
+        if st.button("Más antiguos ▶", key="hist_pag_sig", disabled=siguiente is None):
+            _ir_a_pagina(cursores + [siguiente])
+            st.rerun()
+    with p3:
+        st.caption(f"Página {len(cursores)}")
 
     seleccion = st.selectbox("Seleccionar MIA", list(opciones.keys()), key="hist_sel_mie")
     mie_id = opciones[seleccion]
 
-    detalle = obtener_mie_detalle(mie_id)
-    fotos = obtener_fotos_mie(mie_id)
-
-    if "edit_mie_id" not in st.session_state:
-        st.session_state["edit_mie_id"] = None
+    # Fotos: acá solo viene la metadata; los bytes se bajan más abajo, solo de lo que se muestra
+    if mie_id != mie_id_prev:
+        detalle, fotos = asyncio.run(
+            backend_async.cargar_detalle_y_fotos(
+                mie_id, ancho_max=_ancho_fotos(mie_id), columnas=COLUMNAS_HISTORIAL
+            )
+        )
 
     editando = (st.session_state["edit_mie_id"] == mie_id)
 
     st.subheader("📄 Datos del MIA")
+    _pendientes_mie = escrituras_pendientes(mie_id)
+    if any(p["estado"] == "FALLIDA" for p in _pendientes_mie):
+        st.error("❌ Este MIA tiene cambios que no se pudieron guardar en BigQuery (se muestran acá; ver panel lateral).")
+    elif _pendientes_mie:
+        st.info("⏳ Este MIA tiene cambios que todavía se están guardando en BigQuery (ya se muestran acá).")
 
     # Botonera
     c1, c2, c3 = st.columns([1, 1, 6])
@@ -793,7 +972,9 @@ elif modo == "Historial":
         try:
             if val is None or val == "":
                 return None
-            return pd.to_datetime(val).to_pydatetime()
+            if isinstance(val, datetime):
+                return val
+            return datetime.fromisoformat(str(val))
         except Exception:
             return None
 
@@ -1234,15 +1415,32 @@ elif modo == "Historial":
     # ---------------------------------------------------
     st.subheader("📸 Fotos asociadas")
 
+    # En edición no se muestran las DESPUÉS: no se bajan
+    fotos = materializar_fotos(
+        [f for f in fotos if f.tipo == "ANTES" or (not editando and f.tipo == "DESPUES")]
+    )
+
+    if fotos.omitidas:
+        st.warning(
+            f"⚠️ {len(fotos.omitidas)} foto(s) no se pudieron cargar "
+            "(no existen en el bucket o tardaron demasiado). Recargá para reintentar."
+        )
+
     fotos_antes = [f for f in fotos if f["tipo"] == "ANTES"]
     fotos_despues = [f for f in fotos if f["tipo"] == "DESPUES"]
 
     # 1) Fotos actuales ANTES (siempre se ven)
-    if fotos_antes:
+    if fotos_antes and editando:
+        st.markdown("#### Fotos del incidente (ANTES)")
+        cols_thumb = st.columns(4)
+        for i, f in enumerate(fotos_antes):
+            with cols_thumb[i % 4]:
+                _mostrar_foto(f, caption=str(f["fecha_hora"]), width=FOTO_THUMB_PX)
+    elif fotos_antes:
         st.markdown("#### Fotos del incidente (ANTES)")
         for f in fotos_antes:
             st.markdown(f"**{f['fecha_hora']}**")
-            st.image(f["data"], use_container_width=True)
+            _mostrar_foto(f)
     else:
         st.info("No hay fotos ANTES cargadas.")
 
@@ -1263,17 +1461,13 @@ elif modo == "Historial":
                 if not nuevas_fotos_antes:
                     st.warning("No seleccionaste fotos.")
                 else:
-                    codigo = getattr(detalle, "codigo_mie", None)
-                    if not codigo:
-                        st.error("No se encontró código de MIA para armar la ruta en el bucket.")
-                    else:
-                        reemplazar_fotos_antes(
-                            mie_id=mie_id,
-                            codigo_mie=codigo,
-                            archivos=nuevas_fotos_antes
-                        )
-                        st.success("✅ Fotos ANTES reemplazadas.")
-                        st.rerun()
+                    reemplazar_fotos_antes(
+                        mie_id=mie_id,
+                        archivos=nuevas_fotos_antes,
+                        progreso=_barra_progreso_fotos(),
+                    )
+                    st.success("✅ Fotos ANTES reemplazadas.")
+                    st.rerun()
             except Exception as e:
                 st.error(f"❌ Error reemplazando fotos ANTES: {e}")
 
@@ -1284,7 +1478,7 @@ elif modo == "Historial":
             st.markdown("#### Fotos de remediación (DESPUÉS)")
             for f in fotos_despues:
                 st.markdown(f"**{f['fecha_hora']}**")
-                st.image(f["data"], use_container_width=True)
+                _mostrar_foto(f)
 
     # ---------------------------------------------------
     # BLOQUE DE REMEDIACIÓN (NO SE TOCA EN EDICIÓN)
@@ -1319,11 +1513,22 @@ elif modo == "Historial":
 
             st.subheader("📄 Generar PDF de este MIA")
 
-            try:
-                pdf_bytes_hist = generar_mie_pdf(detalle, fotos)
-            except Exception as e:
-                st.error(f"⚠️ Error generando PDF: {e}")
-            else:
+            # Se arma solo a pedido: bajar todas las fotos en cada rerun no tiene sentido
+            clave_pdf = f"pdf_hist_{mie_id}"
+            if st.button("🧾 Generar PDF", key=f"btn_pdf_hist_{mie_id}"):
+                try:
+                    from mie_pdf_email import generar_mie_pdf
+
+                    # Bytes siempre (el PDF no puede usar URLs firmadas), en paralelo y con plazo
+                    fotos_pdf = materializar_fotos(fotos, usar_url=False)
+                    st.session_state[clave_pdf] = generar_mie_pdf(
+                        obtener_mie_detalle(mie_id, COLUMNAS_PDF), fotos_pdf
+                    )
+                except Exception as e:
+                    st.error(f"⚠️ Error generando PDF: {e}")
+
+            pdf_bytes_hist = st.session_state.get(clave_pdf)
+            if pdf_bytes_hist is not None:
                 nombre_inst = (
                     getattr(detalle, "nombre_instalacion", None)
                     or detalle.pozo
@@ -1412,14 +1617,12 @@ elif modo == "Historial":
                     )
 
                     if fotos_despues_up:
-                        codigo = detalle.codigo_mie
-                        for archivo in fotos_despues_up:
-                            nombre_destino = (
-                                f"{codigo}/DESPUES/"
-                                f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{archivo.name}"
-                            )
-                            blob_name = subir_foto_a_bucket(archivo, nombre_destino)
-                            insertar_foto(mie_id, "DESPUES", blob_name)
+                        registrar_fotos(
+                            mie_id,
+                            "DESPUES",
+                            fotos_despues_up,
+                            progreso=_barra_progreso_fotos(),
+                        )
 
                     st.success("MIA cerrado exitosamente.")
                     st.rerun()
@@ -1431,15 +1634,17 @@ elif modo == "Historial":
 #  MODO 2.5 - ESTADISTICAS
 # =======================================================
 elif modo == "Estadísticas":
+    import pandas as pd
+    from mie_snapshot import obtener_snapshot_eventos
+
     st.header("Estadísticas de MIA")
 
-    registros = obtener_todos_mie()
-    if not registros:
+    # Snapshot local sincronizado por cambios (no relee toda la tabla en cada visita)
+    df = obtener_snapshot_eventos(COLUMNAS_ESTADISTICAS)
+    if df.empty:
         st.info("No hay MIA registrados para generar estadísticas.")
         st.stop()
 
-    df = pd.DataFrame([dict(r) for r in registros])
-
     for col in ["fecha_hora_evento", "fecha_creacion_registro", "rem_fecha_fin_saneamiento"]:
         if col in df.columns:
             df[col] = pd.to_datetime(df[col], errors="coerce", utc=True).dt.tz_localize(None)
@@ -1591,7 +1796,7 @@ elif modo == "Estadísticas":
 
     st.subheader("Distribución de MIA por Yacimiento")
     if "yacimiento" in df_filt.columns:
-        df_yac = df_filt.groupby("yacimiento").size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
+        df_yac = df_filt.groupby("yacimiento", observed=True).size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
         if not df_yac.empty:
             fig_yac = px.bar(df_yac, x="cantidad", y="yacimiento", orientation="h",
                              title="MIA por Yacimiento",
@@ -1605,7 +1810,7 @@ elif modo == "Estadísticas":
 
     st.subheader("Distribución de MIA por Tipo de Instalación")
     if "tipo_instalacion" in df_filt.columns:
-        df_inst = df_filt.groupby("tipo_instalacion").size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
+        df_inst = df_filt.groupby("tipo_instalacion", observed=True).size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
         if not df_inst.empty:
             fig_inst = px.bar(df_inst, x="tipo_instalacion", y="cantidad",
                               title="MIA por Tipo de Instalación",
@@ -1619,7 +1824,7 @@ elif modo == "Estadísticas":
 
     st.subheader("Distribución de MIA por Causa Inmediata")
     if "causa_inmediata" in df_filt.columns:
-        df_causa = df_filt.groupby("causa_inmediata").size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
+        df_causa = df_filt.groupby("causa_inmediata", observed=True).size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
         if not df_causa.empty:
             fig_causa = px.bar(df_causa, x="causa_inmediata", y="cantidad",
                                title="MIA por Causa Inmediata",
@@ -1633,7 +1838,7 @@ elif modo == "Estadísticas":
 
     st.subheader("Distribución de MIA por Tipo de Afectación")
     if "tipo_afectacion" in df_filt.columns:
-        df_afec = df_filt.groupby("tipo_afectacion").size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
+        df_afec = df_filt.groupby("tipo_afectacion", observed=True).size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
         if not df_afec.empty:
             fig_afec = px.bar(df_afec, x="tipo_afectacion", y="cantidad",
                               title="MIA por Tipo de Afectación",
@@ -1647,7 +1852,7 @@ elif modo == "Estadísticas":
 
     st.subheader("Distribución de MIA por Tipo de Derrame")
     if "tipo_derrame" in df_filt.columns:
-        df_der = df_filt.groupby("tipo_derrame").size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
+        df_der = df_filt.groupby("tipo_derrame", observed=True).size().reset_index(name="cantidad").sort_values("cantidad", ascending=False)
         if not df_der.empty:
             fig_der = px.bar(df_der, x="tipo_derrame", y="cantidad",
                              title="MIA por Tipo de Derrame",
@@ -1663,6 +1868,9 @@ elif modo == "Estadísticas":
 #  MODO 3 - EXPORTAR MIA A EXCEL
 # =======================================================
 elif modo == "Exportar MIA":
+    import pandas as pd
+    from mie_snapshot import obtener_snapshot_eventos, sincronizar as sincronizar_snapshot
+
     st.header("Exportar base completa de MIA")
 
     st.markdown("""
@@ -1672,14 +1880,13 @@ elif modo == "Exportar MIA":
 
     if st.button("Generar archivo Excel"):
         try:
-            registros = obtener_todos_mie()
+            # Export = dato al momento: se fuerza la sincronización del snapshot
+            sincronizar_snapshot(forzar=True)
+            df = obtener_snapshot_eventos(COLUMNAS_EXPORTAR)
 
-            if not registros:
+            if df.empty:
                 st.info("No existen registros de MIA para exportar.")
             else:
-                filas = [dict(r) for r in registros]
-                df = pd.DataFrame(filas)
-
                 for col in df.columns:
                     if pd.api.types.is_datetime64_any_dtype(df[col]):
                         df[col] = pd.to_datetime(df[col], utc=True).dt.tz_localize(None)
@@ -1,4 +1,93 @@
+import os
+
 PROJECT_ID = "eventos-479403"          # tu proyecto de Google Cloud
 DATASET_ID = "mie_db"                  # dataset donde guardaremos las tablas
 REGION = "southamerica-east1"          # región recomendada
 BUCKET_NAME = "mie-fotos-ypf-luciano"     # bucket para guardar fotos
+
+# Almacenamiento del backend: "gcp" (BigQuery + GCS) o "local" (SQLite + carpeta,
+# para desarrollo / benchmarks sin credenciales)
+ALMACENAMIENTO = os.environ.get("MIE_ALMACENAMIENTO", "gcp")
+LOCAL_DIR = os.environ.get("MIE_LOCAL_DIR", "./mie_local")
+
+# Cache de lecturas de BigQuery (compartido por todas las sesiones del proceso)
+CACHE_TTL_SEGUNDOS = 300               # vida máxima de cada entrada
+CACHE_MAX_ENTRADAS = 512               # tope de entradas (se descarta la menos usada)
+
+# Historial: MIA por página del selector (paginado por cursor)
+LISTADO_TAMANO_PAGINA = 50
+
+# Reserva de IDs (tabla mie_secuencias): cuántos IDs se reservan por consulta
+IDS_BLOQUE_EVENTOS = 10
+IDS_BLOQUE_FOTOS = 50
+# codigo_mie también va por bloques (una transacción cada N altas, no una por
+# alta). Costo: un bloque que la instancia no llega a usar deja un hueco en la
+# numeración y, con varias instancias, los números no siguen el orden de alta.
+IDS_BLOQUE_CODIGOS = 5
+
+# Subida de fotos a GCS
+SUBIDA_WORKERS = 4                     # subidas simultáneas (por proceso)
+SUBIDA_REINTENTOS = 3                  # intentos por archivo (backoff exponencial)
+SUBIDA_CHUNK_MB = 8                    # chunk de las subidas reanudables (memoria por subida)
+
+# Descarga de fotos desde GCS
+DESCARGA_WORKERS = 8                   # descargas simultáneas (por proceso)
+DESCARGA_PLAZO_SEG = 8                 # plazo total para traer las fotos de un MIA
+DESCARGA_TIMEOUT_BLOB_SEG = 5          # timeout de cada descarga individual
+
+# Renditions de fotos (lado mayor en px)
+FOTO_THUMB_PX = 320
+FOTO_MEDIUM_PX = 1280
+FOTO_CALIDAD_JPEG = 82
+
+# Ingesta: cada foto se orienta (EXIF), se limita a FOTO_MAX_PX de lado mayor
+# y se recomprime antes de subirla. El archivo recibido solo se guarda
+# (blob <foto>__original) si MIE_FOTO_GUARDAR_ORIGINAL=1.
+FOTO_MAX_PX = 2560
+FOTO_CALIDAD_PRINCIPAL = 85
+FOTO_GUARDAR_ORIGINAL = os.environ.get("MIE_FOTO_GUARDAR_ORIGINAL", "0") == "1"
+
+# Cache local (disco) de fotos descargadas de GCS.
+# En Cloud Run el disco es memoria: el tope cuenta contra el límite de la instancia.
+FOTOS_CACHE_DIR = os.environ.get("MIE_FOTOS_CACHE_DIR", "/tmp/mie_fotos_cache")
+FOTOS_CACHE_MAX_MB = int(os.environ.get("MIE_FOTOS_CACHE_MAX_MB", "256"))
+
+# Fotos al navegador: con MIE_FOTOS_URL_FIRMADAS=1 el historial muestra <img>
+# con URLs firmadas (V4) que el navegador baja directo de GCS, sin pasar los
+# bytes por la instancia. Requiere poder firmar: clave de service account o
+# permiso iam.serviceAccounts.signBlob sobre la propia cuenta (Cloud Run).
+# Con STORAGE_EMULATOR_HOST se arma la URL del emulador, sin firma.
+FOTOS_URL_FIRMADAS = os.environ.get("MIE_FOTOS_URL_FIRMADAS", "0") == "1"
+FOTOS_URL_VIGENCIA_SEG = 3600          # vigencia de cada URL firmada
+# Cache-Control de los blobs: los nombres son por contenido (nunca cambian)
+FOTOS_CACHE_CONTROL = "private, max-age=604800, immutable"
+# Un blob sin filas que lo referencien se borra recién si nadie lo subió ni
+# lo reusó en este lapso: una subida en curso (que encontró el blob y todavía
+# no insertó sus filas) no pierde la foto.
+FOTOS_BORRADO_GRACIA_SEG = 3600
+# Cada cuánto (como mucho, por instancia) se recorre el almacén buscando fotos
+# sin referencias para borrar. Cada pasada lista todos los blobs de fotos/.
+FOTOS_BARRIDO_INTERVALO_SEG = 3600
+
+# Snapshot local (Parquet) de mie_eventos para Estadísticas / Exportar.
+# Se sincroniza de forma incremental por fecha_modificacion.
+SNAPSHOT_DIR = os.environ.get("MIE_SNAPSHOT_DIR", "/tmp/mie_snapshot")
+SNAPSHOT_INTERVALO_SEG = 60            # no consultar cambios más seguido que esto
+SNAPSHOT_SOLAPAMIENTO_SEG = 300        # margen hacia atrás de la marca (relojes / escrituras en curso)
+SNAPSHOT_RECONCILIAR_SEG = 3600        # cada cuánto se comparan los mie_id con BigQuery (filas borradas)
+
+# Escrituras diferidas (write-behind): insertar / editar / cerrar un MIA se
+# anotan en un journal SQLite local y vuelven enseguida; un hilo las aplica
+# en BigQuery con reintentos. El journal sobrevive a errores de BigQuery y a
+# reinicios del proceso, no a que se borre el disco. Apagado por defecto:
+# activarlo (MIE_JOURNAL=1) solo con JOURNAL_DIR en un disco que dure más que
+# la instancia y CPU entre requests. En Cloud Run /tmp es memoria de la
+# instancia y la CPU se quita entre requests: lo pendiente se puede perder.
+JOURNAL_ACTIVO = os.environ.get("MIE_JOURNAL", "0") == "1"
+JOURNAL_DIR = os.environ.get("MIE_JOURNAL_DIR", "/tmp/mie_journal")
+JOURNAL_REINTENTO_MAX_SEG = 60         # tope del backoff entre reintentos
+JOURNAL_MAX_INTENTOS = 10              # después, la entrada pasa a FALLIDA (se reintenta a mano)
+JOURNAL_RETENER_SEG = 24 * 3600        # cuánto se guardan las entradas ya confirmadas
+
+# Diagnóstico de consultas (panel lateral + log "mie.consultas")
+DIAG_MAX_REGISTROS = 500               # registros que se guardan en memoria
@@ -1,11 +1,184 @@
 # crear_tablas.py
+import sys
+from datetime import datetime
+
 from google.cloud import bigquery
+
 from config import PROJECT_ID, DATASET_ID, REGION
+from mie_repositorio import CODIGO_BASE_ANIO, SECUENCIA_CODIGO
 
 client = bigquery.Client(project=PROJECT_ID)
 
 
-def crear_dataset_y_tablas():
+def agregar_columnas_faltantes(tabla_ref, campos):
+    """Agrega al schema de una tabla existente las columnas que no tenga."""
+    tabla = client.get_table(tabla_ref)
+    existentes = {f.name for f in tabla.schema}
+    nuevas = [c for c in campos if c.name not in existentes]
+    if not nuevas:
+        return
+    tabla.schema = list(tabla.schema) + nuevas
+    client.update_table(tabla, ["schema"])
+    print(f"✅ Columnas agregadas a {tabla_ref}: {', '.join(c.name for c in nuevas)}")
+
+
+# Layout físico: mie_eventos particionada por mes del evento y clusterizada
+# por los filtros habituales; mie_fotos clusterizada por mie_id (todas las
+# lecturas son "fotos de un MIA").
+PARTICION_EVENTOS = bigquery.TimePartitioning(
+    type_=bigquery.TimePartitioningType.MONTH,
+    field="fecha_hora_evento",
+)
+CLUSTER_EVENTOS = ["yacimiento", "zona", "estado", "mie_id"]
+CLUSTER_FOTOS = ["mie_id"]
+
+
+def _misma_particion(tabla, particion) -> bool:
+    actual = tabla.time_partitioning
+    if particion is None:
+        return actual is None
+    return (
+        actual is not None
+        and actual.type_ == particion.type_
+        and actual.field == particion.field
+    )
+
+
+def _mismo_layout(tabla, particion, clustering) -> bool:
+    return (
+        _misma_particion(tabla, particion)
+        and list(tabla.clustering_fields or []) == list(clustering or [])
+    )
+
+
+def sembrar_secuencias(dataset_ref):
+    """
+    Crea las filas de mie_secuencias que falten, arrancando en el máximo
+    actual de cada tabla. Se hace acá (una vez, sin concurrencia) y no en el
+    primer uso: sin claves únicas, dos instancias sembrando la misma fila a
+    la vez entregaban el mismo bloque.
+    """
+    year = datetime.now().year
+    query = f"""
+        MERGE `{dataset_ref}.mie_secuencias` T
+        USING (
+            SELECT 'mie_eventos.mie_id' AS nombre,
+                   (SELECT COALESCE(MAX(mie_id), 0) FROM `{dataset_ref}.mie_eventos`) AS valor
+            UNION ALL
+            SELECT 'mie_fotos.id',
+                   (SELECT COALESCE(MAX(id), 0) FROM `{dataset_ref}.mie_fotos`)
+            UNION ALL
+            SELECT @secuencia_codigo,
+                   @year * @base + COALESCE((
+                       SELECT MAX(SAFE_CAST(SPLIT(codigo_mie, '-')[SAFE_OFFSET(2)] AS INT64))
+                       FROM `{dataset_ref}.mie_eventos`
+                       WHERE STARTS_WITH(codigo_mie, @prefijo)
+                   ), 0)
+        ) S
+        ON T.nombre = S.nombre
+        WHEN NOT MATCHED THEN
+            INSERT (nombre, valor, actualizado) VALUES (S.nombre, S.valor, CURRENT_TIMESTAMP())
+    """
+    cfg = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("secuencia_codigo", "STRING", SECUENCIA_CODIGO),
+        bigquery.ScalarQueryParameter("year", "INT64", year),
+        bigquery.ScalarQueryParameter("base", "INT64", CODIGO_BASE_ANIO),
+        bigquery.ScalarQueryParameter("prefijo", "STRING", f"MIE-{year}-"),
+    ])
+    job = client.query(query, cfg)
+    job.result()
+    print(f"✅ Secuencias sembradas ({job.num_dml_affected_rows or 0} nuevas)")
+
+
+def _huella(tabla_ref):
+    """(filas, última modificación): cambia con cualquier escritura."""
+    n = list(client.query(f"SELECT COUNT(*) AS n FROM `{tabla_ref}`").result())[0].n
+    return n, client.get_table(tabla_ref).modified
+
+
+def migrar_layout(tabla_ref, particion, clustering, app_detenida=False):
+    """
+    Lleva una tabla existente a la partición / clustering pedidos,
+    reescribiendo los datos: BigQuery no permite cambiar la partición de
+    una tabla existente y un cambio de clustering solo afectaría a los
+    datos nuevos.
+
+    Solo corre con la app detenida (`app_detenida`, ver --app-detenida):
+    una escritura durante la copia se perdería. Si igual cambió algo entre
+    la copia y el cambio de tabla, no se toca nada. La tabla anterior queda
+    como respaldo (<tabla>__respaldo_<fecha>), no se borra.
+    - Misma partición (cambia el clustering): CREATE OR REPLACE sobre la
+      misma tabla, que BigQuery reemplaza de forma atómica.
+    - Otra partición: BigQuery no deja reemplazar una tabla con otra
+      partición. Se copia a una tabla nueva, la actual pasa a ser el
+      respaldo (RENAME) y la nueva toma su nombre.
+    """
+    tabla = client.get_table(tabla_ref)
+    if _mismo_layout(tabla, particion, clustering):
+        return
+    if not app_detenida:
+        raise SystemExit(
+            f"❌ {tabla_ref} necesita reescribirse para cambiar partición / clustering. "
+            "Detener la app (sin escrituras) y correr: python crear_tablas.py --app-detenida"
+        )
+
+    nombre = tabla_ref.split(".")[-1]
+    respaldo_ref = f"{tabla_ref}__respaldo_{datetime.now():%Y%m%d_%H%M%S}"
+    opciones = []
+    if particion is not None:
+        unidad = {
+            bigquery.TimePartitioningType.DAY: "DAY",
+            bigquery.TimePartitioningType.MONTH: "MONTH",
+            bigquery.TimePartitioningType.YEAR: "YEAR",
+        }[particion.type_]
+        opciones.append(f"PARTITION BY TIMESTAMP_TRUNC({particion.field}, {unidad})")
+    if clustering:
+        opciones.append(f"CLUSTER BY {', '.join(clustering)}")
+
+    antes = _huella(tabla_ref)
+    print(f"⏳ Migrando {tabla_ref} ({antes[0]} filas)...")
+
+    def verificar_sin_cambios():
+        if _huella(tabla_ref) != antes:
+            raise RuntimeError(
+                f"{tabla_ref} cambió durante la migración: hubo escrituras. "
+                "No se migró; detener la app y reintentar."
+            )
+
+    if _misma_particion(tabla, particion):
+        client.copy_table(tabla_ref, respaldo_ref).result()
+        verificar_sin_cambios()
+        client.query(f"""
+            CREATE OR REPLACE TABLE `{tabla_ref}`
+            {' '.join(opciones)}
+            AS SELECT * FROM `{tabla_ref}`
+        """).result()
+    else:
+        tmp_ref = f"{tabla_ref}__migracion"
+        client.query(f"""
+            CREATE OR REPLACE TABLE `{tmp_ref}`
+            {' '.join(opciones)}
+            AS SELECT * FROM `{tabla_ref}`
+        """).result()
+        try:
+            verificar_sin_cambios()
+        except RuntimeError:
+            client.delete_table(tmp_ref)
+            raise
+        try:
+            client.query(f"""
+                ALTER TABLE `{tabla_ref}` RENAME TO `{respaldo_ref.split(".")[-1]}`;
+                ALTER TABLE `{tmp_ref}` RENAME TO `{nombre}`;
+            """).result()
+        except Exception as e:
+            raise RuntimeError(
+                f"Falló el cambio de nombre. Si {tabla_ref} no existe, renombrar a mano "
+                f"{tmp_ref} -> {nombre}; los datos anteriores están en {tabla_ref} o {respaldo_ref}."
+            ) from e
+    print(f"✅ {tabla_ref} particionada / clusterizada (respaldo: {respaldo_ref})")
+
+
+def crear_dataset_y_tablas(app_detenida=False):
     dataset_ref = f"{PROJECT_ID}.{DATASET_ID}"
 
     # 1) Dataset
@@ -20,6 +193,27 @@ def crear_dataset_y_tablas():
 
     # 2) Tabla mie_eventos (eventos de derrame)
     tabla_eventos_ref = f"{dataset_ref}.mie_eventos"
+
+    # Cierre / remediación (los escribe cerrar_mie_con_remediacion)
+    campos_remediacion = [
+        bigquery.SchemaField("rem_fecha_fin_saneamiento", "TIMESTAMP"),
+        bigquery.SchemaField("rem_volumen_tierra_levantada", "FLOAT64"),
+        bigquery.SchemaField("rem_destino_tierra_impactada", "STRING"),
+        bigquery.SchemaField("rem_volumen_liquido_recuperado", "FLOAT64"),
+        bigquery.SchemaField("rem_comentarios", "STRING"),
+        bigquery.SchemaField("rem_aprobador_apellido", "STRING"),
+        bigquery.SchemaField("rem_aprobador_nombre", "STRING"),
+        bigquery.SchemaField("rem_fecha", "TIMESTAMP"),
+        bigquery.SchemaField("rem_responsable", "STRING"),
+        bigquery.SchemaField("rem_detalle", "STRING"),
+    ]
+
+    # Última escritura del registro (sincronización incremental, ver mie_snapshot)
+    campos_modificacion = [
+        bigquery.SchemaField("fecha_modificacion", "TIMESTAMP"),
+        # Huella del formulario de alta (insertar_mie idempotente)
+        bigquery.SchemaField("clave_idempotencia", "STRING"),
+    ]
     try:
         client.get_table(tabla_eventos_ref)
         print("✅ Tabla mie_eventos ya existe")
@@ -87,13 +281,31 @@ def crear_dataset_y_tablas():
             bigquery.SchemaField("aprobador_apellido", "STRING"),
             bigquery.SchemaField("aprobador_nombre", "STRING"),
             bigquery.SchemaField("fecha_hora_aprobacion", "TIMESTAMP"),
-        ]
+        ] + campos_remediacion + campos_modificacion
         tabla_eventos = bigquery.Table(tabla_eventos_ref, schema=schema_eventos)
+        tabla_eventos.time_partitioning = PARTICION_EVENTOS
+        tabla_eventos.clustering_fields = CLUSTER_EVENTOS
         client.create_table(tabla_eventos)
         print("✅ Tabla mie_eventos creada")
 
-    # 3) Tabla mie_fotos (igual que antes)
+    # Migración: tablas creadas antes de la remediación / fecha_modificacion /
+    # clave_idempotencia y sin particionar
+    agregar_columnas_faltantes(tabla_eventos_ref, campos_remediacion + campos_modificacion)
+    migrar_layout(tabla_eventos_ref, PARTICION_EVENTOS, CLUSTER_EVENTOS, app_detenida)
+
+    # 3) Tabla mie_fotos
     tabla_fotos_ref = f"{dataset_ref}.mie_fotos"
+
+    # Renditions (blobs hermanos más chicos del original) y archivo original
+    # tal cual se recibió (solo con MIE_FOTO_GUARDAR_ORIGINAL)
+    campos_renditions = [
+        bigquery.SchemaField("url_thumb", "STRING"),
+        bigquery.SchemaField("url_medium", "STRING"),
+        bigquery.SchemaField("url_original", "STRING"),
+        # Nombre por contenido: url_foto = fotos/<hh>/<hash_contenido>
+        bigquery.SchemaField("hash_contenido", "STRING"),
+    ]
+
     try:
         client.get_table(tabla_fotos_ref)
         print("✅ Tabla mie_fotos ya existe")
@@ -104,13 +316,36 @@ def crear_dataset_y_tablas():
             bigquery.SchemaField("tipo", "STRING"),
             bigquery.SchemaField("url_foto", "STRING"),
             bigquery.SchemaField("fecha_hora", "TIMESTAMP"),
-        ]
+        ] + campos_renditions
         tabla_fotos = bigquery.Table(tabla_fotos_ref, schema=schema_fotos)
+        tabla_fotos.clustering_fields = CLUSTER_FOTOS
         client.create_table(tabla_fotos)
         print("✅ Tabla mie_fotos creada")
 
+    # Migración: tablas creadas antes de las renditions / sin clustering
+    agregar_columnas_faltantes(tabla_fotos_ref, campos_renditions)
+    migrar_layout(tabla_fotos_ref, None, CLUSTER_FOTOS, app_detenida)
+
+    # 4) Tabla mie_secuencias (reserva de IDs / códigos por bloques)
+    tabla_secuencias_ref = f"{dataset_ref}.mie_secuencias"
+    try:
+        client.get_table(tabla_secuencias_ref)
+        print("✅ Tabla mie_secuencias ya existe")
+    except Exception:
+        schema_secuencias = [
+            bigquery.SchemaField("nombre", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("valor", "INT64", mode="REQUIRED"),
+            bigquery.SchemaField("actualizado", "TIMESTAMP"),
+        ]
+        tabla_secuencias = bigquery.Table(tabla_secuencias_ref, schema=schema_secuencias)
+        client.create_table(tabla_secuencias)
+        print("✅ Tabla mie_secuencias creada")
+
+    sembrar_secuencias(dataset_ref)
+
 
 if __name__ == "__main__":
-    crear_dataset_y_tablas()
+    # --app-detenida: habilita reescribir tablas existentes (ver migrar_layout)
+    crear_dataset_y_tablas(app_detenida="--app-detenida" in sys.argv[1:])
 
 
@@ -2,181 +2,1028 @@
 # mie_backend.py — backend oficial MIA / MIE
 # ============================================================
 
-from datetime import datetime
+import contextlib
+import functools
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
-from google.cloud import bigquery, storage
-from config import PROJECT_ID, DATASET_ID, BUCKET_NAME
-from google.api_core.exceptions import NotFound
+from config import (
+    CACHE_TTL_SEGUNDOS,
+    CACHE_MAX_ENTRADAS,
+    IDS_BLOQUE_EVENTOS,
+    IDS_BLOQUE_FOTOS,
+    IDS_BLOQUE_CODIGOS,
+    SUBIDA_WORKERS,
+    SUBIDA_REINTENTOS,
+    DESCARGA_WORKERS,
+    DESCARGA_PLAZO_SEG,
+    DESCARGA_TIMEOUT_BLOB_SEG,
+    FOTO_THUMB_PX,
+    FOTO_MEDIUM_PX,
+    FOTO_CALIDAD_JPEG,
+    FOTO_MAX_PX,
+    FOTO_CALIDAD_PRINCIPAL,
+    FOTO_GUARDAR_ORIGINAL,
+    FOTOS_CACHE_DIR,
+    FOTOS_CACHE_MAX_MB,
+    FOTOS_URL_FIRMADAS,
+    FOTOS_URL_VIGENCIA_SEG,
+    FOTOS_BORRADO_GRACIA_SEG,
+    FOTOS_BARRIDO_INTERVALO_SEG,
+    LISTADO_TAMANO_PAGINA,
+    JOURNAL_ACTIVO,
+)
+import mie_journal
+from mie_diagnostico import con_sitio
+from mie_repositorio import (
+    CODIGO_BASE_ANIO,
+    COLUMNAS_EVENTOS,
+    SECUENCIA_CODIGO,
+    BlobNoEncontrado,
+    Fila,
+    crear_almacenamiento,
+    formato_codigo,
+)
 # ---------------------------------------------------------
-# Clientes globales
+# Almacenamiento (BigQuery + GCS o local, ver mie_repositorio)
 # ---------------------------------------------------------
-bq_client = bigquery.Client(project=PROJECT_ID)
-storage_client = storage.Client(project=PROJECT_ID)
+# Perezosos: los clientes se crean con la primera consulta, no al importar
+_repo, _almacen = crear_almacenamiento()
 
 # ---------------------------------------------------------
-# Utils
+# Cache de lecturas (TTL + LRU, compartido entre sesiones)
 # ---------------------------------------------------------
-def obtener_siguiente_id(tabla: str, campo: str) -> int:
-    query = f"""
-        SELECT MAX({campo}) AS max_id
-        FROM `{PROJECT_ID}.{DATASET_ID}.{tabla}`
+# Streamlit re-ejecuta el script en cada click: sin esto, cada rerun
+# dispara de nuevo las mismas consultas a BigQuery.
+# Clave: (grupo, args, kwargs). Las escrituras invalidan por grupo / mie_id.
+_cache_lock = threading.Lock()
+_cache = OrderedDict()   # clave -> (expira_en, valor)
+
+
+def _cache_leer(clave):
+    with _cache_lock:
+        item = _cache.get(clave)
+        if item is None:
+            return False, None
+        expira_en, valor = item
+        if expira_en < time.monotonic():
+            del _cache[clave]
+            return False, None
+        _cache.move_to_end(clave)
+        return True, valor
+
+
+def _cache_guardar(clave, valor):
+    with _cache_lock:
+        _cache[clave] = (time.monotonic() + CACHE_TTL_SEGUNDOS, valor)
+        _cache.move_to_end(clave)
+        while len(_cache) > CACHE_MAX_ENTRADAS:
+            _cache.popitem(last=False)
+
+
+def invalidar_cache(grupo=None, mie_id=None):
+    """
+    Borra entradas del cache.
+    - sin argumentos: todo
+    - grupo: solo ese grupo (nombre de la función)
+    - grupo + mie_id: solo las entradas de ese MIA dentro del grupo
     """
-    rows = list(bq_client.query(query).result())
-    if not rows or rows[0].max_id is None:
-        return 1
-    return rows[0].max_id + 1
+    with _cache_lock:
+        for clave in list(_cache):
+            g, args, _ = clave
+            if grupo is not None and g != grupo:
+                continue
+            if mie_id is not None and (not args or args[0] != mie_id):
+                continue
+            del _cache[clave]
+
+
+def _cacheado(fn):
+    """Read-through: devuelve lo cacheado o consulta y guarda."""
+    grupo = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        clave = (grupo, args, tuple(sorted(kwargs.items())))
+        encontrado, valor = _cache_leer(clave)
+        if encontrado:
+            return list(valor) if isinstance(valor, list) else valor
+        valor = fn(*args, **kwargs)
+        _cache_guardar(clave, valor)
+        return list(valor) if isinstance(valor, list) else valor
+
+    return wrapper
+
+
+# ---------------------------------------------------------
+# IDs: reserva por bloques (tabla mie_secuencias)
+# ---------------------------------------------------------
+# En vez de SELECT MAX(...) sobre toda la tabla en cada insert, cada
+# secuencia es una fila de mie_secuencias. El repositorio reserva un bloque
+# de forma atómica y los IDs se entregan desde memoria.
+# Las secuencias arrancan en el máximo actual (las siembra crear_tablas.py;
+# el backend local, en el primer uso), así los IDs siguen a los existentes.
+class _Secuencia:
+    def __init__(self, nombre: str, semilla: tuple, bloque: int, piso: int = 0):
+        self.nombre = nombre
+        self.semilla = semilla
+        self.bloque = bloque
+        self.piso = piso
+        self._libres = deque()
+        self._lock = threading.Lock()
+
+    def siguientes(self, cantidad: int = 1) -> list:
+        with self._lock:
+            faltan = cantidad - len(self._libres)
+            if faltan > 0:
+                n = max(self.bloque, faltan)
+                fin = _repo.reservar_bloque(self.nombre, n, self.semilla, self.piso)
+                self._libres.extend(range(fin - n + 1, fin + 1))
+            return [self._libres.popleft() for _ in range(cantidad)]
+
+    def siguiente(self) -> int:
+        return self.siguientes(1)[0]
+
+
+_secuencias = {
+    ("mie_eventos", "mie_id"): _Secuencia(
+        "mie_eventos.mie_id", ("max", "mie_eventos", "mie_id"), IDS_BLOQUE_EVENTOS
+    ),
+    ("mie_fotos", "id"): _Secuencia(
+        "mie_fotos.id", ("max", "mie_fotos", "id"), IDS_BLOQUE_FOTOS
+    ),
+}
+_secuencias_lock = threading.Lock()
+
+
+def _secuencia_codigo(year: int) -> _Secuencia:
+    # Contador de codigo_mie con el piso del año (ver SECUENCIA_CODIGO), por
+    # bloques como los IDs (ver IDS_BLOQUE_CODIGOS: huecos posibles)
+    clave = (SECUENCIA_CODIGO, year)
+    with _secuencias_lock:
+        if clave not in _secuencias:
+            _secuencias[clave] = _Secuencia(
+                SECUENCIA_CODIGO, ("codigo", year), IDS_BLOQUE_CODIGOS, piso=year * CODIGO_BASE_ANIO
+            )
+        return _secuencias[clave]
+
+
+def obtener_siguiente_id(tabla: str, campo: str) -> int:
+    return _secuencias[(tabla, campo)].siguiente()
 
 
-def generar_codigo_mie(num: int) -> str:
+def generar_codigo_mie() -> str:
     year = datetime.now().year
-    return f"MIE-{year}-{num:04d}"
+    return formato_codigo(year, _secuencia_codigo(year).siguiente() - year * CODIGO_BASE_ANIO)
 
 
 # ---------------------------------------------------------
 # Bucket / Fotos
 # ---------------------------------------------------------
-def subir_foto_a_bucket(file_obj, nombre_destino: str) -> str:
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(nombre_destino)
+# Renditions: versiones chicas de cada foto, guardadas como blobs hermanos
+# (<original>__thumb.jpg / <original>__medium.jpg). (nombre, lado mayor en px)
+RENDITIONS = (
+    ("thumb", FOTO_THUMB_PX),
+    ("medium", FOTO_MEDIUM_PX),
+)
 
-    data = file_obj.read()
-    blob.upload_from_file(BytesIO(data), content_type=file_obj.type)
 
-    return nombre_destino
+def _a_jpeg(img, lado: int, calidad: int) -> bytes:
+    from PIL import Image
 
+    copia = img.copy()
+    copia.thumbnail((lado, lado), Image.LANCZOS)
+    buffer = BytesIO()
+    copia.save(buffer, format="JPEG", quality=calidad, optimize=True)
+    return buffer.getvalue()
+
+
+def _preparar_foto(file_obj) -> dict:
+    """
+    Etapa de ingesta (corre en el worker de subida, no en el hilo de la UI):
+    orienta según EXIF, limita el lado mayor a FOTO_MAX_PX, recomprime a
+    JPEG y genera las renditions a partir de esa misma imagen decodificada.
+    Devuelve {"principal": bytes | None, "thumb": bytes, "medium": bytes}.
+    principal None = subir el archivo tal cual (no es una imagen, o ya era
+    un JPEG derecho y chico que recomprimido no achica).
+    """
+    # PIL solo hace falta al subir fotos: no se carga al arrancar
+    from PIL import Image, ImageOps
 
-def borrar_blob_bucket(blob_name: str):
-    if not blob_name:
-        return
-    bucket = storage_client.bucket(BUCKET_NAME)
-    blob = bucket.blob(blob_name)
     try:
-        blob.delete()
+        img = Image.open(file_obj)
+        formato = img.format
+        lado_original = max(img.size)
+        orientacion = img.getexif().get(0x0112, 1)
+        # JPEG: decodifica ya reducido (DCT), sin pasar por la resolución completa
+        img.draft("RGB", (FOTO_MAX_PX, FOTO_MAX_PX))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            # PNG con transparencia: fondo blanco (JPEG no tiene alfa)
+            fondo = Image.new("RGB", img.size, "white")
+            fondo.paste(img.convert("RGBA"), mask=img.convert("RGBA").getchannel("A"))
+            img = fondo
+        else:
+            img = img.convert("RGB")
     except Exception:
-        pass
+        return {"principal": None}
+
+    img.thumbnail((FOTO_MAX_PX, FOTO_MAX_PX), Image.LANCZOS)
+    principal = _a_jpeg(img, FOTO_MAX_PX, FOTO_CALIDAD_PRINCIPAL)
+
+    hay_que_cambiar = formato != "JPEG" or orientacion != 1 or lado_original > FOTO_MAX_PX
+    tamano_original = file_obj.seek(0, 2)
+    preparada = {
+        "principal": principal if hay_que_cambiar or len(principal) < tamano_original else None,
+    }
+    for nombre, lado in RENDITIONS:
+        if max(img.size) <= lado:
+            # La principal ya es chica: no tiene sentido otra copia
+            continue
+        preparada[nombre] = _a_jpeg(img, lado, FOTO_CALIDAD_JPEG)
+    return preparada
 
 
-def insertar_foto(mie_id: int, tipo: str, blob_name: str):
-    tabla = f"{PROJECT_ID}.{DATASET_ID}.mie_fotos"
-    foto_id = obtener_siguiente_id("mie_fotos", "id")
-    ahora = datetime.utcnow()
+def subir_foto_a_bucket(file_obj, nombre_destino: str) -> dict:
+    """
+    Normaliza la foto (ver _preparar_foto) y sube la versión principal y
+    sus renditions. Con FOTO_GUARDAR_ORIGINAL también sube el archivo tal
+    cual vino. Devuelve el dict de la foto (url_foto / url_thumb /
+    url_medium / url_original) listo para insertar_fotos.
+
+    La principal se sube al final y lleva en su metadata qué renditions
+    tiene: si existe, el juego completo existe (ver _foto_ya_subida).
+    """
+    preparada = _preparar_foto(file_obj)
+    foto = {"url_foto": nombre_destino, "url_thumb": None, "url_medium": None, "url_original": None}
+
+    for nombre, _ in RENDITIONS:
+        if preparada.get(nombre):
+            blob_name = _blob_rendition(nombre_destino, nombre)
+            _almacen.subir_bytes(blob_name, preparada[nombre], content_type="image/jpeg")
+            foto[f"url_{nombre}"] = blob_name
+
+    file_obj.seek(0)
+    tipo = getattr(file_obj, "type", None)
+    if preparada["principal"] is not None and FOTO_GUARDAR_ORIGINAL:
+        blob_name = _blob_rendition(nombre_destino, "original")
+        _almacen.subir(blob_name, file_obj, content_type=tipo)
+        foto["url_original"] = blob_name
+
+    metadata = {"renditions": ",".join(r for r in _RENDITIONS_BLOB if foto[f"url_{r}"])}
+    if preparada["principal"] is None:
+        # Se sube el archivo recibido, en streaming desde el mismo file_obj
+        _almacen.subir(nombre_destino, file_obj, content_type=tipo, metadata=metadata)
+    else:
+        _almacen.subir_bytes(
+            nombre_destino, preparada["principal"], content_type="image/jpeg", metadata=metadata,
+        )
 
-    row = [{
-        "id": foto_id,
-        "mie_id": mie_id,
-        "tipo": tipo,               # ANTES / DESPUES
-        "url_foto": blob_name,
-        "fecha_hora": ahora.isoformat(),
-    }]
+    return foto
 
-    errors = bq_client.insert_rows_json(tabla, row)
-    if errors:
-        raise RuntimeError(errors)
 
+# Blobs que acompañan a la principal (nombre: ver _blob_rendition)
+_RENDITIONS_BLOB = ("thumb", "medium", "original")
 
-def obtener_fotos_mie(mie_id: int):
-    query = f"""
-        SELECT tipo, url_foto, fecha_hora
-        FROM `{PROJECT_ID}.{DATASET_ID}.mie_fotos`
-        WHERE mie_id = @id
-        ORDER BY fecha_hora
+
+def _blob_rendition(nombre_destino: str, rendition: str) -> str:
+    if rendition == "original":
+        return f"{nombre_destino}__original"
+    return f"{nombre_destino}__{rendition}.jpg"
+
+
+def _foto_ya_subida(nombre_destino: str):
     """
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("id", "INT64", mie_id)]
-    )
+    Dict de la foto si `nombre_destino` ya está en el almacén (misma foto
+    subida antes, por este u otro MIA), None si hay que subirla. Una sola
+    llamada al almacén: marca la principal como usada (el barrido de fotos
+    sin referencias la respeta, y con ella a sus renditions) y trae de su
+    metadata qué renditions tiene.
+    """
+    metadata = _almacen.marcar_uso(nombre_destino)
+    if metadata is None or "renditions" not in metadata:
+        # No está, o se subió antes de que la principal listara sus
+        # renditions: se vuelve a subir (mismo nombre, se sobrescribe)
+        return None
+    foto = {"url_foto": nombre_destino, "url_thumb": None, "url_medium": None, "url_original": None}
+    for rendition in filter(None, metadata["renditions"].split(",")):
+        foto[f"url_{rendition}"] = _blob_rendition(nombre_destino, rendition)
+    return foto
+
+
+def hash_contenido(file_obj) -> str:
+    """SHA-256 (hex) del archivo, leído de a 1 MB. Deja el archivo al inicio."""
+    file_obj.seek(0)
+    h = hashlib.sha256()
+    for bloque in iter(lambda: file_obj.read(1024 * 1024), b""):
+        h.update(bloque)
+    file_obj.seek(0)
+    return h.hexdigest()
+
+
+def nombre_destino_foto(hash_hex: str) -> str:
+    """
+    Blob de una foto según su contenido: la misma imagen subida dos veces
+    (reintento, o en la creación y en el cierre) es el mismo objeto.
+    """
+    return f"{_PREFIJO_FOTOS}{hash_hex[:2]}/{hash_hex}"
 
-    rows = bq_client.query(query, cfg).result()
-    bucket = storage_client.bucket(BUCKET_NAME)
 
-    fotos = []
-    for r in rows:
-        if not r.url_foto:
-            continue
+_PREFIJO_FOTOS = "fotos/"
+
+
+# ---------------------------------------------------------
+# Subida concurrente (pool acotado + reintentos por archivo)
+# ---------------------------------------------------------
+# Un único pool para todo el proceso: acota la concurrencia total contra
+# GCS aunque haya varias sesiones guardando a la vez.
+_pool_subidas = ThreadPoolExecutor(max_workers=SUBIDA_WORKERS, thread_name_prefix="mie-subida")
 
-        blob = bucket.blob(r.url_foto)
 
+def _subir_con_reintentos(file_obj) -> dict:
+    # Hash, normalización y subida corren acá, en el worker
+    digest = hash_contenido(file_obj)
+    nombre_destino = nombre_destino_foto(digest)
+    espera = 0.5
+    for intento in range(SUBIDA_REINTENTOS):
         try:
-            data = blob.download_as_bytes()
-        except NotFound:
-            # El archivo no existe en el bucket (pero sí quedó registrado en BigQuery)
-            # Lo ignoramos para no romper la pantalla
-            continue
+            foto = _foto_ya_subida(nombre_destino)
+            if foto is None:
+                file_obj.seek(0)
+                foto = subir_foto_a_bucket(file_obj, nombre_destino)
+            foto["hash_contenido"] = digest
+            return foto
         except Exception:
-            # Cualquier otro error de descarga también se ignora
-            continue
+            if intento == SUBIDA_REINTENTOS - 1:
+                raise
+            time.sleep(espera + random.uniform(0, espera))
+            espera *= 2
+
+
+def subir_fotos_a_bucket(archivos, progreso=None) -> list:
+    """
+    Sube un lote de fotos en paralelo. Devuelve los dicts de cada foto
+    (ver subir_foto_a_bucket) en el mismo orden que `archivos`. Las fotos
+    que ya están en el almacén (mismo contenido) no se vuelven a subir.
+
+    `progreso(hechas, total, nombre)` se llama desde el hilo que invoca
+    (no desde los workers), así puede actualizar widgets de Streamlit.
+
+    Si alguna foto falla tras los reintentos se lanza RuntimeError: no
+    queda nada a medio registrar. Las que sí se subieron quedan sin
+    referencias y las borra un barrido posterior (ver
+    barrer_fotos_sin_referencias).
+    """
+    archivos = list(archivos or [])
+    if not archivos:
+        return []
 
-        fotos.append({
-            "tipo": r.tipo,
-            "fecha_hora": r.fecha_hora,
-            "data": data,
-        })
+    futuros = {
+        _pool_subidas.submit(_subir_con_reintentos, archivo): i
+        for i, archivo in enumerate(archivos)
+    }
 
-    return fotos
+    subidas = [None] * len(archivos)
+    errores = []
+    for hechas, fut in enumerate(as_completed(futuros), start=1):
+        i = futuros[fut]
+        try:
+            subidas[i] = fut.result()
+        except Exception as e:
+            errores.append(f"{archivos[i].name}: {e}")
+        if progreso:
+            progreso(hechas, len(archivos), archivos[i].name)
+
+    if errores:
+        _pool_borrados.submit(barrer_fotos_sin_referencias)
+        raise RuntimeError("No se pudieron subir las fotos: " + "; ".join(errores))
+
+    return subidas
+
+
+def registrar_fotos(mie_id: int, tipo: str, archivos, progreso=None) -> list:
+    """
+    Sube el lote y, solo si todo subió bien, lo registra en mie_fotos.
+    Repetirlo no duplica filas: una foto (mismo contenido) que el MIA ya
+    tiene con ese `tipo` no se vuelve a registrar (p. ej. el mismo
+    formulario reenviado, que insertar_mie resuelve al MIA existente).
+    """
+    subidas = subir_fotos_a_bucket(archivos, progreso)
+    ya_registradas = {f.url_foto for f in _repo.fotos_de_mie(mie_id, tipo)}
+    insertar_fotos(mie_id, tipo, [f for f in subidas if f["url_foto"] not in ya_registradas])
+    # Guardar fotos es lo habitual: de acá sale el barrido periódico
+    _pool_borrados.submit(barrer_fotos_sin_referencias)
+    return subidas
 
 
 # ---------------------------------------------------------
-# Fotos – REEMPLAZO (solo ANTES)
+# Barrido de fotos sin referencias
 # ---------------------------------------------------------
-def _obtener_fotos_meta(mie_id: int, tipo: str):
-    query = f"""
-        SELECT id, url_foto
-        FROM `{PROJECT_ID}.{DATASET_ID}.mie_fotos`
-        WHERE mie_id = @id AND tipo = @tipo
-    """
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("id", "INT64", mie_id),
-            bigquery.ScalarQueryParameter("tipo", "STRING", tipo),
-        ]
-    )
-    return list(bq_client.query(query, cfg).result())
+# Sin estado en memoria: cada pasada recorre el almacén, así lo que quedó
+# pendiente (todavía en el plazo de gracia) lo encuentra la siguiente,
+# aunque la instancia se haya reiniciado en el medio.
+_barrido_lock = threading.Lock()
+_ultimo_barrido = None          # time.monotonic() de la última pasada
+_LOTE_REFERENCIAS = 500         # urls por consulta a fotos_referenciadas
 
 
-def _borrar_fotos_bq(mie_id: int, tipo: str):
-    query = f"""
-        DELETE FROM `{PROJECT_ID}.{DATASET_ID}.mie_fotos`
-        WHERE mie_id = @id AND tipo = @tipo
+def barrer_fotos_sin_referencias(forzar: bool = False) -> int:
     """
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("id", "INT64", mie_id),
-            bigquery.ScalarQueryParameter("tipo", "STRING", tipo),
-        ]
-    )
-    bq_client.query(query, cfg).result()
+    Borra las fotos de fotos/ que no usa ninguna fila de mie_fotos y que
+    nadie subió ni reusó hace más de FOTOS_BORRADO_GRACIA_SEG: una subida
+    en curso (encontró la foto y todavía no insertó sus filas) no la pierde.
+    Corre como mucho una vez cada FOTOS_BARRIDO_INTERVALO_SEG por proceso,
+    salvo con `forzar`. Devuelve cuántos blobs borró.
+
+    La principal manda: se borra primero (condicionado a que nadie la haya
+    marcado en el medio) y después sus renditions. Las renditions cuya
+    principal ya no está (un borrado cortado) también se borran.
+    """
+    global _ultimo_barrido
+    with _barrido_lock:
+        ahora = time.monotonic()
+        if (
+            not forzar
+            and _ultimo_barrido is not None
+            and ahora - _ultimo_barrido < FOTOS_BARRIDO_INTERVALO_SEG
+        ):
+            return 0
+        _ultimo_barrido = ahora
+
+    limite = datetime.now(timezone.utc) - timedelta(seconds=FOTOS_BORRADO_GRACIA_SEG)
+    principales, renditions, viejos = set(), {}, set()
+    for nombre, uso in _almacen.listar(_PREFIJO_FOTOS):
+        principal = nombre.split("__", 1)[0]
+        if principal == nombre:
+            principales.add(nombre)
+        else:
+            renditions.setdefault(principal, []).append(nombre)
+        if uso < limite:
+            viejos.add(nombre)
+
+    candidatas = sorted(principales & viejos)
+    sin_filas = []
+    for i in range(0, len(candidatas), _LOTE_REFERENCIAS):
+        lote = candidatas[i:i + _LOTE_REFERENCIAS]
+        en_uso = _repo.fotos_referenciadas(lote)
+        sin_filas.extend(u for u in lote if u not in en_uso)
+
+    recientes = set(_almacen.borrar_sin_uso(sin_filas, FOTOS_BORRADO_GRACIA_SEG))
+    borrados = [u for u in sin_filas if u not in recientes]
+
+    sueltas = [
+        r
+        for principal, nombres in renditions.items()
+        if principal not in principales or principal in borrados
+        for r in nombres
+        if r in viejos
+    ]
+    recientes = set(_almacen.borrar_sin_uso(sueltas, FOTOS_BORRADO_GRACIA_SEG))
+    borrados.extend(r for r in sueltas if r not in recientes)
+
+    for blob_name in borrados:
+        _cache_disco.descartar(blob_name)
+    return len(borrados)
+
+
+# Barridos en segundo plano: un solo worker, no compite con subidas ni
+# descargas.
+_pool_borrados = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mie-borrado")
+
+
+def _filas_fotos(mie_id: int, tipo: str, fotos) -> list:
+    """Filas de mie_fotos (con IDs ya reservados) para `fotos`: blob_names o dicts."""
+    fotos = [f if isinstance(f, dict) else {"url_foto": f} for f in fotos if f]
+    fotos = [f for f in fotos if f.get("url_foto")]
+    if not fotos:
+        return []
+
+    ids = _secuencias[("mie_fotos", "id")].siguientes(len(fotos))
+    ahora = datetime.utcnow()
+
+    return [
+        {
+            "id": foto_id,
+            "mie_id": mie_id,
+            "tipo": tipo,               # ANTES / DESPUES
+            "url_foto": foto["url_foto"],
+            "url_thumb": foto.get("url_thumb"),
+            "url_medium": foto.get("url_medium"),
+            "url_original": foto.get("url_original"),
+            "hash_contenido": foto.get("hash_contenido"),
+            "fecha_hora": ahora,
+        }
+        for foto_id, foto in zip(ids, fotos)
+    ]
+
+
+@con_sitio
+def insertar_fotos(mie_id: int, tipo: str, fotos):
+    """
+    Registra N fotos en mie_fotos con una sola reserva de IDs
+    y una sola escritura.
+    `fotos`: blob_names (str) o dicts de subir_foto_a_bucket.
+    """
+    rows = _filas_fotos(mie_id, tipo, fotos)
+    if not rows:
+        return
+
+    try:
+        _repo.insertar_fotos(rows)
+    finally:
+        invalidar_cache("_listar_fotos_mie", mie_id)
+
+
+@_cacheado
+@con_sitio
+def _listar_fotos_mie(mie_id: int):
+    return _repo.fotos_de_mie(mie_id)
+
+
+# ---------------------------------------------------------
+# Cache en disco de fotos (LRU por bytes, clave = blob_name)
+# ---------------------------------------------------------
+class _CacheDiscoBlobs:
+    """
+    Copia local de los blobs ya descargados. Cada archivo se llama
+    <sha256(blob_name)>.<generation> (la generación con que se bajó). Se
+    desaloja por antigüedad de uso (mtime) hasta quedar dentro de `max_bytes`.
+    """
+
+    def __init__(self, directorio: str, max_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._indice = OrderedDict()   # clave -> (generacion, tamaño)
+        self._total = 0
+        os.makedirs(directorio, exist_ok=True)
+        self._cargar_indice()
+
+    @staticmethod
+    def _clave(blob_name: str) -> str:
+        return hashlib.sha256(blob_name.encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave: str, generacion) -> str:
+        return os.path.join(self.directorio, f"{clave}.{generacion}")
+
+    def _cargar_indice(self):
+        # Tras un reinicio del proceso se reaprovecha lo que ya está en disco
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            clave, _, generacion = nombre.partition(".")
+            if nombre.endswith(".tmp"):
+                # Escritura a medias de un proceso anterior
+                os.remove(ruta)
+                continue
+            if not generacion:
+                continue
+            info = os.stat(ruta)
+            archivos.append((info.st_mtime, clave, generacion, info.st_size))
+        for _, clave, generacion, tamaño in sorted(archivos):
+            if clave in self._indice:
+                self._borrar(clave)
+            self._indice[clave] = (generacion, tamaño)
+            self._total += tamaño
+        self._desalojar()
+
+    def _borrar(self, clave: str):
+        generacion, tamaño = self._indice.pop(clave)
+        self._total -= tamaño
+        try:
+            os.remove(self._ruta(clave, generacion))
+        except OSError:
+            pass
+
+    def _desalojar(self):
+        while self._total > self.max_bytes and self._indice:
+            self._borrar(next(iter(self._indice)))
+
+    def leer(self, blob_name: str):
+        """(generacion, bytes) si está en disco; si no, None."""
+        clave = self._clave(blob_name)
+        with self._lock:
+            item = self._indice.get(clave)
+            if item is None:
+                return None
+            generacion, _ = item
+            self._indice.move_to_end(clave)
+
+        # El archivo se lee fuera del lock: las lecturas no se serializan
+        ruta = self._ruta(clave, generacion)
+        try:
+            with open(ruta, "rb") as fh:
+                data = fh.read()
+            os.utime(ruta)
+        except OSError:
+            # Desalojado (o reemplazado) mientras tanto: cuenta como fallo
+            with self._lock:
+                if self._indice.get(clave, (None,))[0] == generacion:
+                    self._borrar(clave)
+            return None
+        return generacion, data
+
+    def guardar(self, blob_name: str, generacion, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        clave = self._clave(blob_name)
+        ruta = self._ruta(clave, generacion)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp, "wb") as fh:
+                    fh.write(data)
+                os.replace(tmp, ruta)
+            except OSError:
+                return
+            if clave in self._indice:
+                if self._indice[clave][0] == str(generacion):
+                    self._total -= self._indice.pop(clave)[1]
+                else:
+                    self._borrar(clave)
+            self._indice[clave] = (str(generacion), len(data))
+            self._total += len(data)
+            self._desalojar()
+
+    def descartar(self, blob_name: str):
+        clave = self._clave(blob_name)
+        with self._lock:
+            if clave in self._indice:
+                self._borrar(clave)
+
+
+_cache_disco = _CacheDiscoBlobs(FOTOS_CACHE_DIR, FOTOS_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _leer_blob(blob_name: str, timeout=None) -> bytes:
+    """
+    Toda lectura de blobs pasa por acá. Los blobs se nombran por contenido
+    (ver nombre_destino_foto): una copia en disco no puede quedar vieja y se
+    sirve sin consultar al almacén.
+    """
+    local = _cache_disco.leer(blob_name)
+    if local is not None:
+        return local[1]
+
+    data, generacion = _almacen.descargar(blob_name, timeout)
+    _cache_disco.guardar(blob_name, generacion, data)
+    return data
+
+
+# ---------------------------------------------------------
+# Descarga concurrente (plazo total + timeout por blob)
+# ---------------------------------------------------------
+_pool_descargas = ThreadPoolExecutor(max_workers=DESCARGA_WORKERS, thread_name_prefix="mie-descarga")
 
 
-def reemplazar_fotos_antes(mie_id: int, codigo_mie: str, archivos):
+class FotoMIE:
+    """
+    Foto de un MIA. tipo / fecha_hora / blob_name están siempre; los bytes
+    se bajan recién la primera vez que se lee `.data` (o en lote con
+    materializar_fotos). `url`: URL firmada para el navegador, si está
+    activo FOTOS_URL_FIRMADAS. Se puede usar como dict: f["tipo"], f.get("data").
+    """
+
+    _CLAVES = ("tipo", "fecha_hora", "blob_name", "url", "data")
+
+    def __init__(self, tipo, fecha_hora, blob_name, url=None):
+        self.tipo = tipo
+        self.fecha_hora = fecha_hora
+        self.blob_name = blob_name
+        self.url = url
+        self.motivo = None          # si no se pudo bajar: no_existe / error / plazo
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def cargada(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self):
+        # Si ya falló no se reintenta en cada acceso (p.ej. desde el PDF)
+        if self._data is None and self.motivo is None:
+            with self._lock:
+                if self._data is None and self.motivo is None:
+                    try:
+                        self._data = _descargar_blob(self.blob_name)
+                    except BlobNoEncontrado:
+                        self.motivo = "no_existe"
+                    except Exception:
+                        self.motivo = "error"
+        return self._data
+
+    def _resolver(self, data=None, motivo=None):
+        self._data = data
+        self.motivo = motivo
+
+    def __getitem__(self, clave):
+        if clave not in self._CLAVES:
+            raise KeyError(clave)
+        return getattr(self, clave)
+
+    def get(self, clave, default=None):
+        try:
+            return self[clave]
+        except KeyError:
+            return default
+
+
+class FotosMIE(list):
+    """
+    Lista de FotoMIE que además informa en `omitidas` las que no se
+    pudieron traer: dicts con tipo, fecha_hora, url_foto y motivo
+    ("no_existe", "error", "plazo").
+    """
+
+    def __init__(self, fotos=(), omitidas=()):
+        super().__init__(fotos)
+        self.omitidas = list(omitidas)
+
+
+def _descargar_blob(blob_name: str) -> bytes:
+    return _leer_blob(blob_name, timeout=DESCARGA_TIMEOUT_BLOB_SEG)
+
+
+def _descargar_blobs(blob_names, plazo=None):
+    """
+    Descarga en paralelo. Devuelve ({blob_name: bytes}, {blob_name: motivo})
+    apenas terminan todas o vence `plazo` (segundos); lo que siga en curso
+    queda como omitido y no bloquea al llamador.
+    """
+    futuros = {_pool_descargas.submit(_descargar_blob, n): n for n in dict.fromkeys(blob_names)}
+    if not futuros:
+        return {}, {}
+
+    hechos, pendientes = wait(futuros, timeout=plazo)
+
+    datos, motivos = {}, {}
+    for fut in hechos:
+        nombre = futuros[fut]
+        try:
+            datos[nombre] = fut.result()
+        except BlobNoEncontrado:
+            # El archivo no existe en el bucket (pero sí quedó registrado en BigQuery)
+            motivos[nombre] = "no_existe"
+        except Exception:
+            motivos[nombre] = "error"
+    for fut in pendientes:
+        fut.cancel()
+        motivos[futuros[fut]] = "plazo"
+
+    return datos, motivos
+
+
+def _blob_para_ancho(r, ancho_max=None) -> str:
+    """La rendition más chica que cubre `ancho_max` px; si no hay, el original."""
+    if ancho_max:
+        for nombre, lado in RENDITIONS:
+            blob_name = getattr(r, f"url_{nombre}", None)
+            if blob_name and lado >= ancho_max:
+                return blob_name
+    return r.url_foto
+
+
+# URLs firmadas ya generadas: blob_name -> (renovar_en, url). Se reusa la
+# misma URL entre reruns (el navegador la tiene en cache) hasta la mitad
+# de su vigencia.
+_urls_lock = threading.Lock()
+_urls_firmadas = {}
+
+
+def url_firmada_foto(blob_name: str):
+    """URL firmada del blob (None si está desactivado o el almacén no firma)."""
+    if not FOTOS_URL_FIRMADAS or not blob_name:
+        return None
+    ahora = time.monotonic()
+    with _urls_lock:
+        item = _urls_firmadas.get(blob_name)
+        if item is not None and item[0] > ahora:
+            return item[1]
+    try:
+        url = _almacen.url_firmada(blob_name, FOTOS_URL_VIGENCIA_SEG)
+    except Exception:
+        # Sin permiso para firmar (o falla de IAM): se sirven los bytes
+        return None
+    if url is not None:
+        with _urls_lock:
+            if len(_urls_firmadas) >= CACHE_MAX_ENTRADAS:
+                _urls_firmadas.clear()
+            _urls_firmadas[blob_name] = (ahora + FOTOS_URL_VIGENCIA_SEG / 2, url)
+    return url
+
+
+def obtener_fotos_mie(mie_id: int, ancho_max=None) -> FotosMIE:
+    """
+    Fotos del MIA sin bajar bytes (ver FotoMIE / materializar_fotos).
+    `ancho_max`: ancho máximo (px) al que se va a mostrar la foto; se usa
+    la rendition más chica que alcance. None = original.
+    """
+    fotos = []
+    for r in _listar_fotos_mie(mie_id):
+        if r.url_foto:
+            blob_name = _blob_para_ancho(r, ancho_max)
+            fotos.append(FotoMIE(r.tipo, r.fecha_hora, blob_name, url_firmada_foto(blob_name)))
+    return FotosMIE(fotos)
+
+
+def materializar_fotos(fotos, plazo=DESCARGA_PLAZO_SEG, usar_url=True) -> FotosMIE:
+    """
+    Baja en paralelo los bytes de las fotos que se van a mostrar.
+    Devuelve solo las que quedaron cargadas; el resto va en `omitidas`.
+    Con `usar_url` las que tienen URL firmada no se bajan (las pide el
+    navegador); False = bytes siempre (PDF, email).
+    """
+    fotos = list(fotos)
+    if not usar_url:
+        for f in fotos:
+            f.url = None
+    faltan = [f for f in fotos if f.url is None and not f.cargada and f.motivo is None]
+    datos, motivos = _descargar_blobs([f.blob_name for f in faltan], plazo)
+    for f in faltan:
+        if f.blob_name in datos:
+            f._resolver(data=datos[f.blob_name])
+        else:
+            f._resolver(motivo=motivos.get(f.blob_name, "error"))
+
+    listas = [f for f in fotos if f.url is not None or f.cargada]
+    omitidas = [
+        {
+            "tipo": f.tipo,
+            "fecha_hora": f.fecha_hora,
+            "url_foto": f.blob_name,
+            "motivo": f.motivo,
+        }
+        for f in fotos
+        if f.url is None and not f.cargada
+    ]
+    return FotosMIE(listas, omitidas)
+
+
+# ---------------------------------------------------------
+# Fotos – REEMPLAZO (solo ANTES)
+# ---------------------------------------------------------
+@con_sitio
+def reemplazar_fotos_antes(mie_id: int, archivos, progreso=None):
     """
     Reemplaza TODAS las fotos tipo ANTES.
     No afecta fotos DESPUES / remediación.
+
+    Orden pensado para que un corte en cualquier punto no deje el MIA a
+    medias: primero se suben las nuevas, después se cambian las filas en
+    una transacción; los blobs viejos que ya nadie referencia los borra
+    después el barrido (ver barrer_fotos_sin_referencias). Volver a cargar las mismas fotos no
+    sube nada (nombres por contenido).
     """
     if not archivos:
         return
 
-    # 1) obtener fotos actuales ANTES
-    actuales = _obtener_fotos_meta(mie_id, "ANTES")
+    # 1) subir nuevas en paralelo (si alguna falla no se tocó nada)
+    subidas = subir_fotos_a_bucket(archivos, progreso)
+    filas = _filas_fotos(mie_id, "ANTES", subidas)
+
+    # 2) cambiar las filas en una sola transacción
+    try:
+        _repo.reemplazar_fotos(mie_id, "ANTES", filas)
+    except Exception:
+        # Si el commit llegó a aplicarse (p.ej. se cortó la respuesta), las
+        # nuevas ya están referenciadas: no se pueden borrar.
+        try:
+            vigentes = {f.url_foto for f in _repo.fotos_de_mie(mie_id, "ANTES")}
+        except Exception:
+            vigentes = set()
+        if not all(f["url_foto"] in vigentes for f in filas):
+            # Las recién subidas quedan sin referencias: las borra un barrido
+            _pool_borrados.submit(barrer_fotos_sin_referencias)
+            raise
+    finally:
+        invalidar_cache("_listar_fotos_mie", mie_id)
 
-    # 2) borrar blobs
-    for f in actuales:
-        borrar_blob_bucket(f.url_foto)
+    # 3) las viejas que ya nadie referencia las borra el barrido, pasado el
+    #    plazo de gracia (las que se volvieron a cargar siguen referenciadas)
+    _pool_borrados.submit(barrer_fotos_sin_referencias)
 
-    # 3) borrar registros BQ
-    _borrar_fotos_bq(mie_id, "ANTES")
 
-    # 4) subir nuevas
-    for archivo in archivos:
-        nombre_destino = (
-            f"{codigo_mie}/ANTES/"
-            f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{archivo.name}"
-        )
-        blob_name = subir_foto_a_bucket(archivo, nombre_destino)
-        insertar_foto(mie_id, "ANTES", blob_name)
+# ---------------------------------------------------------
+# Escrituras de mie_eventos (directas o diferidas por el journal)
+# ---------------------------------------------------------
+def _invalidar_evento(mie_id: int):
+    invalidar_cache("_listar_mie_pagina")
+    invalidar_cache("_obtener_mie_detalle", mie_id)
+
+
+def _escribir_evento(tipo: str, mie_id: int, campos: dict):
+    """
+    "insertar" (fila completa) o "actualizar" (campos). Con JOURNAL_ACTIVO
+    se anota en mie_journal y vuelve enseguida; si no, se escribe ya.
+    """
+    if JOURNAL_ACTIVO:
+        mie_journal.encolar(tipo, mie_id, campos)
+        _invalidar_evento(mie_id)
+    else:
+        _aplicar_entrada(tipo, mie_id, campos, reintento=False)
+
+
+@con_sitio
+def _aplicar_entrada(tipo: str, mie_id: int, campos: dict, reintento: bool):
+    """Escribe una entrada en el repositorio. Idempotente: se puede repetir."""
+    # La marca es la de cuando se aplica: si el journal tardó, mie_snapshot
+    # igual ve el cambio (sincroniza por fecha_modificacion).
+    campos = dict(campos, fecha_modificacion=datetime.utcnow())
+    if tipo == "insertar":
+        # Un intento anterior pudo haber escrito la fila aunque no llegó la
+        # respuesta: el mie_id ya reservado es la clave de idempotencia.
+        if not (reintento and _repo.obtener_evento(mie_id, ("mie_id",)) is not None):
+            _repo.insertar_evento(campos)
+    elif tipo == "actualizar":
+        # UPDATE con valores fijos: repetirlo no cambia el resultado
+        _repo.actualizar_evento(mie_id, campos)
+    else:
+        raise ValueError(f"Entrada de journal desconocida: {tipo!r}")
+    _invalidar_evento(mie_id)
+
+
+def _pendientes_de(mie_id=None) -> list:
+    if not JOURNAL_ACTIVO:
+        return []
+    return mie_journal.pendientes(mie_id)
+
+
+def _con_pendientes(fila, pendientes: list, columnas=None):
+    """`fila` (o nada, si todavía no está en la tabla) con las entradas aplicadas encima."""
+    datos = dict(fila) if fila is not None else {}
+    for e in pendientes:
+        datos.update(e["campos"])
+    if not datos:
+        return fila
+    if columnas is not None:
+        datos = {c: datos.get(c) for c in columnas}
+    return Fila(datos)
+
+
+def escrituras_pendientes(mie_id=None) -> list:
+    """
+    Escrituras del journal que todavía no llegaron a la base (de un MIA o
+    todas): dicts con id, tipo, mie_id, estado, intentos, ultimo_error,
+    creada. estado FALLIDA = agotó los reintentos (ver reintentar_escritura).
+    """
+    return [
+        {k: v for k, v in e.items() if k != "campos"}
+        for e in _pendientes_de(mie_id)
+    ]
+
+
+def escrituras_recientes(limite: int = 20) -> list:
+    """
+    Últimas escrituras del journal en cualquier estado (PENDIENTE,
+    CONFIRMADA, FALLIDA), más nuevas primero: mismos dicts que
+    escrituras_pendientes más `confirmada` (fecha o None).
+    """
+    if not JOURNAL_ACTIVO:
+        return []
+    return [
+        {k: v for k, v in e.items() if k != "campos"}
+        for e in mie_journal.recientes(limite)
+    ]
+
+
+def reintentar_escritura(entrada_id: str):
+    """Vuelve a poner en cola una escritura FALLIDA del journal."""
+    if JOURNAL_ACTIVO:
+        mie_journal.reintentar(entrada_id)
+
+
+if JOURNAL_ACTIVO:
+    # Retoma lo que haya quedado pendiente de una ejecución anterior
+    mie_journal.iniciar(_aplicar_entrada)
 
 
 # ---------------------------------------------------------
 # MIA - Insertar
 # ---------------------------------------------------------
+# Locks por clave de idempotencia (repartidas por hash): buscar la clave y
+# escribir el alta no se intercala con otro envío del mismo formulario.
+_locks_altas = [threading.Lock() for _ in range(16)]
+
+
+def _alta_por_clave(clave: str):
+    """(mie_id, codigo_mie) del alta con esa clave, o None."""
+    # Primero el journal y después la base: una entrada que se confirma en
+    # el medio ya está en la tabla cuando se la busca ahí
+    for e in _pendientes_de():
+        if e["tipo"] == "insertar" and e["campos"].get("clave_idempotencia") == clave:
+            return e["mie_id"], e["campos"]["codigo_mie"]
+    existente = _repo.evento_por_clave(clave)
+    return None if existente is None else (existente.mie_id, existente.codigo_mie)
+
+
+@con_sitio
 def insertar_mie(
     drm,
     pozo,
@@ -212,127 +1059,245 @@ def insertar_mie(
     aprobador_apellido=None,
     aprobador_nombre=None,
     fecha_hora_aprobacion=None,
+    clave_idempotencia=None,
 ):
-    tabla = f"{PROJECT_ID}.{DATASET_ID}.mie_eventos"
-
-    mie_id = obtener_siguiente_id("mie_eventos", "mie_id")
-    codigo = generar_codigo_mie(mie_id)
-
-    if not drm:
-        drm = codigo
-
-    ahora = datetime.utcnow()
-    fecha_evento = fecha_hora_evento or ahora
-
-    query = f"""
-        INSERT INTO `{tabla}` (
-            mie_id, codigo_mie, drm, pozo, locacion, fluido,
-            volumen_estimado_m3, causa_probable, responsable, observaciones,
-            estado, creado_por, fecha_hora_evento, fecha_creacion_registro,
-
-            observador_apellido, observador_nombre,
-            responsable_inst_apellido, responsable_inst_nombre,
-            yacimiento, zona, nombre_instalacion,
-            latitud, longitud, tipo_afectacion, tipo_derrame, tipo_instalacion,
-            causa_inmediata, volumen_bruto_m3, volumen_gas_m3, ppm_agua,
-            volumen_crudo_m3, area_afectada_m2, recursos_afectados,
-            medidas_inmediatas,
-            aprobador_apellido, aprobador_nombre, fecha_hora_aprobacion
-        )
-        VALUES (
-            @mie_id, @codigo, @drm, @pozo, @locacion, @fluido,
-            @vol_est, @causa_prob, @resp, @obs,
-            "ABIERTO", @creado_por, @fh_evento, @fh_creacion,
-
-            @obs_ap, @obs_no,
-            @res_inst_ap, @res_inst_no,
-            @yacimiento, @zona, @nombre_inst,
-            @lat, @lon, @tipo_af, @tipo_der, @tipo_inst,
-            @causa_inm, @vol_bruto, @vol_gas, @ppm,
-            @vol_crudo, @area_af, @rec_af,
-            @med_inm,
-            @ap_ap, @ap_no, @fh_ap
-        )
     """
-
-    params = [
-        ("mie_id", "INT64", mie_id),
-        ("codigo", "STRING", codigo),
-        ("drm", "STRING", drm),
-        ("pozo", "STRING", pozo),
-        ("locacion", "STRING", locacion),
-        ("fluido", "STRING", fluido),
-        ("vol_est", "FLOAT64", volumen_estimado_m3),
-        ("causa_prob", "STRING", causa_probable),
-        ("resp", "STRING", responsable),
-        ("obs", "STRING", observaciones),
-        ("creado_por", "STRING", creado_por),
-        ("fh_evento", "TIMESTAMP", fecha_evento.isoformat()),
-        ("fh_creacion", "TIMESTAMP", ahora.isoformat()),
-
-        ("obs_ap", "STRING", observador_apellido),
-        ("obs_no", "STRING", observador_nombre),
-        ("res_inst_ap", "STRING", responsable_inst_apellido),
-        ("res_inst_no", "STRING", responsable_inst_nombre),
-        ("yacimiento", "STRING", yacimiento),
-        ("zona", "STRING", zona),
-        ("nombre_inst", "STRING", nombre_instalacion),
-        ("lat", "STRING", latitud),
-        ("lon", "STRING", longitud),
-        ("tipo_af", "STRING", tipo_afectacion),
-        ("tipo_der", "STRING", tipo_derrame),
-        ("tipo_inst", "STRING", tipo_instalacion),
-        ("causa_inm", "STRING", causa_inmediata),
-        ("vol_bruto", "FLOAT64", volumen_bruto_m3),
-        ("vol_gas", "FLOAT64", volumen_gas_m3),
-        ("ppm", "STRING", str(ppm_agua) if ppm_agua is not None else None),
-        ("vol_crudo", "FLOAT64", volumen_crudo_m3),
-        ("area_af", "FLOAT64", area_afectada_m2),
-        ("rec_af", "STRING", recursos_afectados),
-        ("med_inm", "STRING", medidas_inmediatas),
-        ("ap_ap", "STRING", aprobador_apellido),
-        ("ap_no", "STRING", aprobador_nombre),
-        ("fh_ap", "TIMESTAMP", fecha_hora_aprobacion.isoformat() if fecha_hora_aprobacion else None),
-    ]
-
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter(n, t, v) for n, t, v in params]
-    )
-
-    bq_client.query(query, cfg).result()
-    return mie_id, codigo
+    Alta de un MIA. Devuelve (mie_id, codigo_mie).
+
+    `clave_idempotencia`: huella del formulario. Si ya hay un MIA con esa
+    clave (recarga, otra pestaña, doble click) no se crea otro: se devuelven
+    los datos del existente. Se busca por la clave (en el journal y en la
+    base) antes de tomar mie_id y código, así un reenvío no gasta números;
+    si no está, el alta es un append común (Storage Write API, sin DML),
+    diferido por el journal si JOURNAL_ACTIVO. Buscar y escribir no es
+    atómico entre instancias: dos envíos simultáneos del mismo formulario
+    en instancias distintas pueden crear dos filas, y la búsqueda devuelve
+    siempre la primera.
+    """
+    if clave_idempotencia:
+        # Dentro del proceso, dos envíos de la misma clave no se cruzan
+        lock = _locks_altas[hash(clave_idempotencia) % len(_locks_altas)]
+    else:
+        lock = contextlib.nullcontext()
+
+    with lock:
+        if clave_idempotencia:
+            existente = _alta_por_clave(clave_idempotencia)
+            if existente is not None:
+                return existente
+
+        mie_id = obtener_siguiente_id("mie_eventos", "mie_id")
+        codigo = generar_codigo_mie()
+
+        if not drm:
+            drm = codigo
+
+        ahora = datetime.utcnow()
+        fecha_evento = fecha_hora_evento or ahora
+
+        fila = {
+            "mie_id": mie_id,
+            "codigo_mie": codigo,
+            "drm": drm,
+            "pozo": pozo,
+            "locacion": locacion,
+            "fluido": fluido,
+            "volumen_estimado_m3": volumen_estimado_m3,
+            "causa_probable": causa_probable,
+            "responsable": responsable,
+            "observaciones": observaciones,
+            "estado": "ABIERTO",
+            "creado_por": creado_por,
+            "fecha_hora_evento": fecha_evento,
+            "fecha_creacion_registro": ahora,
+            "fecha_modificacion": ahora,
+
+            "observador_apellido": observador_apellido,
+            "observador_nombre": observador_nombre,
+            "responsable_inst_apellido": responsable_inst_apellido,
+            "responsable_inst_nombre": responsable_inst_nombre,
+            "yacimiento": yacimiento,
+            "zona": zona,
+            "nombre_instalacion": nombre_instalacion,
+            "latitud": latitud,
+            "longitud": longitud,
+            "tipo_afectacion": tipo_afectacion,
+            "tipo_derrame": tipo_derrame,
+            "tipo_instalacion": tipo_instalacion,
+            "causa_inmediata": causa_inmediata,
+            "volumen_bruto_m3": volumen_bruto_m3,
+            "volumen_gas_m3": volumen_gas_m3,
+            "ppm_agua": str(ppm_agua) if ppm_agua is not None else None,
+            "volumen_crudo_m3": volumen_crudo_m3,
+            "area_afectada_m2": area_afectada_m2,
+            "recursos_afectados": recursos_afectados,
+            "medidas_inmediatas": medidas_inmediatas,
+            "aprobador_apellido": aprobador_apellido,
+            "aprobador_nombre": aprobador_nombre,
+            "fecha_hora_aprobacion": fecha_hora_aprobacion,
+            "clave_idempotencia": clave_idempotencia,
+        }
+
+        # Diferida o no, un reintento no duplica: el mie_id ya está reservado
+        _escribir_evento("insertar", mie_id, fila)
+        return mie_id, codigo
 
 
 # ---------------------------------------------------------
 # Listados / Detalle
 # ---------------------------------------------------------
-def listar_mie():
-    query = f"""
-        SELECT mie_id, codigo_mie, pozo, nombre_instalacion,
-               estado, fecha_creacion_registro
-        FROM `{PROJECT_ID}.{DATASET_ID}.mie_eventos`
-        ORDER BY fecha_creacion_registro DESC
-        LIMIT 300
+@_cacheado
+@con_sitio
+def _listar_mie_pagina(
+    cursor=None,
+    tamano=LISTADO_TAMANO_PAGINA,
+    codigo_prefijo=None,
+    instalacion=None,
+    estado=None,
+    desde=None,
+    hasta=None,
+):
     """
-    return list(bq_client.query(query).result())
-
-
-def obtener_mie_detalle(mie_id: int):
-    query = f"""
-        SELECT *
-        FROM `{PROJECT_ID}.{DATASET_ID}.mie_eventos`
-        WHERE mie_id = @id
+    Una página del listado (más recientes primero) con filtros del lado
+    del servidor. Devuelve (filas, siguiente_cursor); siguiente_cursor es
+    None en la última página. El costo por página no depende de cuántas
+    páginas haya antes: se sigue desde el cursor, no con OFFSET.
+    `desde` / `hasta`: fechas (date) del evento, ambas inclusive.
     """
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("id", "INT64", mie_id)]
+    if desde is not None:
+        desde = datetime.combine(desde, datetime.min.time())
+    if hasta is not None:
+        hasta = datetime.combine(hasta + timedelta(days=1), datetime.min.time())
+
+    filas = _repo.listar_eventos_pagina(
+        tamano + 1,
+        cursor=cursor,
+        codigo_prefijo=codigo_prefijo,
+        instalacion=instalacion,
+        estado=estado,
+        desde=desde,
+        hasta=hasta,
     )
-    rows = list(bq_client.query(query, cfg).result())
-    return rows[0] if rows else None
+    if len(filas) <= tamano:
+        return filas, None
+    filas = filas[:tamano]
+    ultima = filas[-1]
+    return filas, (ultima.fecha_creacion_registro, ultima.mie_id)
+
+
+def listar_mie_pagina(
+    cursor=None,
+    tamano=LISTADO_TAMANO_PAGINA,
+    codigo_prefijo=None,
+    instalacion=None,
+    estado=None,
+    desde=None,
+    hasta=None,
+):
+    """
+    Ver _listar_mie_pagina. Además refleja el journal: en la primera página
+    sin filtros aparecen arriba los MIA recién creados que todavía no
+    llegaron a BigQuery, y las filas con cambios pendientes los muestran.
+    """
+    filas, siguiente = _listar_mie_pagina(
+        cursor, tamano, codigo_prefijo, instalacion, estado, desde, hasta
+    )
+    pendientes = _pendientes_de()
+    if not pendientes:
+        return filas, siguiente
+
+    por_mie = {}
+    for e in pendientes:
+        por_mie.setdefault(e["mie_id"], []).append(e)
+
+    # Row de BigQuery: iterar da los valores, no los nombres de columna
+    columnas = tuple(filas[0].keys()) if filas else None
+    filas = [
+        _con_pendientes(f, por_mie[f.mie_id], columnas) if f.mie_id in por_mie else f
+        for f in filas
+    ]
+    sin_filtros = not any((codigo_prefijo, instalacion, estado, desde, hasta))
+    if cursor is None and sin_filtros:
+        vistos = {f.mie_id for f in filas}
+        nuevos = [
+            _con_pendientes(None, por_mie[e["mie_id"]], columnas)
+            for e in pendientes
+            if e["tipo"] == "insertar" and e["mie_id"] not in vistos
+        ]
+        nuevos.sort(key=lambda f: (f.fecha_creacion_registro, f.mie_id), reverse=True)
+        filas = nuevos + filas
+    return filas, siguiente
+
+
+# Columnas que necesita cada vista: BigQuery cobra y transfiere por columna
+# leída, así que cada pantalla pide solo lo que muestra.
+COLUMNAS_HISTORIAL = (
+    "mie_id", "codigo_mie", "drm", "pozo", "estado", "creado_por",
+    "fecha_hora_evento", "fecha_creacion_registro",
+    "observador_apellido", "observador_nombre",
+    "responsable_inst_apellido", "responsable_inst_nombre",
+    "yacimiento", "zona", "nombre_instalacion", "latitud", "longitud",
+    "tipo_afectacion", "tipo_derrame", "tipo_instalacion", "causa_inmediata",
+    "volumen_bruto_m3", "volumen_gas_m3", "ppm_agua", "area_afectada_m2",
+    "recursos_afectados", "causa_probable", "responsable", "observaciones",
+    "medidas_inmediatas",
+    "aprobador_apellido", "aprobador_nombre", "fecha_hora_aprobacion",
+    "rem_fecha_fin_saneamiento", "rem_volumen_tierra_levantada",
+    "rem_destino_tierra_impactada", "rem_volumen_liquido_recuperado",
+    "rem_comentarios", "rem_aprobador_apellido", "rem_aprobador_nombre",
+    "rem_fecha", "rem_detalle",
+)
+
+COLUMNAS_PDF = (
+    "mie_id", "codigo_mie", "drm", "pozo", "estado", "creado_por",
+    "fecha_hora_evento", "fecha_creacion_registro",
+    "observador_apellido", "observador_nombre",
+    "responsable_inst_apellido", "responsable_inst_nombre",
+    "yacimiento", "zona", "nombre_instalacion", "latitud", "longitud",
+    "tipo_afectacion", "tipo_derrame", "tipo_instalacion", "causa_inmediata",
+    "volumen_bruto_m3", "volumen_crudo_m3", "volumen_gas_m3", "ppm_agua",
+    "area_afectada_m2",
+    "recursos_afectados", "observaciones", "medidas_inmediatas",
+    "aprobador_apellido", "aprobador_nombre", "fecha_hora_aprobacion",
+    "rem_fecha_fin_saneamiento", "rem_volumen_tierra_levantada",
+    "rem_destino_tierra_impactada", "rem_volumen_liquido_recuperado",
+    "rem_comentarios", "rem_aprobador_apellido", "rem_aprobador_nombre",
+)
+
+COLUMNAS_ESTADISTICAS = (
+    "mie_id", "estado", "magnitud",
+    "fecha_hora_evento", "fecha_creacion_registro", "rem_fecha_fin_saneamiento",
+    "yacimiento", "zona",
+    "tipo_instalacion", "tipo_afectacion", "tipo_derrame", "causa_inmediata",
+    "volumen_estimado_m3", "rem_volumen_liquido_recuperado", "rem_volumen_tierra_levantada",
+)
+
+# Exportar = tabla completa, pero con columnas explícitas (orden estable)
+COLUMNAS_EXPORTAR = tuple(COLUMNAS_EVENTOS)
+
+
+@_cacheado
+@con_sitio
+def _obtener_mie_detalle(mie_id: int, columnas=None):
+    return _repo.obtener_evento(mie_id, columnas)
+
+
+def obtener_mie_detalle(mie_id: int, columnas=None):
+    """
+    Detalle del MIA. `columnas`: tupla (p.ej. COLUMNAS_PDF); None = todas.
+    Incluye las escrituras todavía pendientes en el journal.
+    """
+    detalle = _obtener_mie_detalle(mie_id, columnas)
+    pendientes = _pendientes_de(mie_id)
+    if not pendientes:
+        return detalle
+    return _con_pendientes(detalle, pendientes, columnas)
 
 
 # ---------------------------------------------------------
 # ACTUALIZAR MIA (SOLO CARGA – botón Editar)
 # ---------------------------------------------------------
+@con_sitio
 def actualizar_mie_completo(
     mie_id: int,
     creado_por=None,
@@ -364,88 +1329,49 @@ def actualizar_mie_completo(
     aprobador_nombre=None,
     fecha_hora_aprobacion=None,
 ):
-    query = f"""
-        UPDATE `{PROJECT_ID}.{DATASET_ID}.mie_eventos`
-        SET
-            creado_por=@creado_por,
-            fecha_hora_evento=@fh_evento,
-
-            observador_apellido=@obs_ap,
-            observador_nombre=@obs_no,
-            responsable_inst_apellido=@res_inst_ap,
-            responsable_inst_nombre=@res_inst_no,
-
-            yacimiento=@yac,
-            zona=@zona,
-            nombre_instalacion=@nombre_inst,
-            latitud=@lat,
-            longitud=@lon,
-
-            tipo_afectacion=@tipo_af,
-            tipo_derrame=@tipo_der,
-            tipo_instalacion=@tipo_inst,
-            causa_inmediata=@causa_inm,
-
-            volumen_bruto_m3=@vol_bruto,
-            volumen_gas_m3=@vol_gas,
-            ppm_agua=@ppm,
-            volumen_crudo_m3=@vol_crudo,
-            area_afectada_m2=@area_af,
-
-            recursos_afectados=@rec_af,
-            causa_probable=@causa_prob,
-            responsable=@resp,
-            observaciones=@obs,
-            medidas_inmediatas=@med_inm,
-
-            aprobador_apellido=@ap_ap,
-            aprobador_nombre=@ap_no,
-            fecha_hora_aprobacion=@fh_ap
-
-        WHERE mie_id=@id
-    """
-
-    params = [
-        ("creado_por", "STRING", creado_por),
-        ("fh_evento", "TIMESTAMP", fecha_hora_evento.isoformat() if fecha_hora_evento else None),
-        ("obs_ap", "STRING", observador_apellido),
-        ("obs_no", "STRING", observador_nombre),
-        ("res_inst_ap", "STRING", responsable_inst_apellido),
-        ("res_inst_no", "STRING", responsable_inst_nombre),
-        ("yac", "STRING", yacimiento),
-        ("zona", "STRING", zona),
-        ("nombre_inst", "STRING", nombre_instalacion),
-        ("lat", "STRING", latitud),
-        ("lon", "STRING", longitud),
-        ("tipo_af", "STRING", tipo_afectacion),
-        ("tipo_der", "STRING", tipo_derrame),
-        ("tipo_inst", "STRING", tipo_instalacion),
-        ("causa_inm", "STRING", causa_inmediata),
-        ("vol_bruto", "FLOAT64", volumen_bruto_m3),
-        ("vol_gas", "FLOAT64", volumen_gas_m3),
-        ("ppm", "STRING", str(ppm_agua) if ppm_agua is not None else None),
-        ("vol_crudo", "FLOAT64", volumen_crudo_m3),
-        ("area_af", "FLOAT64", area_afectada_m2),
-        ("rec_af", "STRING", recursos_afectados),
-        ("causa_prob", "STRING", causa_probable),
-        ("resp", "STRING", responsable),
-        ("obs", "STRING", observaciones),
-        ("med_inm", "STRING", medidas_inmediatas),
-        ("ap_ap", "STRING", aprobador_apellido),
-        ("ap_no", "STRING", aprobador_nombre),
-        ("fh_ap", "TIMESTAMP", fecha_hora_aprobacion.isoformat() if fecha_hora_aprobacion else None),
-        ("id", "INT64", mie_id),
-    ]
-
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter(n, t, v) for n, t, v in params]
-    )
-    bq_client.query(query, cfg).result()
+    _escribir_evento("actualizar", mie_id, {
+        "creado_por": creado_por,
+        "fecha_hora_evento": fecha_hora_evento,
+
+        "observador_apellido": observador_apellido,
+        "observador_nombre": observador_nombre,
+        "responsable_inst_apellido": responsable_inst_apellido,
+        "responsable_inst_nombre": responsable_inst_nombre,
+
+        "yacimiento": yacimiento,
+        "zona": zona,
+        "nombre_instalacion": nombre_instalacion,
+        "latitud": latitud,
+        "longitud": longitud,
+
+        "tipo_afectacion": tipo_afectacion,
+        "tipo_derrame": tipo_derrame,
+        "tipo_instalacion": tipo_instalacion,
+        "causa_inmediata": causa_inmediata,
+
+        "volumen_bruto_m3": volumen_bruto_m3,
+        "volumen_gas_m3": volumen_gas_m3,
+        "ppm_agua": str(ppm_agua) if ppm_agua is not None else None,
+        "volumen_crudo_m3": volumen_crudo_m3,
+        "area_afectada_m2": area_afectada_m2,
+
+        "recursos_afectados": recursos_afectados,
+        "causa_probable": causa_probable,
+        "responsable": responsable,
+        "observaciones": observaciones,
+        "medidas_inmediatas": medidas_inmediatas,
+
+        "aprobador_apellido": aprobador_apellido,
+        "aprobador_nombre": aprobador_nombre,
+        "fecha_hora_aprobacion": fecha_hora_aprobacion,
+        "fecha_modificacion": datetime.utcnow(),
+    })
 
 
 # ---------------------------------------------------------
 # CIERRE / REMEDIACIÓN (NO SE USA EN EDITAR)
 # ---------------------------------------------------------
+@con_sitio
 def cerrar_mie_con_remediacion(
     mie_id,
     fecha_fin_saneamiento,
@@ -456,45 +1382,31 @@ def cerrar_mie_con_remediacion(
     aprob_apellido,
     aprob_nombre,
 ):
-    query = f"""
-        UPDATE `{PROJECT_ID}.{DATASET_ID}.mie_eventos`
-        SET
-            estado="CERRADO",
-            rem_fecha_fin_saneamiento=@fh,
-            rem_volumen_tierra_levantada=@vol_tierra,
-            rem_destino_tierra_impactada=@destino,
-            rem_volumen_liquido_recuperado=@vol_liq,
-            rem_comentarios=@coment,
-            rem_aprobador_apellido=@ap_ap,
-            rem_aprobador_nombre=@ap_no,
-            rem_fecha=@fh,
-            rem_responsable=CONCAT(COALESCE(@ap_ap,''),' ',COALESCE(@ap_no,'')),
-            rem_detalle=@coment
-        WHERE mie_id=@id
-    """
-
-    cfg = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("fh", "TIMESTAMP", fecha_fin_saneamiento.isoformat()),
-            bigquery.ScalarQueryParameter("vol_tierra", "FLOAT64", volumen_tierra_levantada),
-            bigquery.ScalarQueryParameter("destino", "STRING", destino_tierra_impactada),
-            bigquery.ScalarQueryParameter("vol_liq", "FLOAT64", volumen_liquido_recuperado),
-            bigquery.ScalarQueryParameter("coment", "STRING", comentarios),
-            bigquery.ScalarQueryParameter("ap_ap", "STRING", aprob_apellido),
-            bigquery.ScalarQueryParameter("ap_no", "STRING", aprob_nombre),
-            bigquery.ScalarQueryParameter("id", "INT64", mie_id),
-        ]
-    )
-    bq_client.query(query, cfg).result()
+    _escribir_evento("actualizar", mie_id, {
+        "estado": "CERRADO",
+        "rem_fecha_fin_saneamiento": fecha_fin_saneamiento,
+        "rem_volumen_tierra_levantada": volumen_tierra_levantada,
+        "rem_destino_tierra_impactada": destino_tierra_impactada,
+        "rem_volumen_liquido_recuperado": volumen_liquido_recuperado,
+        "rem_comentarios": comentarios,
+        "rem_aprobador_apellido": aprob_apellido,
+        "rem_aprobador_nombre": aprob_nombre,
+        "rem_fecha": fecha_fin_saneamiento,
+        "rem_responsable": f"{aprob_apellido or ''} {aprob_nombre or ''}",
+        "rem_detalle": comentarios,
+        "fecha_modificacion": datetime.utcnow(),
+    })
 
 
 # ---------------------------------------------------------
 # Exportar
 # ---------------------------------------------------------
-def obtener_todos_mie():
-    query = f"""
-        SELECT *
-        FROM `{PROJECT_ID}.{DATASET_ID}.mie_eventos`
-        ORDER BY fecha_creacion_registro
+@con_sitio
+def obtener_todos_mie_df(columnas=None, desde=None):
+    """
+    Todos los MIA como DataFrame tipado (Arrow, sin Row ni dicts
+    intermedios; picklists como category). `columnas`: tupla (p.ej.
+    COLUMNAS_ESTADISTICAS); None = todas. `desde`: solo los MIA con
+    fecha_modificacion >= desde (sincronización incremental de mie_snapshot).
     """
-    return list(bq_client.query(query).result())
+    return _repo.eventos_dataframe(columnas, desde)
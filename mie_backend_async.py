@@ -0,0 +1,62 @@
+# ============================================================
+# mie_backend_async.py — misma API que mie_backend, en asyncio
+# ============================================================
+# Cada función corre la versión bloqueante de mie_backend en un hilo
+# (asyncio.to_thread), así varias consultas a BigQuery / lecturas de GCS
+# independientes se pueden esperar juntas con asyncio.gather en vez de
+# una detrás de otra. Cache, reservas de IDs, etc. son los del backend.
+
+import asyncio
+import functools
+
+import mie_backend as _backend
+
+
+def _en_hilo(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    return wrapper
+
+
+# ---------------------------------------------------------
+# Lecturas
+# ---------------------------------------------------------
+listar_mie_pagina = _en_hilo(_backend.listar_mie_pagina)
+obtener_mie_detalle = _en_hilo(_backend.obtener_mie_detalle)
+obtener_fotos_mie = _en_hilo(_backend.obtener_fotos_mie)
+materializar_fotos = _en_hilo(_backend.materializar_fotos)
+
+# ---------------------------------------------------------
+# Escrituras
+# ---------------------------------------------------------
+insertar_mie = _en_hilo(_backend.insertar_mie)
+insertar_fotos = _en_hilo(_backend.insertar_fotos)
+registrar_fotos = _en_hilo(_backend.registrar_fotos)
+actualizar_mie_completo = _en_hilo(_backend.actualizar_mie_completo)
+cerrar_mie_con_remediacion = _en_hilo(_backend.cerrar_mie_con_remediacion)
+reemplazar_fotos_antes = _en_hilo(_backend.reemplazar_fotos_antes)
+
+
+# ---------------------------------------------------------
+# Combinadas (lo que necesita cada pantalla, en una sola ronda)
+# ---------------------------------------------------------
+async def cargar_detalle_y_fotos(mie_id: int, ancho_max=None, columnas=None):
+    """(detalle, fotos) con ambas consultas en paralelo. Fotos sin bytes."""
+    return await asyncio.gather(
+        obtener_mie_detalle(mie_id, columnas),
+        obtener_fotos_mie(mie_id, ancho_max=ancho_max),
+    )
+
+
+async def cargar_historial(mie_id: int, ancho_max=None, columnas=None, pagina=None):
+    """
+    (pagina, detalle, fotos): página del listado + MIA seleccionado, en
+    paralelo. `pagina`: kwargs de listar_mie_pagina; devuelve (filas, cursor).
+    """
+    return await asyncio.gather(
+        listar_mie_pagina(**(pagina or {})),
+        obtener_mie_detalle(mie_id, columnas),
+        obtener_fotos_mie(mie_id, ancho_max=ancho_max),
+    )
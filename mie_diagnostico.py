@@ -0,0 +1,161 @@
+# ============================================================
+# mie_diagnostico.py — métricas por consulta (BigQuery / SQLite)
+# ============================================================
+# Cada consulta del repositorio deja un registro: sitio (función del
+# backend que la originó), tiempos, bytes procesados / facturados,
+# slot-ms y si salió del cache de BigQuery. Los registros van al log
+# (una línea JSON, logger "mie.consultas") y a un buffer circular en
+# memoria que muestra el panel de diagnóstico de la app.
+
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError
+
+from config import DIAG_MAX_REGISTROS
+
+logger = logging.getLogger("mie.consultas")
+if not logger.handlers:
+    # Una línea JSON por consulta en stderr: Cloud Run / Cloud Logging la
+    # toma como log estructurado.
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Referencia de arranque: app_mie importa este módulo antes que nada
+_T0 = time.perf_counter()
+_arranque = {}             # etapa -> ms desde _T0 (la primera vez que se llega)
+
+_sitio = contextvars.ContextVar("mie_sitio", default="(sin sitio)")
+_registros = deque(maxlen=DIAG_MAX_REGISTROS)
+_registros_lock = threading.Lock()
+
+
+# ---------------------------------------------------------
+# Sitio (quién originó la consulta)
+# ---------------------------------------------------------
+def sitio_actual() -> str:
+    return _sitio.get()
+
+
+def con_sitio(fn):
+    """Las consultas hechas dentro de `fn` se registran con su nombre."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _sitio.set(fn.__name__)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _sitio.reset(token)
+
+    return wrapper
+
+
+# ---------------------------------------------------------
+# Registros
+# ---------------------------------------------------------
+def registrar(**campos):
+    """Guarda un registro (agrega el sitio actual) y lo escribe al log."""
+    registro = {"sitio": sitio_actual(), **campos}
+    with _registros_lock:
+        _registros.append(registro)
+    logger.info(json.dumps(registro, default=str, ensure_ascii=False))
+
+
+def estado_de(error) -> str:
+    """"ok" / "cancelado" / "error" según la excepción que cortó la consulta."""
+    if error is None:
+        return "ok"
+    if isinstance(error, (KeyboardInterrupt, SystemExit, CancelledError)):
+        return "cancelado"
+    # Job cancelado en BigQuery (bq cancel, consola): razón "stopped"
+    if any(e.get("reason") == "stopped" for e in getattr(error, "errors", None) or ()):
+        return "cancelado"
+    return "error"
+
+
+def registrar_job(job, wall_ms: float, error=None):
+    """
+    Registro a partir de un QueryJob de BigQuery terminado, bien o mal.
+    `error`: la excepción si falló o se canceló (`job` es None si ni
+    siquiera llegó a crearse).
+    """
+    campos = {}
+    if job is not None:
+        cola_ms = None
+        if job.created and job.started:
+            cola_ms = round((job.started - job.created).total_seconds() * 1000, 1)
+        campos = dict(
+            job_id=job.job_id,
+            tipo=job.statement_type,
+            cola_ms=cola_ms,
+            bytes_procesados=job.total_bytes_processed,
+            bytes_facturados=job.total_bytes_billed,
+            slot_ms=job.slot_millis,
+            cache_hit=job.cache_hit,
+        )
+    registrar(
+        motor="bigquery",
+        wall_ms=round(wall_ms, 1),
+        estado=estado_de(error),
+        **campos,
+        **({"error": str(error)[:300]} if error is not None else {}),
+    )
+
+
+def ultimos_registros(n=None) -> list:
+    """Los últimos `n` registros (todos si n es None), más nuevos primero."""
+    with _registros_lock:
+        registros = list(_registros)
+    registros.reverse()
+    return registros[:n] if n else registros
+
+
+def resumen_por_sitio() -> list:
+    """Agregado por sitio sobre el buffer: llamadas, errores, tiempos, bytes y cache hits."""
+    grupos = {}
+    for r in ultimos_registros():
+        grupos.setdefault(r["sitio"], []).append(r)
+
+    resumen = []
+    for sitio, regs in grupos.items():
+        tiempos = sorted(r["wall_ms"] for r in regs)
+        resumen.append({
+            "sitio": sitio,
+            "llamadas": len(regs),
+            "errores": sum(1 for r in regs if r.get("estado", "ok") != "ok"),
+            "wall_ms_p50": tiempos[len(tiempos) // 2],
+            "wall_ms_max": tiempos[-1],
+            "bytes_facturados": sum(r.get("bytes_facturados") or 0 for r in regs),
+            "slot_ms": sum(r.get("slot_ms") or 0 for r in regs),
+            "cache_hits": sum(1 for r in regs if r.get("cache_hit")),
+        })
+    resumen.sort(key=lambda r: r["bytes_facturados"], reverse=True)
+    return resumen
+
+
+# ---------------------------------------------------------
+# Arranque (cold start)
+# ---------------------------------------------------------
+def marcar_arranque(etapa: str):
+    """
+    Registra (una vez por proceso) cuántos ms pasaron desde el arranque
+    hasta `etapa`. Van al log y al panel de diagnóstico.
+    """
+    if etapa in _arranque:
+        return
+    ms = round((time.perf_counter() - _T0) * 1000, 1)
+    _arranque[etapa] = ms
+    logger.info(json.dumps({"arranque": etapa, "ms": ms}, ensure_ascii=False))
+
+
+def arranque() -> list:
+    """Etapas de arranque registradas, en orden: [{"etapa", "ms"}]."""
+    return [{"etapa": e, "ms": ms} for e, ms in _arranque.items()]
@@ -0,0 +1,280 @@
+# ============================================================
+# mie_journal.py — escrituras diferidas (write-behind) de MIA
+# ============================================================
+# insertar / actualizar un MIA no espera a que BigQuery escriba (un alta
+# con clave solo la busca antes, ver mie_backend.insertar_mie): la escritura
+# se anota en un journal SQLite (WAL, en disco local) y se devuelve enseguida. Un
+# hilo de fondo aplica las entradas, reintentando con backoff mientras
+# fallen. El orden se respeta dentro de cada MIA (un UPDATE no se adelanta
+# al INSERT de su MIA); entre MIA distintos no, así una entrada trabada no
+# frena al resto. Tras JOURNAL_MAX_INTENTOS fallos la entrada pasa a
+# FALLIDA: queda a la vista (ver fallidas) y retiene solo a las posteriores
+# de su MIA hasta que se reintenta a mano. Si el proceso se reinicia, lo
+# pendiente se retoma al arrancar.
+#
+# Idempotencia: cada entrada tiene un id propio y el mie_id ya reservado;
+# aplicar dos veces la misma entrada no duplica (ver mie_backend._aplicar_entrada).
+# Un journal = un proceso: el archivo no se comparte entre instancias.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from config import JOURNAL_DIR, JOURNAL_MAX_INTENTOS, JOURNAL_REINTENTO_MAX_SEG, JOURNAL_RETENER_SEG
+
+logger = logging.getLogger("mie.journal")
+
+_RUTA = os.path.join(JOURNAL_DIR, "mie_journal.sqlite3")
+
+PENDIENTE = "PENDIENTE"
+CONFIRMADA = "CONFIRMADA"
+FALLIDA = "FALLIDA"
+
+_local = threading.local()
+_hay_trabajo = threading.Event()
+_arranque_lock = threading.Lock()
+_hilo = None
+_aplicar = None
+
+
+# ---------------------------------------------------------
+# Serialización (JSON con fechas)
+# ---------------------------------------------------------
+def _a_json(campos: dict) -> str:
+    def _valor(v):
+        if isinstance(v, datetime):
+            return {"$dt": v.isoformat()}
+        if isinstance(v, date):
+            return {"$d": v.isoformat()}
+        return v
+
+    return json.dumps({k: _valor(v) for k, v in campos.items()}, ensure_ascii=False)
+
+
+def _de_json(texto: str) -> dict:
+    def _valor(v):
+        if isinstance(v, dict):
+            if "$dt" in v:
+                return datetime.fromisoformat(v["$dt"])
+            if "$d" in v:
+                return date.fromisoformat(v["$d"])
+        return v
+
+    return {k: _valor(v) for k, v in json.loads(texto).items()}
+
+
+# ---------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------
+def _conexion() -> sqlite3.Connection:
+    # Una conexión por hilo (sesiones de Streamlit + hilo de drenado)
+    con = getattr(_local, "con", None)
+    if con is None:
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        con = sqlite3.connect(_RUTA, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        # FULL: la entrada está en disco antes de devolverle el control a la UI
+        con.execute("PRAGMA synchronous=FULL")
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entradas (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                tipo TEXT NOT NULL,
+                mie_id INTEGER NOT NULL,
+                campos TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                ultimo_error TEXT,
+                proximo_intento REAL NOT NULL DEFAULT 0,
+                creada REAL NOT NULL,
+                confirmada REAL
+            )
+            """
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS entradas_estado ON entradas (estado, seq)")
+        con.execute("CREATE INDEX IF NOT EXISTS entradas_mie ON entradas (mie_id, seq)")
+        _local.con = con
+    return con
+
+
+def _entrada(r) -> dict:
+    return {
+        "id": r["id"],
+        "tipo": r["tipo"],
+        "mie_id": r["mie_id"],
+        "campos": _de_json(r["campos"]),
+        "estado": r["estado"],
+        "intentos": r["intentos"],
+        "ultimo_error": r["ultimo_error"],
+        "creada": datetime.fromtimestamp(r["creada"]),
+        "confirmada": datetime.fromtimestamp(r["confirmada"]) if r["confirmada"] else None,
+    }
+
+
+# ---------------------------------------------------------
+# API
+# ---------------------------------------------------------
+def iniciar(aplicar):
+    """
+    Arranca (una vez por proceso) el hilo que drena el journal.
+    `aplicar(tipo, mie_id, campos, reintento)` escribe una entrada en el
+    repositorio; si lanza, la entrada queda pendiente y se reintenta.
+    """
+    global _hilo, _aplicar
+    with _arranque_lock:
+        _aplicar = aplicar
+        if _hilo is None:
+            _hilo = threading.Thread(target=_drenar, name="mie-journal", daemon=True)
+            _hilo.start()
+    _hay_trabajo.set()
+
+
+def encolar(tipo: str, mie_id: int, campos: dict) -> str:
+    """Anota una escritura pendiente y despierta al hilo. Devuelve el id de la entrada."""
+    entrada_id = uuid.uuid4().hex
+    _conexion().execute(
+        "INSERT INTO entradas (id, tipo, mie_id, campos, estado, creada) VALUES (?, ?, ?, ?, ?, ?)",
+        (entrada_id, tipo, mie_id, _a_json(campos), PENDIENTE, time.time()),
+    )
+    _hay_trabajo.set()
+    return entrada_id
+
+
+def pendientes(mie_id=None) -> list:
+    """
+    Entradas sin confirmar (PENDIENTE o FALLIDA), de un MIA o todas, en el
+    orden en que se aplican.
+    """
+    if mie_id is None:
+        filas = _conexion().execute(
+            "SELECT * FROM entradas WHERE estado IN (?, ?) ORDER BY seq", (PENDIENTE, FALLIDA)
+        ).fetchall()
+    else:
+        filas = _conexion().execute(
+            "SELECT * FROM entradas WHERE estado IN (?, ?) AND mie_id = ? ORDER BY seq",
+            (PENDIENTE, FALLIDA, mie_id),
+        ).fetchall()
+    return [_entrada(r) for r in filas]
+
+
+def fallidas() -> list:
+    """Entradas que agotaron los reintentos (dead letter)."""
+    filas = _conexion().execute(
+        "SELECT * FROM entradas WHERE estado = ? ORDER BY seq", (FALLIDA,)
+    ).fetchall()
+    return [_entrada(r) for r in filas]
+
+
+def recientes(limite: int = 20) -> list:
+    """
+    Las últimas `limite` entradas en cualquier estado, más nuevas primero.
+    Las confirmadas se ven mientras se retienen (JOURNAL_RETENER_SEG).
+    """
+    filas = _conexion().execute(
+        "SELECT * FROM entradas ORDER BY seq DESC LIMIT ?", (limite,)
+    ).fetchall()
+    return [_entrada(r) for r in filas]
+
+
+def reintentar(entrada_id: str):
+    """Vuelve una entrada FALLIDA a la cola, con los intentos en cero."""
+    _conexion().execute(
+        "UPDATE entradas SET estado = ?, intentos = 0, proximo_intento = 0 WHERE id = ? AND estado = ?",
+        (PENDIENTE, entrada_id, FALLIDA),
+    )
+    _hay_trabajo.set()
+
+
+# ---------------------------------------------------------
+# Drenado (hilo de fondo)
+# ---------------------------------------------------------
+# Entradas pendientes sin otra anterior de su MIA todavía sin confirmar:
+# las únicas que se pueden aplicar sin romper el orden de ese MIA.
+_PRIMERAS_DE_SU_MIA = """
+    FROM entradas e
+    WHERE e.estado = ?
+      AND NOT EXISTS (
+          SELECT 1 FROM entradas p
+          WHERE p.mie_id = e.mie_id AND p.seq < e.seq AND p.estado IN (?, ?)
+      )
+"""
+
+
+def _siguiente():
+    """
+    (fila, espera): la entrada más vieja que ya se puede aplicar, o None y
+    los segundos hasta que la próxima salga del backoff (None si no hay).
+    """
+    con = _conexion()
+    params = (PENDIENTE, PENDIENTE, FALLIDA)
+    fila = con.execute(
+        f"SELECT e.* {_PRIMERAS_DE_SU_MIA} AND e.proximo_intento <= ? ORDER BY e.seq LIMIT 1",
+        (*params, time.time()),
+    ).fetchone()
+    if fila is not None:
+        return fila, 0
+    proximo = con.execute(f"SELECT MIN(e.proximo_intento) AS t {_PRIMERAS_DE_SU_MIA}", params).fetchone()["t"]
+    return None, (None if proximo is None else max(0.0, proximo - time.time()))
+
+
+def _purgar_confirmadas():
+    _conexion().execute(
+        "DELETE FROM entradas WHERE estado = ? AND confirmada < ?",
+        (CONFIRMADA, time.time() - JOURNAL_RETENER_SEG),
+    )
+
+
+def _drenar():
+    while True:
+        try:
+            # clear antes de mirar: un encolar posterior siempre despierta
+            _hay_trabajo.clear()
+            fila, espera = _siguiente()
+            if fila is None:
+                if espera is None:
+                    _purgar_confirmadas()
+                    espera = JOURNAL_REINTENTO_MAX_SEG
+                _hay_trabajo.wait(espera)
+                continue
+
+            _procesar(fila)
+        except Exception:
+            # El journal en sí falló (disco, SQLite): no matar el hilo
+            logger.exception("Error drenando el journal")
+            time.sleep(1)
+
+
+def _procesar(fila):
+    con = _conexion()
+    try:
+        _aplicar(fila["tipo"], fila["mie_id"], _de_json(fila["campos"]), fila["intentos"] > 0)
+    except Exception as e:
+        intentos = fila["intentos"] + 1
+        if intentos >= JOURNAL_MAX_INTENTOS:
+            con.execute(
+                "UPDATE entradas SET estado = ?, intentos = ?, ultimo_error = ? WHERE id = ?",
+                (FALLIDA, intentos, str(e)[:500], fila["id"]),
+            )
+            logger.error("Entrada %s (%s MIA %s) FALLIDA tras %d intentos: %s",
+                         fila["id"], fila["tipo"], fila["mie_id"], intentos, e)
+            return
+        espera = min(JOURNAL_REINTENTO_MAX_SEG, 0.5 * 2 ** intentos)
+        con.execute(
+            "UPDATE entradas SET intentos = ?, ultimo_error = ?, proximo_intento = ? WHERE id = ?",
+            (intentos, str(e)[:500], time.time() + espera, fila["id"]),
+        )
+        logger.warning("Entrada %s (%s MIA %s) falló, intento %d: %s",
+                       fila["id"], fila["tipo"], fila["mie_id"], intentos, e)
+        return
+
+    con.execute(
+        "UPDATE entradas SET estado = ?, confirmada = ?, ultimo_error = NULL WHERE id = ?",
+        (CONFIRMADA, time.time(), fila["id"]),
+    )
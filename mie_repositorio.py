@@ -0,0 +1,407 @@
+# ============================================================
+# mie_repositorio.py — interfaz de almacenamiento del backend MIA
+# ============================================================
+# mie_backend no habla directo con BigQuery / GCS: usa un repositorio
+# (tablas) y un almacén de fotos (blobs). Hay dos implementaciones:
+#   - "gcp":   BigQuery + Cloud Storage (producción)      -> mie_repositorio_bigquery
+#   - "local": SQLite + carpeta en disco (dev / benchmarks) -> mie_repositorio_local
+# Se elige con MIE_ALMACENAMIENTO (ver config.py).
+
+import threading
+from abc import ABC, abstractmethod
+
+from config import ALMACENAMIENTO
+
+
+# ---------------------------------------------------------
+# Schema (compartido por las implementaciones)
+# ---------------------------------------------------------
+COLUMNAS_EVENTOS = {
+    "mie_id": "INT64",
+    "codigo_mie": "STRING",
+    "drm": "STRING",
+    "pozo": "STRING",
+    "locacion": "STRING",
+    "fluido": "STRING",
+    "volumen_estimado_m3": "FLOAT64",
+    "causa_probable": "STRING",
+    "responsable": "STRING",
+    "observaciones": "STRING",
+    "estado": "STRING",
+    "creado_por": "STRING",
+    "fecha_hora_evento": "TIMESTAMP",
+    "fecha_creacion_registro": "TIMESTAMP",
+    "fecha_modificacion": "TIMESTAMP",
+
+    "observador_apellido": "STRING",
+    "observador_nombre": "STRING",
+    "responsable_inst_apellido": "STRING",
+    "responsable_inst_nombre": "STRING",
+    "yacimiento": "STRING",
+    "zona": "STRING",
+    "nombre_instalacion": "STRING",
+    "latitud": "STRING",
+    "longitud": "STRING",
+
+    "tipo_afectacion": "STRING",
+    "tipo_derrame": "STRING",
+    "tipo_instalacion": "STRING",
+    "causa_inmediata": "STRING",
+
+    "volumen_bruto_m3": "FLOAT64",
+    "volumen_gas_m3": "FLOAT64",
+    "ppm_agua": "STRING",
+    "volumen_crudo_m3": "FLOAT64",
+    "area_afectada_m2": "FLOAT64",
+
+    "recursos_afectados": "STRING",
+    "magnitud": "STRING",
+
+    "aviso_sen": "STRING",
+    "difusion_mediatica": "STRING",
+
+    "aviso_autoridad": "STRING",
+    "aviso_autoridad_fecha_hora": "TIMESTAMP",
+    "aviso_autoridad_emisor": "STRING",
+    "aviso_autoridad_medio": "STRING",
+    "aviso_autoridad_organismo": "STRING",
+    "aviso_autoridad_contacto": "STRING",
+
+    "aviso_superficiario": "STRING",
+    "aviso_superficiario_fecha_hora": "TIMESTAMP",
+    "aviso_superficiario_emisor": "STRING",
+    "aviso_superficiario_medio": "STRING",
+    "aviso_superficiario_organismo": "STRING",
+    "aviso_superficiario_contacto": "STRING",
+
+    "medidas_inmediatas": "STRING",
+
+    "aprobador_apellido": "STRING",
+    "aprobador_nombre": "STRING",
+    "fecha_hora_aprobacion": "TIMESTAMP",
+
+    # Remediación / cierre
+    "rem_fecha_fin_saneamiento": "TIMESTAMP",
+    "rem_volumen_tierra_levantada": "FLOAT64",
+    "rem_destino_tierra_impactada": "STRING",
+    "rem_volumen_liquido_recuperado": "FLOAT64",
+    "rem_comentarios": "STRING",
+    "rem_aprobador_apellido": "STRING",
+    "rem_aprobador_nombre": "STRING",
+    "rem_fecha": "TIMESTAMP",
+    "rem_responsable": "STRING",
+    "rem_detalle": "STRING",
+
+    # Huella del formulario de alta (SHA-256): el mismo envío no crea dos MIA
+    "clave_idempotencia": "STRING",
+}
+
+# Columnas de picklist: en los DataFrames van como category (pocos valores
+# distintos repetidos en miles de filas)
+COLUMNAS_CATEGORICAS = (
+    "estado",
+    "fluido",
+    "yacimiento",
+    "zona",
+    "tipo_afectacion",
+    "tipo_derrame",
+    "tipo_instalacion",
+    "causa_inmediata",
+    "magnitud",
+    "aviso_sen",
+    "difusion_mediatica",
+    "aviso_autoridad",
+    "aviso_superficiario",
+)
+
+COLUMNAS_FOTOS = {
+    "id": "INT64",
+    "mie_id": "INT64",
+    "tipo": "STRING",
+    "url_foto": "STRING",
+    "url_thumb": "STRING",
+    "url_medium": "STRING",
+    "url_original": "STRING",
+    "hash_contenido": "STRING",     # SHA-256 del archivo subido (url_foto deriva de él)
+    "fecha_hora": "TIMESTAMP",
+}
+
+
+# codigo_mie (MIE-<año>-<n>) sale de una sola fila de mie_secuencias para
+# todos los años: valor = año * CODIGO_BASE_ANIO + n. Con el piso del año
+# (ver reservar_bloque) el contador vuelve a 1 en enero sin sembrar filas
+# nuevas en caliente.
+SECUENCIA_CODIGO = "codigo_mie"
+CODIGO_BASE_ANIO = 1_000_000
+
+
+def formato_codigo(year: int, numero: int) -> str:
+    return f"MIE-{year}-{numero:04d}"
+
+
+def lista_select(columnas=None) -> str:
+    """Lista del SELECT para `columnas` (None = todas). Solo acepta columnas del schema."""
+    if columnas is None:
+        return "*"
+    desconocidas = [c for c in columnas if c not in COLUMNAS_EVENTOS]
+    if desconocidas:
+        raise ValueError(f"Columnas desconocidas en mie_eventos: {desconocidas}")
+    return ", ".join(dict.fromkeys(columnas))
+
+
+def tipar_dataframe(df):
+    """
+    Dtypes fijos por columna, sea cual sea el origen: TIMESTAMP ->
+    datetime64[ns, UTC], INT64 -> Int64, FLOAT64 -> float64, picklists ->
+    category. Devuelve el mismo DataFrame.
+    """
+    import pandas as pd
+
+    for col in df.columns:
+        tipo = COLUMNAS_EVENTOS.get(col)
+        if tipo == "TIMESTAMP":
+            df[col] = pd.to_datetime(df[col], errors="coerce", utc=True)
+        elif tipo == "FLOAT64":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif tipo == "INT64":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
+        elif col in COLUMNAS_CATEGORICAS:
+            df[col] = df[col].astype("category")
+    return df
+
+
+# ---------------------------------------------------------
+# Tipos comunes
+# ---------------------------------------------------------
+class Fila:
+    """
+    Fila de resultado con la misma interfaz que bigquery.Row: r["x"], r[0],
+    r.x, r.get("x"), keys() / items(), dict(r). Como Row, iterar da los
+    valores (no los nombres de columna).
+    """
+
+    __slots__ = ("_valores", "_indices")
+
+    def __init__(self, pares):
+        datos = dict(pares)
+        self._valores = tuple(datos.values())
+        self._indices = {c: i for i, c in enumerate(datos)}
+
+    def keys(self):
+        return self._indices.keys()
+
+    def values(self):
+        return self._valores
+
+    def items(self):
+        return [(c, self._valores[i]) for c, i in self._indices.items()]
+
+    def get(self, nombre, default=None):
+        i = self._indices.get(nombre)
+        return default if i is None else self._valores[i]
+
+    def __getitem__(self, clave):
+        if isinstance(clave, (int, slice)):
+            return self._valores[clave]
+        return self._valores[self._indices[clave]]
+
+    def __getattr__(self, nombre):
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        try:
+            return self._valores[self._indices[nombre]]
+        except KeyError:
+            raise AttributeError(nombre) from None
+
+    def __iter__(self):
+        return iter(self._valores)
+
+    def __len__(self):
+        return len(self._valores)
+
+    def __eq__(self, otra):
+        if not isinstance(otra, Fila):
+            return NotImplemented
+        return self._valores == otra._valores and self._indices == otra._indices
+
+    def __repr__(self):
+        return f"Fila({dict(self.items())!r})"
+
+
+class BlobNoEncontrado(Exception):
+    """El blob pedido no existe en el almacén."""
+
+
+# ---------------------------------------------------------
+# Interfaces
+# ---------------------------------------------------------
+class RepositorioMIE(ABC):
+    """Tablas mie_eventos / mie_fotos / mie_secuencias."""
+
+    @abstractmethod
+    def reservar_bloque(self, nombre: str, cantidad: int, semilla: tuple, piso: int = 0) -> int:
+        """
+        Reserva `cantidad` valores de la secuencia `nombre` y devuelve el
+        último: valor = max(valor, piso) + cantidad. `semilla` da el valor
+        inicial de una secuencia nueva: ("max", tabla, campo) o ("codigo",
+        year). Solo se siembra en el momento donde es atómico (SQLite); en
+        BigQuery las siembra crear_tablas.py y una secuencia faltante es error.
+        """
+
+    @abstractmethod
+    def insertar_evento(self, fila: dict):
+        ...
+
+    @abstractmethod
+    def evento_por_clave(self, clave: str):
+        """
+        Fila (mie_id, codigo_mie) del MIA dado de alta con esa
+        clave_idempotencia, o None. Si hubiera más de uno, el primero creado.
+        """
+
+    @abstractmethod
+    def listar_eventos_pagina(self, limite: int, cursor=None, codigo_prefijo=None,
+                              instalacion=None, estado=None, desde=None, hasta=None) -> list:
+        """
+        Hasta `limite` filas del listado, más recientes primero, ordenadas por
+        (fecha_creacion_registro, mie_id) DESC. `cursor`: ese par de la última
+        fila de la página anterior (keyset). `desde` / `hasta` acotan
+        fecha_hora_evento (hasta es exclusivo).
+        """
+
+    @abstractmethod
+    def obtener_evento(self, mie_id: int, columnas=None):
+        """Fila de mie_eventos con solo `columnas` (None = todas)."""
+
+    @abstractmethod
+    def actualizar_evento(self, mie_id: int, campos: dict):
+        ...
+
+    @abstractmethod
+    def eventos_dataframe(self, columnas=None, desde=None):
+        """
+        DataFrame tipado (sin pasar por filas Python) de mie_eventos,
+        ordenado por fecha_creacion_registro. `desde`: solo filas con
+        fecha_modificacion >= desde (None = todas). Ver tipar_dataframe.
+        """
+
+    @abstractmethod
+    def fotos_de_mie(self, mie_id: int, tipo=None) -> list:
+        """Filas de mie_fotos (todas las columnas) ordenadas por fecha_hora."""
+
+    @abstractmethod
+    def insertar_fotos(self, filas: list):
+        ...
+
+    @abstractmethod
+    def reemplazar_fotos(self, mie_id: int, tipo: str, filas: list) -> list:
+        """
+        En una sola transacción borra las fotos `tipo` del MIA e inserta
+        `filas`. Devuelve las filas borradas (url_foto y demás blobs).
+        """
+
+    @abstractmethod
+    def fotos_referenciadas(self, urls: list) -> set:
+        """Las `urls` (url_foto) que todavía usa alguna fila de mie_fotos."""
+
+
+class AlmacenFotos(ABC):
+    """Blobs de fotos (bucket o carpeta)."""
+
+    @abstractmethod
+    def subir(self, nombre: str, file_obj, content_type=None, metadata=None):
+        """
+        Sube el blob con la marca de último uso en ahora. `metadata`: dict
+        de strings que devuelve marcar_uso.
+        """
+
+    @abstractmethod
+    def subir_bytes(self, nombre: str, data: bytes, content_type=None, metadata=None):
+        """Como subir, desde bytes en memoria."""
+
+    @abstractmethod
+    def descargar(self, nombre: str, timeout=None):
+        """(bytes, generacion). Lanza BlobNoEncontrado si no existe."""
+
+    @abstractmethod
+    def marcar_uso(self, nombre: str):
+        """
+        Refresca la marca de último uso de `nombre` (se va a volver a
+        referenciar) y devuelve su metadata (dict, vacío si no tiene). None
+        si el blob no existe.
+        """
+
+    @abstractmethod
+    def listar(self, prefijo: str):
+        """(nombre, último uso como datetime UTC) de cada blob bajo `prefijo`."""
+
+    def url_firmada(self, nombre: str, vigencia_seg: int):
+        """
+        URL temporal para que el navegador baje el blob directo del almacén.
+        None si el almacén no la puede dar (se sirven los bytes).
+        """
+        return None
+
+    @abstractmethod
+    def borrar_sin_uso(self, nombres: list, gracia_seg: int) -> list:
+        """
+        Borra los blobs de `nombres` cuyo último uso (subida o marcar_uso)
+        fue hace más de `gracia_seg`. Devuelve los que quedaron por haberse
+        usado hace menos; los que no existen se ignoran.
+        """
+
+
+# ---------------------------------------------------------
+# Selección de implementación
+# ---------------------------------------------------------
+class Perezoso:
+    """
+    Objeto que se crea con `crear()` recién al primer atributo pedido, una
+    sola vez por proceso aunque lo pidan varios hilos. Importar el backend
+    no carga las librerías de Google ni abre clientes.
+    """
+
+    def __init__(self, crear):
+        self._crear = crear
+        self._objeto = None
+        self._lock = threading.Lock()
+
+    def _obtener(self):
+        if self._objeto is None:
+            with self._lock:
+                if self._objeto is None:
+                    self._objeto = self._crear()
+        return self._objeto
+
+    def __getattr__(self, nombre):
+        return getattr(self._obtener(), nombre)
+
+
+def crear_repositorio() -> RepositorioMIE:
+    if ALMACENAMIENTO == "local":
+        from mie_repositorio_local import RepositorioLocal
+        return RepositorioLocal()
+    if ALMACENAMIENTO == "gcp":
+        from mie_repositorio_bigquery import RepositorioBigQuery
+        return RepositorioBigQuery()
+    raise ValueError(f"MIE_ALMACENAMIENTO desconocido: {ALMACENAMIENTO!r}")
+
+
+def crear_almacen() -> AlmacenFotos:
+    if ALMACENAMIENTO == "local":
+        from mie_repositorio_local import AlmacenLocal
+        return AlmacenLocal()
+    if ALMACENAMIENTO == "gcp":
+        from mie_repositorio_bigquery import AlmacenGCS
+        return AlmacenGCS()
+    raise ValueError(f"MIE_ALMACENAMIENTO desconocido: {ALMACENAMIENTO!r}")
+
+
+def crear_almacenamiento():
+    """
+    (repositorio, almacén) según MIE_ALMACENAMIENTO, perezosos: cada uno
+    se crea (con sus clientes) la primera vez que se usa.
+    """
+    if ALMACENAMIENTO not in ("local", "gcp"):
+        raise ValueError(f"MIE_ALMACENAMIENTO desconocido: {ALMACENAMIENTO!r}")
+    return Perezoso(crear_repositorio), Perezoso(crear_almacen)
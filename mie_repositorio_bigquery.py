@@ -0,0 +1,627 @@
+# ============================================================
+# mie_repositorio_bigquery.py — almacenamiento MIA en BigQuery + GCS
+# ============================================================
+
+import calendar
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import google.auth
+from google.api_core.exceptions import (
+    AlreadyExists,
+    BadRequest,
+    FailedPrecondition,
+    InvalidArgument,
+    NotFound,
+    PreconditionFailed,
+)
+from google.auth.credentials import Signing
+from google.auth.transport.requests import Request
+from google.cloud import bigquery, storage
+from google.cloud import bigquery_storage_v1
+from google.cloud.bigquery_storage_v1 import types as bqs_types
+from google.cloud.bigquery_storage_v1 import writer as bqs_writer
+from google.cloud.storage.retry import DEFAULT_RETRY
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+import mie_diagnostico
+from config import PROJECT_ID, DATASET_ID, BUCKET_NAME, SUBIDA_CHUNK_MB, FOTOS_CACHE_CONTROL
+from mie_repositorio import (
+    COLUMNAS_EVENTOS,
+    COLUMNAS_FOTOS,
+    AlmacenFotos,
+    BlobNoEncontrado,
+    RepositorioMIE,
+    lista_select,
+    tipar_dataframe,
+)
+
+TABLA_EVENTOS = f"{PROJECT_ID}.{DATASET_ID}.mie_eventos"
+TABLA_FOTOS = f"{PROJECT_ID}.{DATASET_ID}.mie_fotos"
+TABLA_SECUENCIAS = f"{PROJECT_ID}.{DATASET_ID}.mie_secuencias"
+
+
+def _parametro(nombre: str, tipo: str, valor):
+    if tipo == "TIMESTAMP" and isinstance(valor, datetime):
+        valor = valor.isoformat()
+    return bigquery.ScalarQueryParameter(nombre, tipo, valor)
+
+
+# ---------------------------------------------------------
+# IDs: reserva por bloques (tabla mie_secuencias)
+# ---------------------------------------------------------
+# Cada secuencia es una fila de mie_secuencias; un UPDATE dentro de una
+# transacción reserva el bloque (dos instancias a la vez: BigQuery aborta
+# una y se reintenta). Las filas las siembra crear_tablas.py: sembrar acá en
+# el primer uso no es seguro, BigQuery no tiene claves únicas y dos altas
+# simultáneas de la misma fila entregarían el mismo bloque.
+_SQL_RESERVA = f"""
+    DECLARE fin INT64;
+
+    BEGIN TRANSACTION;
+    UPDATE `{TABLA_SECUENCIAS}`
+    SET valor = GREATEST(valor, @piso) + @cantidad, actualizado = CURRENT_TIMESTAMP()
+    WHERE nombre = @nombre;
+    IF @@row_count = 0 THEN
+        RAISE USING MESSAGE = FORMAT('Secuencia %s sin sembrar: correr crear_tablas.py', @nombre);
+    END IF;
+    SET fin = (SELECT MAX(valor) FROM `{TABLA_SECUENCIAS}` WHERE nombre = @nombre);
+    COMMIT TRANSACTION;
+
+    SELECT fin AS fin;
+"""
+
+
+# ---------------------------------------------------------
+# Storage Write API (altas sin job DML)
+# ---------------------------------------------------------
+_PROTO_TIPOS = {
+    "STRING": descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+    "INT64": descriptor_pb2.FieldDescriptorProto.TYPE_INT64,
+    "FLOAT64": descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE,
+    "TIMESTAMP": descriptor_pb2.FieldDescriptorProto.TYPE_INT64,   # microsegundos epoch
+}
+
+_REINTENTOS_APPEND = 3
+_TIMEOUT_APPEND_SEG = 30
+
+_protos = {}
+_protos_lock = threading.Lock()
+
+
+def _proto_filas(tabla: str, columnas: dict):
+    """(DescriptorProto, clase de mensaje) para filas de `tabla` con esas columnas."""
+    clave = (tabla, tuple(columnas.items()))
+    with _protos_lock:
+        if clave not in _protos:
+            nombre = f"Fila_{tabla}"
+            descriptor = descriptor_pb2.DescriptorProto(name=nombre)
+            for i, (col, tipo) in enumerate(columnas.items(), start=1):
+                descriptor.field.add(
+                    name=col,
+                    number=i,
+                    type=_PROTO_TIPOS[tipo],
+                    label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+                )
+            # proto2: los campos opcionales sin valor se escriben como NULL
+            archivo = descriptor_pb2.FileDescriptorProto(name=f"{nombre}.proto", syntax="proto2")
+            archivo.message_type.add().CopyFrom(descriptor)
+            pool = descriptor_pool.DescriptorPool()
+            pool.Add(archivo)
+            clase = message_factory.GetMessageClass(pool.FindMessageTypeByName(nombre))
+            _protos[clave] = (descriptor, clase)
+        return _protos[clave]
+
+
+def _a_micros(dt: datetime) -> int:
+    # Igual que los parámetros TIMESTAMP: un datetime naive se toma como UTC
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(dt.timetuple()) * 1_000_000 + dt.microsecond
+
+
+class _StreamCommitted:
+    """
+    Stream COMMITTED de una tabla, creado una vez por proceso y reusado por
+    todas sus escrituras (AppendRowsStream: una conexión abierta, sin crear
+    ni finalizar un stream por insert). Cada append lleva su offset: si un
+    reintento repite uno que ya llegó, el servidor responde ALREADY_EXISTS y
+    no duplica (exactly-once). Los appends van de a uno: el offset del
+    próximo depende de cómo terminó el anterior.
+    """
+
+    def __init__(self, write_client, tabla: str, columnas: dict):
+        self._client = write_client
+        self._tabla = tabla
+        self._columnas = columnas
+        self._descriptor, self._clase = _proto_filas(tabla, columnas)
+        self._lock = threading.Lock()
+        self._conexion = None
+        self._offset = 0
+
+    def _abrir(self):
+        stream = self._client.create_write_stream(
+            parent=self._client.table_path(PROJECT_ID, DATASET_ID, self._tabla),
+            write_stream=bqs_types.WriteStream(type_=bqs_types.WriteStream.Type.COMMITTED),
+        )
+        plantilla = bqs_types.AppendRowsRequest(
+            write_stream=stream.name,
+            proto_rows=bqs_types.AppendRowsRequest.ProtoData(
+                writer_schema=bqs_types.ProtoSchema(proto_descriptor=self._descriptor),
+            ),
+        )
+        self._conexion = bqs_writer.AppendRowsStream(self._client, plantilla)
+        self._offset = 0
+
+    def _descartar(self):
+        # El próximo append abre un stream nuevo (offset 0)
+        try:
+            self._conexion.close()
+        except Exception:
+            pass
+        self._conexion = None
+
+    def _serializar(self, fila: dict) -> bytes:
+        msg = self._clase()
+        for col, tipo in self._columnas.items():
+            valor = fila.get(col)
+            if valor is None:
+                continue
+            if tipo == "TIMESTAMP":
+                valor = _a_micros(valor)
+            setattr(msg, col, valor)
+        return msg.SerializeToString()
+
+    def escribir(self, filas: list):
+        request = bqs_types.AppendRowsRequest(
+            proto_rows=bqs_types.AppendRowsRequest.ProtoData(
+                rows=bqs_types.ProtoRows(serialized_rows=[self._serializar(f) for f in filas]),
+            ),
+        )
+        with self._lock:
+            espera = 0.5
+            for intento in range(_REINTENTOS_APPEND):
+                ultimo = intento == _REINTENTOS_APPEND - 1
+                if self._conexion is None:
+                    self._abrir()
+                request.offset = self._offset
+                try:
+                    self._conexion.send(request).result(timeout=_TIMEOUT_APPEND_SEG)
+                except AlreadyExists:
+                    # Un intento anterior de este mismo append ya había llegado
+                    pass
+                except InvalidArgument:
+                    # Filas rechazadas: el append no se aplicó ni ocupó el offset
+                    raise
+                except (NotFound, FailedPrecondition):
+                    # Stream inexistente o finalizado: el append no se aplicó
+                    self._descartar()
+                    if ultimo:
+                        raise
+                    continue
+                except Exception:
+                    if ultimo:
+                        # El append pudo haber llegado igual: ese offset ya no
+                        # es confiable para la próxima escritura
+                        self._descartar()
+                        raise
+                    time.sleep(espera)
+                    espera *= 2
+                    continue
+                self._offset += len(filas)
+                return
+
+
+# ---------------------------------------------------------
+# Repositorio (tablas)
+# ---------------------------------------------------------
+class RepositorioBigQuery(RepositorioMIE):
+
+    def __init__(self):
+        self.bq_client = bigquery.Client(project=PROJECT_ID)
+        self._write_client = None
+        self._bqstorage_client = None
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+
+    @property
+    def write_client(self):
+        # Cliente de la Storage Write API: recién con la primera escritura
+        if self._write_client is None:
+            self._write_client = bigquery_storage_v1.BigQueryWriteClient()
+        return self._write_client
+
+    def _ejecutar(self, query: str, params=()):
+        """
+        Corre la consulta y registra sus métricas (ver mie_diagnostico),
+        también si falla o se cancela.
+        """
+        cfg = bigquery.QueryJobConfig(query_parameters=list(params))
+        inicio = time.perf_counter()
+        job = None
+        try:
+            job = self.bq_client.query(query, cfg)
+            resultado = job.result()
+        except BaseException as e:
+            mie_diagnostico.registrar_job(job, (time.perf_counter() - inicio) * 1000, error=e)
+            raise
+        mie_diagnostico.registrar_job(job, (time.perf_counter() - inicio) * 1000)
+        return resultado
+
+    def _consultar(self, query: str, params=()):
+        return list(self._ejecutar(query, params))
+
+    # ---------------- Secuencias ----------------
+    def _consultar_transaccion(self, query: str, params=()):
+        """
+        Corre un script con transacción. Si otra transacción tocó las mismas
+        filas a la vez BigQuery aborta una de las dos: se reintenta con backoff.
+        """
+        espera = 0.5
+        for intento in range(6):
+            try:
+                return self._consultar(query, params)
+            except Exception as e:
+                if "concurrent" not in str(e).lower() or intento == 5:
+                    raise
+                time.sleep(espera)
+                espera *= 2
+
+    def reservar_bloque(self, nombre: str, cantidad: int, semilla: tuple, piso: int = 0) -> int:
+        params = [
+            bigquery.ScalarQueryParameter("nombre", "STRING", nombre),
+            bigquery.ScalarQueryParameter("cantidad", "INT64", cantidad),
+            bigquery.ScalarQueryParameter("piso", "INT64", piso),
+        ]
+        return self._consultar_transaccion(_SQL_RESERVA, params)[0].fin
+
+    # ---------------- Eventos ----------------
+    def _escribir_filas_committed(self, tabla: str, columnas: dict, filas: list):
+        """
+        Escribe `filas` con la Storage Write API por el stream COMMITTED de
+        la tabla (ver _StreamCommitted). A diferencia de insert_rows_json,
+        las filas admiten UPDATE enseguida.
+        """
+        inicio = time.perf_counter()
+        with self._streams_lock:
+            if tabla not in self._streams:
+                self._streams[tabla] = _StreamCommitted(self.write_client, tabla, columnas)
+            stream = self._streams[tabla]
+        error = None
+        try:
+            stream.escribir(filas)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            mie_diagnostico.registrar(
+                motor="bigquery",
+                tipo="STORAGE_WRITE",
+                wall_ms=round((time.perf_counter() - inicio) * 1000, 1),
+                filas=len(filas),
+                estado=mie_diagnostico.estado_de(error),
+                **({"error": str(error)[:300]} if error is not None else {}),
+            )
+
+    def insertar_evento(self, fila: dict):
+        # Storage Write API en vez de un job DML. Schema completo: un solo
+        # stream para la tabla (las columnas que no vienen quedan en NULL).
+        self._escribir_filas_committed("mie_eventos", COLUMNAS_EVENTOS, [fila])
+
+    def evento_por_clave(self, clave: str):
+        # Solo por la clave: la fecha del evento se puede editar después del alta
+        query = f"""
+            SELECT mie_id, codigo_mie
+            FROM `{TABLA_EVENTOS}`
+            WHERE clave_idempotencia = @clave
+            ORDER BY fecha_creacion_registro, mie_id
+            LIMIT 1
+        """
+        rows = self._consultar(query, [bigquery.ScalarQueryParameter("clave", "STRING", clave)])
+        return rows[0] if rows else None
+
+    def listar_eventos_pagina(self, limite: int, cursor=None, codigo_prefijo=None,
+                              instalacion=None, estado=None, desde=None, hasta=None) -> list:
+        condiciones, params = [], [bigquery.ScalarQueryParameter("limite", "INT64", limite)]
+        if cursor is not None:
+            condiciones.append(
+                "(fecha_creacion_registro < @c_fecha"
+                " OR (fecha_creacion_registro = @c_fecha AND mie_id < @c_id))"
+            )
+            params += [
+                _parametro("c_fecha", "TIMESTAMP", cursor[0]),
+                bigquery.ScalarQueryParameter("c_id", "INT64", cursor[1]),
+            ]
+        if codigo_prefijo:
+            condiciones.append("STARTS_WITH(codigo_mie, @prefijo)")
+            params.append(bigquery.ScalarQueryParameter("prefijo", "STRING", codigo_prefijo))
+        if instalacion:
+            condiciones.append(
+                "STRPOS(LOWER(COALESCE(nombre_instalacion, pozo, '')), LOWER(@inst)) > 0"
+            )
+            params.append(bigquery.ScalarQueryParameter("inst", "STRING", instalacion))
+        if estado:
+            condiciones.append("estado = @estado")
+            params.append(bigquery.ScalarQueryParameter("estado", "STRING", estado))
+        if desde is not None:
+            condiciones.append("fecha_hora_evento >= @desde")
+            params.append(_parametro("desde", "TIMESTAMP", desde))
+        if hasta is not None:
+            condiciones.append("fecha_hora_evento < @hasta")
+            params.append(_parametro("hasta", "TIMESTAMP", hasta))
+
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        query = f"""
+            SELECT mie_id, codigo_mie, pozo, nombre_instalacion,
+                   estado, fecha_creacion_registro
+            FROM `{TABLA_EVENTOS}`
+            {where}
+            ORDER BY fecha_creacion_registro DESC, mie_id DESC
+            LIMIT @limite
+        """
+        return self._consultar(query, params)
+
+    def obtener_evento(self, mie_id: int, columnas=None):
+        query = f"""
+            SELECT {lista_select(columnas)}
+            FROM `{TABLA_EVENTOS}`
+            WHERE mie_id = @id
+        """
+        rows = self._consultar(query, [bigquery.ScalarQueryParameter("id", "INT64", mie_id)])
+        return rows[0] if rows else None
+
+    def actualizar_evento(self, mie_id: int, campos: dict):
+        sets = ",\n                ".join(f"{col}=@{col}" for col in campos)
+        query = f"""
+            UPDATE `{TABLA_EVENTOS}`
+            SET
+                {sets}
+            WHERE mie_id=@mie_id
+        """
+        params = [_parametro(col, COLUMNAS_EVENTOS[col], v) for col, v in campos.items()]
+        params.append(bigquery.ScalarQueryParameter("mie_id", "INT64", mie_id))
+        self._consultar(query, params)
+
+    def _read_client(self):
+        # Cliente de la Storage Read API: solo se crea si alguien pide un DataFrame
+        if self._bqstorage_client is None:
+            self._bqstorage_client = bigquery_storage_v1.BigQueryReadClient()
+        return self._bqstorage_client
+
+    def eventos_dataframe(self, columnas=None, desde=None):
+        where, params = "", []
+        if desde is not None:
+            where = "WHERE fecha_modificacion >= @desde"
+            params.append(_parametro("desde", "TIMESTAMP", desde))
+        query = f"""
+            SELECT {lista_select(columnas)}
+            FROM `{TABLA_EVENTOS}`
+            {where}
+            ORDER BY fecha_creacion_registro
+        """
+        # Resultado en Arrow -> DataFrame, sin filas Python intermedias. Si el
+        # resultado entra en la primera página la librería no usa la Read API.
+        df = self._ejecutar(query, params).to_dataframe(
+            bqstorage_client=self._read_client(),
+        )
+        return tipar_dataframe(df)
+
+    # ---------------- Fotos ----------------
+    def fotos_de_mie(self, mie_id: int, tipo=None) -> list:
+        query = f"""
+            SELECT id, tipo, url_foto, url_thumb, url_medium, url_original, fecha_hora
+            FROM `{TABLA_FOTOS}`
+            WHERE mie_id = @id AND (@tipo IS NULL OR tipo = @tipo)
+            ORDER BY fecha_hora
+        """
+        return self._consultar(query, [
+            bigquery.ScalarQueryParameter("id", "INT64", mie_id),
+            bigquery.ScalarQueryParameter("tipo", "STRING", tipo),
+        ])
+
+    def insertar_fotos(self, filas: list):
+        # Storage Write API (igual que los eventos): a diferencia de
+        # insert_rows_json, las filas no quedan en el streaming buffer y el
+        # DELETE de reemplazar_fotos funciona enseguida. Exactly-once por offset.
+        self._escribir_filas_committed("mie_fotos", COLUMNAS_FOTOS, filas)
+
+    def reemplazar_fotos(self, mie_id: int, tipo: str, filas: list) -> list:
+        query = f"""
+            DECLARE viejas ARRAY<STRUCT<url_foto STRING, url_thumb STRING, url_medium STRING, url_original STRING>>;
+
+            BEGIN TRANSACTION;
+            SET viejas = ARRAY(
+                SELECT AS STRUCT url_foto, url_thumb, url_medium, url_original
+                FROM `{TABLA_FOTOS}`
+                WHERE mie_id = @id AND tipo = @tipo
+            );
+            DELETE FROM `{TABLA_FOTOS}` WHERE mie_id = @id AND tipo = @tipo;
+            INSERT INTO `{TABLA_FOTOS}` ({", ".join(COLUMNAS_FOTOS)})
+            SELECT {", ".join(COLUMNAS_FOTOS)}
+            FROM UNNEST(@filas);
+            COMMIT TRANSACTION;
+
+            SELECT v.* FROM UNNEST(viejas) AS v;
+        """
+        filas_param = bigquery.ArrayQueryParameter(
+            "filas",
+            "STRUCT",
+            [
+                bigquery.StructQueryParameter(
+                    None,
+                    *[_parametro(col, tipo_col, f.get(col)) for col, tipo_col in COLUMNAS_FOTOS.items()],
+                )
+                for f in filas
+            ],
+        )
+        return self._consultar(query, [
+            bigquery.ScalarQueryParameter("id", "INT64", mie_id),
+            bigquery.ScalarQueryParameter("tipo", "STRING", tipo),
+            filas_param,
+        ])
+
+    def fotos_referenciadas(self, urls: list) -> set:
+        if not urls:
+            return set()
+        query = f"""
+            SELECT DISTINCT url_foto
+            FROM `{TABLA_FOTOS}`
+            WHERE url_foto IN UNNEST(@urls)
+        """
+        filas = self._consultar(query, [
+            bigquery.ArrayQueryParameter("urls", "STRING", list(urls)),
+        ])
+        return {f.url_foto for f in filas}
+
+
+# ---------------------------------------------------------
+# Almacén de fotos (bucket GCS)
+# ---------------------------------------------------------
+_CHUNK_BYTES = SUBIDA_CHUNK_MB * 1024 * 1024     # múltiplo de 256 KiB (requisito de GCS)
+
+
+def _tamano(file_obj):
+    """Tamaño en bytes de un archivo subido / stream seekable (None si no se sabe)."""
+    tamano = getattr(file_obj, "size", None)
+    if tamano is not None:
+        return tamano
+    try:
+        actual = file_obj.tell()
+        tamano = file_obj.seek(0, 2) - actual
+        file_obj.seek(actual)
+        return tamano
+    except (AttributeError, OSError):
+        return None
+
+
+class AlmacenGCS(AlmacenFotos):
+
+    def __init__(self):
+        self.storage_client = storage.Client(project=PROJECT_ID)
+        self.bucket = self.storage_client.bucket(BUCKET_NAME)
+        self._credenciales_firma = None
+        self._firma_lock = threading.Lock()
+        self._emulador = os.environ.get("STORAGE_EMULATOR_HOST")
+
+    def subir(self, nombre: str, file_obj, content_type=None, metadata=None):
+        """
+        Sube leyendo `file_obj` de a SUBIDA_CHUNK_MB: nunca hay más de un
+        chunk en memoria además del propio archivo. Si una subida grande se
+        corta, el cliente pregunta al servidor cuánto llegó y sigue desde ahí.
+        """
+        tamano = _tamano(file_obj)
+        blob = self._blob_nuevo(nombre, metadata)
+        if tamano is None or tamano > _CHUNK_BYTES:
+            # Subida reanudable por chunks (un archivo chico va en un solo request)
+            blob.chunk_size = _CHUNK_BYTES
+        blob.upload_from_file(file_obj, size=tamano, content_type=content_type, retry=DEFAULT_RETRY)
+
+    def subir_bytes(self, nombre: str, data: bytes, content_type=None, metadata=None):
+        self._blob_nuevo(nombre, metadata).upload_from_string(data, content_type=content_type)
+
+    def _blob_nuevo(self, nombre: str, metadata=None):
+        # Cache-Control viaja como metadata del objeto: GCS lo devuelve en
+        # cada GET, también en los de URLs firmadas. custom_time (marca de
+        # último uso) va en la misma subida, sin un PATCH aparte.
+        blob = self.bucket.blob(nombre)
+        blob.cache_control = FOTOS_CACHE_CONTROL
+        blob.custom_time = datetime.now(timezone.utc)
+        if metadata:
+            blob.metadata = metadata
+        return blob
+
+    def url_firmada(self, nombre: str, vigencia_seg: int):
+        if self._emulador:
+            # El emulador no valida firmas: URL directa de descarga
+            return (
+                f"{self._emulador.rstrip('/')}/download/storage/v1/b/{BUCKET_NAME}"
+                f"/o/{quote(nombre, safe='')}?alt=media"
+            )
+
+        credenciales = self._credenciales_para_firmar()
+        kwargs = {}
+        if not isinstance(credenciales, Signing):
+            # Credenciales de metadata server (Cloud Run): sin clave privada,
+            # se firma con la API IAM signBlob usando el token de la cuenta.
+            kwargs = {
+                "service_account_email": credenciales.service_account_email,
+                "access_token": credenciales.token,
+            }
+        return self.bucket.blob(nombre).generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=vigencia_seg),
+            method="GET",
+            credentials=credenciales if not kwargs else None,
+            **kwargs,
+        )
+
+    def _credenciales_para_firmar(self):
+        with self._firma_lock:
+            if self._credenciales_firma is None:
+                self._credenciales_firma, _ = google.auth.default()
+            if not isinstance(self._credenciales_firma, Signing) and not self._credenciales_firma.valid:
+                self._credenciales_firma.refresh(Request())
+            return self._credenciales_firma
+
+    def descargar(self, nombre: str, timeout=None):
+        blob = self.bucket.blob(nombre)
+        try:
+            data = blob.download_as_bytes(timeout=timeout)
+        except NotFound as e:
+            raise BlobNoEncontrado(nombre) from e
+
+        if blob.generation is None:
+            blob.reload(timeout=timeout)
+        return data, blob.generation
+
+    def marcar_uso(self, nombre: str):
+        # custom_time (solo puede avanzar) es la marca de último uso del blob.
+        # La respuesta del PATCH trae el objeto completo: no hace falta un GET.
+        blob = self.bucket.blob(nombre)
+        blob.custom_time = datetime.now(timezone.utc)
+        try:
+            blob.patch(retry=DEFAULT_RETRY)
+        except NotFound:
+            return None
+        except BadRequest:
+            # Otro ya lo marcó con una hora posterior: el blob existe
+            try:
+                blob.reload()
+            except NotFound:
+                return None
+        return dict(blob.metadata or {})
+
+    def listar(self, prefijo: str):
+        blobs = self.storage_client.list_blobs(
+            self.bucket, prefix=prefijo,
+            fields="items(name,customTime,timeCreated),nextPageToken",
+        )
+        for blob in blobs:
+            yield blob.name, max(t for t in (blob.custom_time, blob.time_created) if t is not None)
+
+    def borrar_sin_uso(self, nombres: list, gracia_seg: int) -> list:
+        limite = datetime.now(timezone.utc) - timedelta(seconds=gracia_seg)
+        recientes = []
+        for nombre in nombres:
+            blob = self.bucket.get_blob(nombre)
+            if blob is None:
+                continue
+            uso = max(t for t in (blob.custom_time, blob.time_created) if t is not None)
+            if uso > limite:
+                recientes.append(nombre)
+                continue
+            try:
+                # Un marcar_uso entre el GET y el DELETE cambia la metageneración;
+                # una subida nueva del mismo nombre, la generación
+                blob.delete(
+                    if_generation_match=blob.generation,
+                    if_metageneration_match=blob.metageneration,
+                )
+            except NotFound:
+                pass
+            except PreconditionFailed:
+                recientes.append(nombre)
+        return recientes
@@ -0,0 +1,418 @@
+# ============================================================
+# mie_repositorio_local.py — almacenamiento MIA local (SQLite + disco)
+# ============================================================
+# Para desarrollo y benchmarks sin credenciales de GCP: las tablas van a
+# un archivo SQLite y las fotos a una carpeta, ambos dentro de LOCAL_DIR.
+
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import mie_diagnostico
+from config import LOCAL_DIR
+from mie_repositorio import (
+    CODIGO_BASE_ANIO,
+    COLUMNAS_EVENTOS,
+    COLUMNAS_FOTOS,
+    AlmacenFotos,
+    BlobNoEncontrado,
+    Fila,
+    RepositorioMIE,
+    lista_select,
+    tipar_dataframe,
+)
+
+_CHUNK_COPIA = 1024 * 1024
+_SUFIJO_META = ".meta.json"   # metadata de un blob (AlmacenLocal)
+
+_TIPOS_SQLITE = {
+    "STRING": "TEXT",
+    "INT64": "INTEGER",
+    "FLOAT64": "REAL",
+    "TIMESTAMP": "TIMESTAMP",
+}
+
+
+def _a_texto(dt: datetime) -> str:
+    # Igual que BigQuery: un datetime naive se toma como UTC
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(sep=" ")
+
+
+def _de_texto(valor: bytes) -> datetime:
+    return datetime.fromisoformat(valor.decode()).replace(tzinfo=timezone.utc)
+
+
+sqlite3.register_adapter(datetime, _a_texto)
+sqlite3.register_converter("TIMESTAMP", _de_texto)
+
+
+def _ddl(tabla: str, columnas: dict, clave: str) -> str:
+    cols = ",\n    ".join(
+        f"{c} {_TIPOS_SQLITE[t]}{' PRIMARY KEY' if c == clave else ''}"
+        for c, t in columnas.items()
+    )
+    return f"CREATE TABLE IF NOT EXISTS {tabla} (\n    {cols}\n)"
+
+
+# ---------------------------------------------------------
+# Repositorio (tablas)
+# ---------------------------------------------------------
+class RepositorioLocal(RepositorioMIE):
+
+    def __init__(self, directorio: str = LOCAL_DIR):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, "mie.sqlite3")
+        self._local = threading.local()
+        with self._conexion() as con:
+            con.execute(_ddl("mie_eventos", COLUMNAS_EVENTOS, "mie_id"))
+            con.execute(_ddl("mie_fotos", COLUMNAS_FOTOS, "id"))
+            self._agregar_columnas_faltantes(con, "mie_eventos", COLUMNAS_EVENTOS)
+            self._agregar_columnas_faltantes(con, "mie_fotos", COLUMNAS_FOTOS)
+            con.execute("CREATE INDEX IF NOT EXISTS mie_fotos_mie_id ON mie_fotos (mie_id)")
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS mie_eventos_listado "
+                "ON mie_eventos (fecha_creacion_registro DESC, mie_id DESC)"
+            )
+            # Sin UNIQUE: BigQuery tampoco lo garantiza (ver insertar_mie)
+            con.execute("DROP INDEX IF EXISTS mie_eventos_clave")
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS mie_eventos_clave_idempotencia "
+                "ON mie_eventos (clave_idempotencia) WHERE clave_idempotencia IS NOT NULL"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS mie_secuencias "
+                "(nombre TEXT PRIMARY KEY, valor INTEGER NOT NULL, actualizado TIMESTAMP)"
+            )
+
+    @staticmethod
+    def _agregar_columnas_faltantes(con, tabla: str, columnas: dict):
+        # Bases locales creadas con una versión anterior del schema
+        existentes = {r["name"] for r in con.execute(f"PRAGMA table_info({tabla})")}
+        for c, t in columnas.items():
+            if c not in existentes:
+                con.execute(f"ALTER TABLE {tabla} ADD COLUMN {c} {_TIPOS_SQLITE[t]}")
+
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión por hilo (los pools de subida / descarga y asyncio.to_thread)
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(
+                self.ruta,
+                timeout=30,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                isolation_level=None,
+            )
+            con.row_factory = lambda cur, row: Fila(zip((d[0] for d in cur.description), row))
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    def _consultar(self, query: str, params=()) -> list:
+        inicio = time.perf_counter()
+        filas, error = [], None
+        try:
+            filas = self._conexion().execute(query, params).fetchall()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            mie_diagnostico.registrar(
+                motor="sqlite",
+                tipo=query.split(None, 1)[0].upper(),
+                wall_ms=round((time.perf_counter() - inicio) * 1000, 1),
+                filas=len(filas),
+                estado=mie_diagnostico.estado_de(error),
+                **({"error": str(error)[:300]} if error is not None else {}),
+            )
+        return filas
+
+    # ---------------- Secuencias ----------------
+    def _semilla(self, con, semilla: tuple) -> int:
+        if semilla[0] == "max":
+            _, tabla, campo = semilla
+            valor = con.execute(f"SELECT MAX({campo}) AS v FROM {tabla}").fetchone().v
+        elif semilla[0] == "codigo":
+            year = semilla[1]
+            prefijo = f"MIE-{year}-"
+            ultimo = con.execute(
+                "SELECT MAX(CAST(substr(codigo_mie, ?) AS INTEGER)) AS v "
+                "FROM mie_eventos WHERE codigo_mie LIKE ?",
+                (len(prefijo) + 1, prefijo + "%"),
+            ).fetchone().v
+            valor = year * CODIGO_BASE_ANIO + (ultimo or 0)
+        else:
+            raise ValueError(f"Semilla desconocida: {semilla!r}")
+        return valor or 0
+
+    def _reservar(self, con, nombre: str, cantidad: int, semilla: tuple, piso: int) -> int:
+        # Dentro de una transacción ya abierta con BEGIN IMMEDIATE
+        fila = con.execute("SELECT valor FROM mie_secuencias WHERE nombre = ?", (nombre,)).fetchone()
+        fin = max(fila.valor if fila else self._semilla(con, semilla), piso) + cantidad
+        con.execute(
+            "INSERT INTO mie_secuencias (nombre, valor, actualizado) VALUES (?, ?, ?) "
+            "ON CONFLICT(nombre) DO UPDATE SET valor = excluded.valor, actualizado = excluded.actualizado",
+            (nombre, fin, datetime.utcnow()),
+        )
+        return fin
+
+    def reservar_bloque(self, nombre: str, cantidad: int, semilla: tuple, piso: int = 0) -> int:
+        con = self._conexion()
+        # BEGIN IMMEDIATE toma el lock de escritura: reserva atómica entre procesos
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            fin = self._reservar(con, nombre, cantidad, semilla, piso)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return fin
+
+    # ---------------- Eventos ----------------
+    def insertar_evento(self, fila: dict):
+        cols = list(fila)
+        self._consultar(
+            f"INSERT INTO mie_eventos ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+            [fila[c] for c in cols],
+        )
+
+    def evento_por_clave(self, clave: str):
+        rows = self._consultar(
+            "SELECT mie_id, codigo_mie FROM mie_eventos WHERE clave_idempotencia = ? "
+            "ORDER BY fecha_creacion_registro, mie_id LIMIT 1",
+            (clave,),
+        )
+        return rows[0] if rows else None
+
+    def listar_eventos_pagina(self, limite: int, cursor=None, codigo_prefijo=None,
+                              instalacion=None, estado=None, desde=None, hasta=None) -> list:
+        condiciones, params = [], []
+        if cursor is not None:
+            condiciones.append("(fecha_creacion_registro, mie_id) < (?, ?)")
+            params += list(cursor)
+        if codigo_prefijo:
+            condiciones.append("substr(codigo_mie, 1, ?) = ?")
+            params += [len(codigo_prefijo), codigo_prefijo]
+        if instalacion:
+            condiciones.append("instr(lower(coalesce(nombre_instalacion, pozo, '')), lower(?)) > 0")
+            params.append(instalacion)
+        if estado:
+            condiciones.append("estado = ?")
+            params.append(estado)
+        if desde is not None:
+            condiciones.append("fecha_hora_evento >= ?")
+            params.append(desde)
+        if hasta is not None:
+            condiciones.append("fecha_hora_evento < ?")
+            params.append(hasta)
+
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return self._consultar(f"""
+            SELECT mie_id, codigo_mie, pozo, nombre_instalacion,
+                   estado, fecha_creacion_registro
+            FROM mie_eventos
+            {where}
+            ORDER BY fecha_creacion_registro DESC, mie_id DESC
+            LIMIT ?
+        """, [*params, limite])
+
+    def obtener_evento(self, mie_id: int, columnas=None):
+        rows = self._consultar(
+            f"SELECT {lista_select(columnas)} FROM mie_eventos WHERE mie_id = ?", (mie_id,)
+        )
+        return rows[0] if rows else None
+
+    def actualizar_evento(self, mie_id: int, campos: dict):
+        sets = ", ".join(f"{col} = ?" for col in campos)
+        self._consultar(
+            f"UPDATE mie_eventos SET {sets} WHERE mie_id = ?",
+            [*campos.values(), mie_id],
+        )
+
+    def eventos_dataframe(self, columnas=None, desde=None):
+        import pandas as pd
+
+        where, params = "", []
+        if desde is not None:
+            where, params = "WHERE fecha_modificacion >= ?", [desde]
+        # Conexión sin row_factory / converters: pandas lee las columnas directo
+        con = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            df = pd.read_sql_query(
+                f"SELECT {lista_select(columnas)} FROM mie_eventos {where} "
+                f"ORDER BY fecha_creacion_registro",
+                con,
+                params=params,
+            )
+        finally:
+            con.close()
+        return tipar_dataframe(df)
+
+    # ---------------- Fotos ----------------
+    def fotos_de_mie(self, mie_id: int, tipo=None) -> list:
+        return self._consultar(
+            """
+            SELECT id, tipo, url_foto, url_thumb, url_medium, url_original, fecha_hora
+            FROM mie_fotos
+            WHERE mie_id = ? AND (? IS NULL OR tipo = ?)
+            ORDER BY fecha_hora
+            """,
+            (mie_id, tipo, tipo),
+        )
+
+    def insertar_fotos(self, filas: list):
+        if not filas:
+            return
+        cols = list(COLUMNAS_FOTOS)
+        con = self._conexion()
+        con.execute("BEGIN")
+        try:
+            # OR IGNORE: mismo criterio que el offset del stream en BigQuery (reintento = no duplica)
+            con.executemany(
+                f"INSERT OR IGNORE INTO mie_fotos ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+                [[f.get(c) for c in cols] for f in filas],
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
+    def reemplazar_fotos(self, mie_id: int, tipo: str, filas: list) -> list:
+        cols = list(COLUMNAS_FOTOS)
+        con = self._conexion()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            viejas = con.execute(
+                "SELECT url_foto, url_thumb, url_medium, url_original "
+                "FROM mie_fotos WHERE mie_id = ? AND tipo = ?",
+                (mie_id, tipo),
+            ).fetchall()
+            con.execute("DELETE FROM mie_fotos WHERE mie_id = ? AND tipo = ?", (mie_id, tipo))
+            con.executemany(
+                f"INSERT INTO mie_fotos ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})",
+                [[f.get(c) for c in cols] for f in filas],
+            )
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        return viejas
+
+    def fotos_referenciadas(self, urls: list) -> set:
+        if not urls:
+            return set()
+        filas = self._consultar(
+            f"SELECT DISTINCT url_foto FROM mie_fotos "
+            f"WHERE url_foto IN ({', '.join('?' for _ in urls)})",
+            list(urls),
+        )
+        return {f.url_foto for f in filas}
+
+
+# ---------------------------------------------------------
+# Almacén de fotos (carpeta)
+# ---------------------------------------------------------
+class AlmacenLocal(AlmacenFotos):
+    """
+    Blobs como archivos bajo LOCAL_DIR/fotos. Generación = mtime_ns, último
+    uso = mtime; la metadata va al lado, en <archivo>.meta.json.
+    """
+
+    def __init__(self, directorio: str = LOCAL_DIR):
+        self.directorio = os.path.join(directorio, "fotos")
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, nombre: str) -> str:
+        ruta = os.path.normpath(os.path.join(self.directorio, nombre))
+        if not ruta.startswith(self.directorio + os.sep):
+            raise ValueError(f"Nombre de blob inválido: {nombre!r}")
+        return ruta
+
+    def _guardar_metadata(self, ruta: str, metadata):
+        # Antes que el archivo: el blob nunca se ve sin su metadata
+        if metadata:
+            tmp = f"{ruta}{_SUFIJO_META}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(metadata, fh)
+            os.replace(tmp, ruta + _SUFIJO_META)
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(ruta + _SUFIJO_META)
+
+    def subir_bytes(self, nombre: str, data: bytes, content_type=None, metadata=None):
+        ruta = self._ruta(nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._guardar_metadata(ruta, metadata)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, ruta)
+
+    def subir(self, nombre: str, file_obj, content_type=None, metadata=None):
+        ruta = self._ruta(nombre)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._guardar_metadata(ruta, metadata)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            shutil.copyfileobj(file_obj, fh, _CHUNK_COPIA)
+        os.replace(tmp, ruta)
+
+    def descargar(self, nombre: str, timeout=None):
+        ruta = self._ruta(nombre)
+        try:
+            generacion = os.stat(ruta).st_mtime_ns
+            with open(ruta, "rb") as fh:
+                return fh.read(), generacion
+        except FileNotFoundError as e:
+            raise BlobNoEncontrado(nombre) from e
+
+    def marcar_uso(self, nombre: str):
+        # El mtime del archivo es la marca de último uso
+        ruta = self._ruta(nombre)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(ruta + _SUFIJO_META, encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def listar(self, prefijo: str):
+        base = os.path.dirname(self._ruta(prefijo + "x"))
+        for carpeta, _, archivos in os.walk(base):
+            for archivo in archivos:
+                if archivo.endswith((".tmp", _SUFIJO_META)):
+                    continue
+                ruta = os.path.join(carpeta, archivo)
+                nombre = os.path.relpath(ruta, self.directorio).replace(os.sep, "/")
+                if not nombre.startswith(prefijo):
+                    continue
+                try:
+                    mtime = os.stat(ruta).st_mtime
+                except FileNotFoundError:
+                    continue
+                yield nombre, datetime.fromtimestamp(mtime, timezone.utc)
+
+    def borrar_sin_uso(self, nombres: list, gracia_seg: int) -> list:
+        limite = time.time() - gracia_seg
+        recientes = []
+        for nombre in nombres:
+            ruta = self._ruta(nombre)
+            try:
+                if os.stat(ruta).st_mtime > limite:
+                    recientes.append(nombre)
+                    continue
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(ruta + _SUFIJO_META)
+        return recientes
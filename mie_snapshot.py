@@ -0,0 +1,174 @@
+# ============================================================
+# mie_snapshot.py — copia local (Parquet) de mie_eventos
+# ============================================================
+# Estadísticas y Exportar leen la tabla completa. En vez de traer todas
+# las filas en cada visita, se mantiene un snapshot en disco y solo se
+# piden a BigQuery las filas con fecha_modificacion posterior a la marca
+# de la última sincronización (upsert por mie_id).
+#
+# Un snapshot por juego de columnas: Estadísticas (COLUMNAS_ESTADISTICAS)
+# no baja las columnas de texto que solo usa Exportar. Las filas borradas
+# en la tabla no aparecen como cambios: cada SNAPSHOT_RECONCILIAR_SEG se
+# compara el conjunto de mie_id con BigQuery y se sacan las que ya no están.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from config import (
+    SNAPSHOT_DIR,
+    SNAPSHOT_INTERVALO_SEG,
+    SNAPSHOT_RECONCILIAR_SEG,
+    SNAPSHOT_SOLAPAMIENTO_SEG,
+)
+from mie_backend import COLUMNAS_EXPORTAR, obtener_todos_mie_df
+from mie_repositorio import tipar_dataframe
+
+# Columnas que lleva todo snapshot: clave del upsert, marca y orden
+_COLUMNAS_BASE = ("mie_id", "fecha_modificacion", "fecha_creacion_registro")
+
+
+class _Snapshot:
+    """Snapshot de un juego de columnas, con su propio Parquet y su propia marca."""
+
+    def __init__(self, columnas: tuple):
+        self.columnas = tuple(dict.fromkeys(tuple(columnas) + _COLUMNAS_BASE))
+        if tuple(columnas) == tuple(COLUMNAS_EXPORTAR):
+            nombre = "mie_eventos"
+        else:
+            firma = hashlib.sha256(",".join(self.columnas).encode("utf-8")).hexdigest()[:12]
+            nombre = f"mie_eventos_{firma}"
+        self.ruta_datos = os.path.join(SNAPSHOT_DIR, f"{nombre}.parquet")
+        self.ruta_marca = os.path.join(SNAPSHOT_DIR, f"{nombre}.json")
+
+        self.lock = threading.Lock()
+        self.df = None                  # snapshot en memoria
+        self.marca = None               # mayor fecha_modificacion vista (UTC)
+        self.ultima_sync = 0.0          # time.monotonic() de la última consulta de cambios
+        self.ultima_reconciliacion = 0.0
+
+    def _normalizar(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Mismas columnas y dtypes siempre (tras leer el Parquet o concatenar)."""
+        return tipar_dataframe(df.reindex(columns=list(self.columnas)))
+
+    def _cargar_de_disco(self):
+        try:
+            df = pd.read_parquet(self.ruta_datos)
+            with open(self.ruta_marca, encoding="utf-8") as fh:
+                marca = json.load(fh)["marca"]
+        except (OSError, ValueError, KeyError):
+            return
+        self.df = self._normalizar(df)
+        self.marca = datetime.fromisoformat(marca) if marca else None
+
+    def _guardar_en_disco(self):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        sufijo = f".{os.getpid()}.tmp"
+        self.df.to_parquet(self.ruta_datos + sufijo, index=False)
+        os.replace(self.ruta_datos + sufijo, self.ruta_datos)
+        # La marca va después de los datos: si se corta en el medio, la próxima
+        # sincronización vuelve a pedir esos cambios (el upsert es idempotente).
+        with open(self.ruta_marca + sufijo, "w", encoding="utf-8") as fh:
+            json.dump({"marca": self.marca.isoformat() if self.marca else None}, fh)
+        os.replace(self.ruta_marca + sufijo, self.ruta_marca)
+
+    def _reconciliar_borrados(self) -> int:
+        # Después de traer los cambios: una fila que está en el snapshot y no
+        # en esta lista se borró de la tabla (las altas nuevas solo suman ids)
+        vigentes = obtener_todos_mie_df(("mie_id",))["mie_id"]
+        borradas = ~self.df["mie_id"].isin(vigentes)
+        self.ultima_reconciliacion = time.monotonic()
+        if not borradas.any():
+            return 0
+        self.df = self.df[~borradas].reset_index(drop=True)
+        return int(borradas.sum())
+
+    def sincronizar(self, forzar: bool = False) -> int:
+        """
+        Trae los cambios desde la marca y los aplica al snapshot; cada tanto
+        (o con `forzar`) saca además las filas borradas en la tabla.
+        Devuelve cuántas filas cambiaron (0 si no tocaba consultar todavía).
+        """
+        with self.lock:
+            if self.df is None:
+                self._cargar_de_disco()
+            if (
+                not forzar
+                and self.df is not None
+                and time.monotonic() - self.ultima_sync < SNAPSHOT_INTERVALO_SEG
+            ):
+                return 0
+
+            completa = self.df is None
+            desde = None
+            if not completa and self.marca is not None:
+                # Margen hacia atrás: relojes de distintas instancias y escrituras
+                # que terminaron después de la última sincronización.
+                desde = self.marca - timedelta(seconds=SNAPSHOT_SOLAPAMIENTO_SEG)
+
+            cambios = obtener_todos_mie_df(self.columnas, None if completa else desde)
+            self.ultima_sync = time.monotonic()
+
+            if completa:
+                self.df = self._normalizar(cambios)
+                self.ultima_reconciliacion = self.ultima_sync
+            elif not cambios.empty:
+                # Upsert por mie_id. concat de category con categorías distintas da
+                # object: _normalizar las vuelve a tipar.
+                self.df = self._normalizar(pd.concat(
+                    [self.df[~self.df["mie_id"].isin(cambios["mie_id"])], cambios],
+                    ignore_index=True,
+                ))
+
+            borradas = 0
+            if forzar or time.monotonic() - self.ultima_reconciliacion >= SNAPSHOT_RECONCILIAR_SEG:
+                borradas = self._reconciliar_borrados()
+
+            if not completa and cambios.empty and not borradas:
+                return 0
+
+            self.df = self.df.sort_values(["fecha_creacion_registro", "mie_id"], ignore_index=True)
+            vistas = self.df["fecha_modificacion"].dropna()
+            if not vistas.empty:
+                self.marca = vistas.max().to_pydatetime().astimezone(timezone.utc)
+            self._guardar_en_disco()
+            return len(cambios) + borradas
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _snapshot(columnas=None) -> _Snapshot:
+    columnas = tuple(columnas) if columnas is not None else tuple(COLUMNAS_EXPORTAR)
+    with _snapshots_lock:
+        if columnas not in _snapshots:
+            _snapshots[columnas] = _Snapshot(columnas)
+        return _snapshots[columnas]
+
+
+def sincronizar(forzar: bool = False, columnas=None) -> int:
+    """
+    Sincroniza el snapshot de `columnas` (None = COLUMNAS_EXPORTAR). Ver
+    _Snapshot.sincronizar.
+    """
+    return _snapshot(columnas).sincronizar(forzar)
+
+
+def obtener_snapshot_eventos(columnas=None) -> pd.DataFrame:
+    """
+    DataFrame de mie_eventos al día (sincroniza antes si corresponde).
+    `columnas`: tupla (p.ej. COLUMNAS_ESTADISTICAS); None = todas. Cada
+    juego de columnas tiene su propio snapshot: solo se bajan esas.
+    Devuelve una copia: el llamador la puede modificar.
+    """
+    snapshot = _snapshot(columnas)
+    snapshot.sincronizar()
+    with snapshot.lock:
+        df = snapshot.df[list(columnas)] if columnas is not None else snapshot.df
+        return df.copy()
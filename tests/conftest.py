@@ -0,0 +1,108 @@
+# ============================================================
+# conftest.py — mie_backend sobre el almacenamiento local, aislado por test
+# ============================================================
+# Los módulos leen la configuración al importarse: el entorno se fija acá,
+# antes de cualquier import del proyecto. Cada test recibe mie_backend con
+# un RepositorioLocal / AlmacenLocal nuevos en su tmp_path, cache y
+# secuencias vacías y un journal propio (apagado salvo con `journal`).
+
+import os
+import tempfile
+import threading
+
+import pytest
+
+_DIR = tempfile.mkdtemp(prefix="mie_tests_")
+os.environ.update({
+    "MIE_ALMACENAMIENTO": "local",
+    "MIE_LOCAL_DIR": os.path.join(_DIR, "local"),
+    "MIE_JOURNAL": "0",
+    "MIE_JOURNAL_DIR": os.path.join(_DIR, "journal"),
+    "MIE_FOTOS_CACHE_DIR": os.path.join(_DIR, "cache"),
+    "MIE_SNAPSHOT_DIR": os.path.join(_DIR, "snapshot"),
+})
+
+import mie_backend  # noqa: E402
+import mie_journal  # noqa: E402
+from mie_repositorio import SECUENCIA_CODIGO  # noqa: E402
+from mie_repositorio_local import AlmacenLocal, RepositorioLocal  # noqa: E402
+
+
+def _esperar_borrados():
+    # Un solo worker: cuando corre esta tarea, las anteriores ya terminaron
+    mie_backend._pool_borrados.submit(lambda: None).result()
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """mie_backend con almacenamiento local nuevo y sin estado en memoria."""
+    directorio = str(tmp_path / "local")
+    monkeypatch.setattr(mie_backend, "_repo", RepositorioLocal(directorio))
+    monkeypatch.setattr(mie_backend, "_almacen", AlmacenLocal(directorio))
+    monkeypatch.setattr(mie_backend, "_secuencias", {
+        clave: mie_backend._Secuencia(s.nombre, s.semilla, s.bloque, s.piso)
+        for clave, s in mie_backend._secuencias.items()
+        if clave[0] != SECUENCIA_CODIGO
+    })
+    monkeypatch.setattr(
+        mie_backend, "_cache_disco",
+        mie_backend._CacheDiscoBlobs(str(tmp_path / "cache"), 16 * 1024 * 1024),
+    )
+    monkeypatch.setattr(mie_backend, "_ultimo_barrido", None)
+    monkeypatch.setattr(mie_backend, "JOURNAL_ACTIVO", False)
+    monkeypatch.setattr(mie_journal, "_RUTA", str(tmp_path / "mie_journal.sqlite3"))
+    monkeypatch.setattr(mie_journal, "_local", threading.local())
+    mie_backend.invalidar_cache()
+
+    yield mie_backend
+
+    # Barridos en segundo plano lanzados por el test: que no crucen al siguiente
+    _esperar_borrados()
+    mie_backend.invalidar_cache()
+
+
+@pytest.fixture
+def journal(backend, monkeypatch):
+    """
+    Activa el journal sin su hilo de fondo. Devuelve drenar(): aplica, en
+    el hilo del test, todo lo que el journal ya puede aplicar.
+    """
+    monkeypatch.setattr(backend, "JOURNAL_ACTIVO", True)
+    monkeypatch.setattr(mie_journal, "_aplicar", backend._aplicar_entrada)
+
+    def drenar():
+        while True:
+            fila, _ = mie_journal._siguiente()
+            if fila is None:
+                return
+            mie_journal._procesar(fila)
+
+    return drenar
+
+
+@pytest.fixture
+def alta(backend):
+    """alta(**campos) -> (mie_id, codigo_mie): insertar_mie con valores por defecto."""
+
+    def crear(**campos):
+        datos = {
+            "drm": None,
+            "pozo": "PZ-1",
+            "locacion": "LOC-1",
+            "fluido": "Petróleo",
+            "volumen_estimado_m3": 1.5,
+            "causa_probable": "Corrosión",
+            "responsable": "Operación",
+            "observaciones": "",
+            "creado_por": "test",
+        }
+        datos.update(campos)
+        return backend.insertar_mie(**datos)
+
+    return crear
+
+
+@pytest.fixture
+def esperar_borrados():
+    """Espera a que terminen los barridos de fotos en segundo plano."""
+    return _esperar_borrados
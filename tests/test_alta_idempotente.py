@@ -0,0 +1,65 @@
+# Alta idempotente (clave_idempotencia): el mismo formulario enviado de
+# nuevo devuelve el MIA existente, sin otra fila ni números gastados.
+
+import threading
+
+import mie_journal
+
+
+def _filas(backend):
+    return backend._repo._consultar("SELECT mie_id, codigo_mie FROM mie_eventos")
+
+
+def test_misma_clave_devuelve_el_mismo_mia(backend, alta):
+    primera = alta(clave_idempotencia="form-1")
+    segunda = alta(clave_idempotencia="form-1")
+
+    assert segunda == primera
+    assert len(_filas(backend)) == 1
+
+
+def test_un_reenvio_no_gasta_ids_ni_codigos(backend, alta):
+    mie_id, _ = alta(clave_idempotencia="form-1")
+    alta(clave_idempotencia="form-1")
+
+    otro_id, _ = alta(clave_idempotencia="form-2")
+
+    assert otro_id == mie_id + 1
+    codigos = sorted(f.codigo_mie for f in _filas(backend))
+    assert [c[-4:] for c in codigos] == ["0001", "0002"]
+
+
+def test_sin_clave_cada_envio_es_un_alta(backend, alta):
+    assert alta() != alta()
+    assert len(_filas(backend)) == 2
+
+
+def test_envios_simultaneos_de_la_misma_clave(backend, alta):
+    resultados = []
+    barrera = threading.Barrier(8)
+
+    def enviar():
+        barrera.wait()
+        resultados.append(alta(clave_idempotencia="doble-click"))
+
+    hilos = [threading.Thread(target=enviar) for _ in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert len(set(resultados)) == 1
+    assert len(_filas(backend)) == 1
+
+
+def test_con_journal_la_clave_se_busca_tambien_en_lo_pendiente(backend, journal, alta):
+    primera = alta(clave_idempotencia="form-1")
+    assert _filas(backend) == []
+
+    assert alta(clave_idempotencia="form-1") == primera
+    journal()
+    assert alta(clave_idempotencia="form-1") == primera
+
+    assert [f.mie_id for f in _filas(backend)] == [primera[0]]
+    altas = [e for e in mie_journal.recientes(100) if e["tipo"] == "insertar"]
+    assert len(altas) == 1
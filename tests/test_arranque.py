@@ -0,0 +1,106 @@
+# ============================================================
+# test_arranque.py — costo de import hasta el login (cold start)
+# ============================================================
+# Cada caso corre en un intérprete nuevo (sys.modules limpio) y verifica
+# que no se cargue, ni se intente cargar, ninguna librería pesada que
+# solo hace falta después del login: clientes de Google, pandas, PIL,
+# reportlab, plotly. El intento también cuenta: así el test sirve aunque
+# la librería no esté instalada.
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+PROHIBIDOS = ("google", "pandas", "pyarrow", "PIL", "reportlab", "plotly")
+
+# Anota cada import de PROHIBIDOS (sin bloquearlo) y al final imprime el
+# JSON con lo intentado y lo que quedó en sys.modules.
+_SONDA = """
+import json, sys
+
+PROHIBIDOS = {prohibidos!r}
+intentados = set()
+
+
+class Vigia:
+    def find_spec(self, nombre, path=None, target=None):
+        if nombre.split(".")[0] in PROHIBIDOS:
+            intentados.add(nombre)
+        return None
+
+
+sys.meta_path.insert(0, Vigia())
+
+{cuerpo}
+
+cargados = sorted(m for m in sys.modules if m.split(".")[0] in PROHIBIDOS)
+print(json.dumps({{"intentados": sorted(intentados), "cargados": cargados, **extra}}))
+"""
+
+# Streamlit de mentira: lo justo para que app_mie llegue a la pantalla de
+# login. st.stop() corta la ejecución como el real.
+_APP_HASTA_LOGIN = """
+from unittest import mock
+
+
+class Stop(Exception):
+    pass
+
+
+st = mock.MagicMock()
+st.session_state = {}
+st.button.return_value = False
+st.text_input.return_value = ""
+st.columns.side_effect = lambda spec, **kw: [
+    mock.MagicMock() for _ in (spec if isinstance(spec, (list, tuple)) else range(spec))
+]
+st.stop.side_effect = Stop
+sys.modules["streamlit"] = st
+
+try:
+    import app_mie
+    llego_al_login = False
+except Stop:
+    llego_al_login = True
+
+import mie_diagnostico
+extra = {
+    "stop": llego_al_login,
+    "etapas": [e["etapa"] for e in mie_diagnostico.arranque()],
+}
+"""
+
+
+def _sondear(cuerpo: str) -> dict:
+    salida = subprocess.run(
+        [sys.executable, "-c", _SONDA.format(prohibidos=PROHIBIDOS, cuerpo=cuerpo)],
+        cwd=RAIZ,
+        capture_output=True,
+        text=True,
+    )
+    assert salida.returncode == 0, salida.stderr
+    # La sonda imprime su JSON al final (el import puede loguear antes)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def test_app_hasta_el_login_no_carga_librerias_pesadas():
+    resultado = _sondear(_APP_HASTA_LOGIN)
+
+    assert resultado["stop"], "app_mie no llegó al st.stop() del login"
+    assert "login" in resultado["etapas"]
+    assert resultado["intentados"] == []
+    assert resultado["cargados"] == []
+
+
+@pytest.mark.parametrize("modulo", ["config", "mie_diagnostico", "mie_backend", "mie_backend_async"])
+def test_import_del_backend_no_carga_librerias_pesadas(modulo):
+    # Lo que app_mie importa recién después del login tampoco abre clientes
+    resultado = _sondear(f"import {modulo}\nextra = {{}}")
+
+    assert resultado["intentados"] == []
+    assert resultado["cargados"] == []
@@ -0,0 +1,91 @@
+# Cache de lecturas de mie_backend: read-through, invalidación por grupo /
+# mie_id en cada escritura, TTL y tope de entradas.
+
+
+def _contar(monkeypatch, objeto, metodo):
+    """Envuelve objeto.metodo para contar las llamadas; devuelve la lista de args."""
+    llamadas = []
+    original = getattr(objeto, metodo)
+
+    def contado(*args, **kwargs):
+        llamadas.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(objeto, metodo, contado)
+    return llamadas
+
+
+def test_lecturas_repetidas_salen_del_cache(backend, alta, monkeypatch):
+    mie_id, _ = alta()
+    llamadas = _contar(monkeypatch, backend._repo, "obtener_evento")
+
+    primera = backend.obtener_mie_detalle(mie_id)
+    segunda = backend.obtener_mie_detalle(mie_id)
+
+    assert primera.mie_id == segunda.mie_id == mie_id
+    assert len(llamadas) == 1
+
+
+def test_actualizar_invalida_detalle_y_listado(backend, alta):
+    mie_id, _ = alta(observaciones="antes")
+    assert backend.obtener_mie_detalle(mie_id).observaciones == "antes"
+    filas, _ = backend.listar_mie_pagina()
+    assert filas[0].estado == "ABIERTO"
+
+    backend.actualizar_mie_completo(mie_id, observaciones="después")
+    backend.cerrar_mie_con_remediacion(mie_id, None, None, None, None, "ok", "Ap", "Nom")
+
+    assert backend.obtener_mie_detalle(mie_id).observaciones == "después"
+    filas, _ = backend.listar_mie_pagina()
+    assert filas[0].estado == "CERRADO"
+
+
+def test_invalidar_un_mia_no_toca_los_demas(backend, alta, monkeypatch):
+    a, _ = alta()
+    b, _ = alta()
+    backend.obtener_mie_detalle(a)
+    backend.obtener_mie_detalle(b)
+    llamadas = _contar(monkeypatch, backend._repo, "obtener_evento")
+
+    backend.actualizar_mie_completo(a, observaciones="x")
+    backend.obtener_mie_detalle(a)
+    backend.obtener_mie_detalle(b)
+
+    assert [args[0] for args in llamadas] == [a]
+
+
+def test_alta_invalida_el_listado(backend, alta):
+    alta()
+    filas, _ = backend.listar_mie_pagina()
+    assert len(filas) == 1
+
+    alta()
+    filas, _ = backend.listar_mie_pagina()
+    assert len(filas) == 2
+
+
+def test_entradas_vencidas_se_vuelven_a_consultar(backend, alta, monkeypatch):
+    mie_id, _ = alta()
+    monkeypatch.setattr(backend, "CACHE_TTL_SEGUNDOS", -1)
+    llamadas = _contar(monkeypatch, backend._repo, "obtener_evento")
+
+    backend.obtener_mie_detalle(mie_id)
+    backend.obtener_mie_detalle(mie_id)
+
+    assert len(llamadas) == 2
+
+
+def test_tope_de_entradas_descarta_la_menos_usada(backend, alta, monkeypatch):
+    ids = [alta()[0] for _ in range(3)]
+    monkeypatch.setattr(backend, "CACHE_MAX_ENTRADAS", 2)
+    backend.obtener_mie_detalle(ids[0])
+    backend.obtener_mie_detalle(ids[1])
+    backend.obtener_mie_detalle(ids[0])      # ids[1] pasa a ser la menos usada
+    backend.obtener_mie_detalle(ids[2])
+    llamadas = _contar(monkeypatch, backend._repo, "obtener_evento")
+
+    backend.obtener_mie_detalle(ids[0])
+    backend.obtener_mie_detalle(ids[1])
+
+    assert len(backend._cache) == 2
+    assert [args[0] for args in llamadas] == [ids[1]]
@@ -0,0 +1,120 @@
+# Fotos por contenido: la misma imagen es un solo juego de blobs aunque la
+# usen varios MIA, y el barrido borra solo lo que ninguna fila referencia
+# y nadie usó dentro del plazo de gracia.
+
+import os
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def _foto(color, lado=1600, nombre="foto.png"):
+    buf = BytesIO()
+    Image.new("RGB", (lado, lado), color).save(buf, "PNG")
+    buf.seek(0)
+    buf.name = nombre
+    buf.type = "image/png"
+    return buf
+
+
+def _blobs(backend):
+    return sorted(nombre for nombre, _ in backend._almacen.listar("fotos/"))
+
+
+@pytest.fixture
+def barrer(backend, esperar_borrados):
+    """Barrido forzado, después de los que hayan quedado en segundo plano."""
+
+    def correr():
+        esperar_borrados()
+        return backend.barrer_fotos_sin_referencias(forzar=True)
+
+    return correr
+
+
+@pytest.fixture
+def sin_gracia(backend, monkeypatch):
+    # Todo lo ya subido cuenta como "usado hace más del plazo"
+    monkeypatch.setattr(backend, "FOTOS_BORRADO_GRACIA_SEG", 0)
+
+
+def test_la_misma_foto_se_sube_una_vez(backend):
+    primera, = backend.registrar_fotos(1, "ANTES", [_foto("red")])
+    blobs = _blobs(backend)
+    segunda, = backend.registrar_fotos(2, "ANTES", [_foto("red", nombre="otra.png")])
+
+    assert segunda == primera
+    assert _blobs(backend) == blobs
+    assert primera["url_thumb"] in blobs and primera["url_medium"] in blobs
+    # Foto chica: sin renditions, y el reuso lo sabe sin buscarlas
+    chica, = backend.registrar_fotos(3, "ANTES", [_foto("blue", lado=100)])
+    assert backend._foto_ya_subida(chica["url_foto"]) == {
+        "url_foto": chica["url_foto"], "url_thumb": None, "url_medium": None, "url_original": None,
+    }
+
+
+def test_reenviar_el_lote_no_duplica_filas(backend):
+    backend.registrar_fotos(1, "ANTES", [_foto("red"), _foto("green")])
+    backend.registrar_fotos(1, "ANTES", [_foto("red"), _foto("green")])
+
+    assert len(backend._repo.fotos_de_mie(1, "ANTES")) == 2
+
+
+def test_barrido_respeta_el_plazo_de_gracia(backend, barrer):
+    backend.subir_fotos_a_bucket([_foto("red")])   # subida sin filas (p. ej. un alta que falló)
+
+    assert barrer() == 0
+    assert len(_blobs(backend)) == 3
+
+
+def test_barrido_borra_lo_que_nadie_referencia(backend, barrer, sin_gracia):
+    usada, = backend.registrar_fotos(1, "ANTES", [_foto("red")])
+    huerfana, = backend.subir_fotos_a_bucket([_foto("green")])
+
+    assert barrer() == 3   # principal + thumb + medium
+
+    restantes = _blobs(backend)
+    assert usada["url_foto"] in restantes and usada["url_thumb"] in restantes
+    assert not any(b.startswith(huerfana["url_foto"]) for b in restantes)
+
+
+def test_reemplazo_borra_solo_las_que_quedaron_sin_filas(backend, barrer, sin_gracia):
+    compartida, vieja = backend.registrar_fotos(1, "ANTES", [_foto("red"), _foto("green")])
+    backend.registrar_fotos(2, "ANTES", [_foto("red")])      # la usa otro MIA
+
+    backend.reemplazar_fotos_antes(1, [_foto("blue")])
+    barrer()
+
+    restantes = _blobs(backend)
+    assert compartida["url_foto"] in restantes
+    assert not any(b.startswith(vieja["url_foto"]) for b in restantes)
+    assert len(backend._repo.fotos_de_mie(1, "ANTES")) == 1
+
+
+def test_barrido_borra_renditions_sin_principal(backend, barrer, sin_gracia):
+    foto, = backend.subir_fotos_a_bucket([_foto("red")])
+    # Un barrido anterior que se cortó después de borrar la principal
+    backend._almacen.borrar_sin_uso([foto["url_foto"]], 0)
+
+    assert barrer() == 2
+    assert _blobs(backend) == []
+
+
+def test_reusar_una_foto_la_protege_del_barrido(backend, barrer):
+    reusada, = backend.subir_fotos_a_bucket([_foto("red")])
+    olvidada, = backend.subir_fotos_a_bucket([_foto("green")])
+    hace_dos_horas = time.time() - 7200
+    for nombre in _blobs(backend):
+        os.utime(backend._almacen._ruta(nombre), (hace_dos_horas, hace_dos_horas))
+
+    # Otra subida encuentra la foto: marca solo la principal, y alcanza
+    assert backend._foto_ya_subida(reusada["url_foto"]) == {
+        k: v for k, v in reusada.items() if k != "hash_contenido"
+    }
+
+    assert barrer() == 3
+    restantes = _blobs(backend)
+    assert [reusada["url_foto"], reusada["url_medium"], reusada["url_thumb"]] == restantes
+    assert not any(b.startswith(olvidada["url_foto"]) for b in restantes)
@@ -0,0 +1,106 @@
+# Journal de escrituras (mie_journal): lectura con lo pendiente encima,
+# orden dentro de cada MIA, dead letter (FALLIDA) y reintento idempotente.
+
+import mie_journal
+
+
+def _fallar_altas(monkeypatch, repo, mie_id, veces, despues_de_escribir=False):
+    """insertar_evento falla `veces` veces para `mie_id` (antes o después de escribir)."""
+    original = repo.insertar_evento
+    fallas = {"quedan": veces}
+
+    def insertar(fila):
+        if fila["mie_id"] == mie_id and fallas["quedan"] > 0:
+            fallas["quedan"] -= 1
+            if despues_de_escribir:
+                original(fila)
+            raise RuntimeError("se cortó la conexión")
+        return original(fila)
+
+    monkeypatch.setattr(repo, "insertar_evento", insertar)
+
+
+def _estados(mie_id):
+    return [
+        (e["tipo"], e["estado"])
+        for e in reversed(mie_journal.recientes(100))
+        if e["mie_id"] == mie_id
+    ]
+
+
+def test_lo_pendiente_se_ve_antes_de_llegar_a_la_base(backend, journal, alta):
+    mie_id, codigo = alta(observaciones="alta")
+    backend.actualizar_mie_completo(mie_id, observaciones="editado")
+
+    assert backend._repo.obtener_evento(mie_id) is None
+    assert backend.obtener_mie_detalle(mie_id).observaciones == "editado"
+    filas, _ = backend.listar_mie_pagina()
+    assert [f.codigo_mie for f in filas] == [codigo]
+
+    journal()
+
+    assert backend._repo.obtener_evento(mie_id).observaciones == "editado"
+    assert _estados(mie_id) == [("insertar", "CONFIRMADA"), ("actualizar", "CONFIRMADA")]
+    assert backend.escrituras_pendientes() == []
+
+
+def test_las_entradas_de_un_mia_se_aplican_en_orden(backend, journal, alta, monkeypatch):
+    aplicadas = []
+    original = backend._aplicar_entrada
+
+    def aplicar(tipo, mie_id, campos, reintento):
+        aplicadas.append((mie_id, campos.get("observaciones")))
+        return original(tipo, mie_id, campos, reintento)
+
+    monkeypatch.setattr(mie_journal, "_aplicar", aplicar)
+    mie_id, _ = alta(observaciones="0")
+    for i in range(1, 4):
+        backend.actualizar_mie_completo(mie_id, observaciones=str(i))
+
+    journal()
+
+    assert aplicadas == [(mie_id, str(i)) for i in range(4)]
+    assert backend._repo.obtener_evento(mie_id).observaciones == "3"
+
+
+def test_una_entrada_fallida_retiene_solo_a_su_mia(backend, journal, alta, monkeypatch):
+    monkeypatch.setattr(mie_journal, "JOURNAL_MAX_INTENTOS", 1)
+    a, _ = alta()
+    b, _ = alta()
+    _fallar_altas(monkeypatch, backend._repo, a, veces=1)
+    backend.actualizar_mie_completo(a, observaciones="a editado")
+    backend.actualizar_mie_completo(b, observaciones="b editado")
+
+    journal()
+
+    assert _estados(a) == [("insertar", "FALLIDA"), ("actualizar", "PENDIENTE")]
+    assert _estados(b) == [("insertar", "CONFIRMADA"), ("actualizar", "CONFIRMADA")]
+    assert backend._repo.obtener_evento(a) is None
+    fallida, = mie_journal.fallidas()
+    assert fallida["mie_id"] == a and "se cortó" in fallida["ultimo_error"]
+
+    backend.reintentar_escritura(fallida["id"])
+    journal()
+
+    assert _estados(a) == [("insertar", "CONFIRMADA"), ("actualizar", "CONFIRMADA")]
+    assert backend._repo.obtener_evento(a).observaciones == "a editado"
+
+
+def test_reintentar_un_alta_que_llego_a_escribirse_no_duplica(backend, journal, alta, monkeypatch):
+    monkeypatch.setattr(mie_journal, "JOURNAL_REINTENTO_MAX_SEG", 0)
+    mie_id, _ = alta()
+    # Escribe la fila pero la respuesta no llega: el journal la reintenta
+    _fallar_altas(monkeypatch, backend._repo, mie_id, veces=1, despues_de_escribir=True)
+
+    journal()
+
+    assert _estados(mie_id) == [("insertar", "CONFIRMADA")]
+    filas = backend._repo._consultar("SELECT mie_id FROM mie_eventos WHERE mie_id = ?", (mie_id,))
+    assert len(filas) == 1
+
+
+def test_sin_journal_la_escritura_es_inmediata(backend, alta):
+    mie_id, _ = alta()
+
+    assert backend._repo.obtener_evento(mie_id) is not None
+    assert backend.escrituras_recientes() == []
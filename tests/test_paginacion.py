@@ -0,0 +1,63 @@
+# Listado paginado por cursor (keyset): orden estable, sin repetidos ni
+# saltos aunque entren altas a mitad de camino, y filtros del lado del servidor.
+
+from datetime import date, datetime
+
+
+def _recorrer(backend, tamano, **filtros):
+    paginas, cursor = [], None
+    while True:
+        filas, cursor = backend.listar_mie_pagina(cursor, tamano, **filtros)
+        paginas.append([f.mie_id for f in filas])
+        if cursor is None:
+            return paginas
+
+
+def test_las_paginas_cubren_todo_en_orden(backend, alta):
+    ids = [alta()[0] for _ in range(7)]
+
+    paginas = _recorrer(backend, 3)
+
+    assert [len(p) for p in paginas] == [3, 3, 1]
+    # Más recientes primero; a igual fecha de creación desempata mie_id
+    assert sum(paginas, []) == sorted(ids, reverse=True)
+
+
+def test_pagina_exacta_no_deja_una_pagina_vacia(backend, alta):
+    for _ in range(4):
+        alta()
+
+    assert [len(p) for p in _recorrer(backend, 2)] == [2, 2]
+
+
+def test_altas_nuevas_no_corren_las_paginas_siguientes(backend, alta):
+    viejos = [alta()[0] for _ in range(6)]
+    primera, cursor = backend.listar_mie_pagina(None, 3)
+
+    nuevos = [alta()[0] for _ in range(2)]
+    resto = []
+    while cursor is not None:
+        filas, cursor = backend.listar_mie_pagina(cursor, 3)
+        resto += [f.mie_id for f in filas]
+
+    vistos = [f.mie_id for f in primera] + resto
+    assert sorted(vistos) == sorted(viejos)
+    assert not set(nuevos) & set(vistos)
+    assert [f.mie_id for f in backend.listar_mie_pagina(None, 2)[0]] == sorted(nuevos, reverse=True)
+
+
+def test_filtros(backend, alta):
+    a, codigo_a = alta(pozo="PZ-NORTE", fecha_hora_evento=datetime(2024, 3, 10, 8, 0))
+    b, _ = alta(pozo="PZ-SUR", fecha_hora_evento=datetime(2024, 3, 11, 23, 59))
+    c, _ = alta(pozo="PZ-NORTE", fecha_hora_evento=datetime(2024, 3, 12, 0, 0))
+    backend.cerrar_mie_con_remediacion(c, None, None, None, None, "", "Ap", "Nom")
+
+    def ids(**filtros):
+        return sorted(sum(_recorrer(backend, 2, **filtros), []))
+
+    assert ids(instalacion="norte") == sorted([a, c])
+    assert ids(estado="CERRADO") == [c]
+    assert ids(codigo_prefijo=codigo_a) == [a]
+    # desde / hasta son días completos, ambos inclusive
+    assert ids(desde=date(2024, 3, 11), hasta=date(2024, 3, 11)) == [b]
+    assert ids(desde=date(2024, 3, 10), hasta=date(2024, 3, 11)) == sorted([a, b])
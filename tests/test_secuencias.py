@@ -0,0 +1,79 @@
+# Reserva de IDs y códigos por bloques (mie_secuencias): una reserva por
+# bloque, bloques disjuntos entre procesos y semilla desde lo ya cargado.
+
+from datetime import datetime
+
+from mie_repositorio import CODIGO_BASE_ANIO, formato_codigo
+
+
+def _contar_reservas(monkeypatch, repo):
+    reservas = []
+    original = repo.reservar_bloque
+
+    def contado(nombre, cantidad, semilla, piso=0):
+        reservas.append((nombre, cantidad))
+        return original(nombre, cantidad, semilla, piso)
+
+    monkeypatch.setattr(repo, "reservar_bloque", contado)
+    return reservas
+
+
+def test_una_reserva_por_bloque(backend, monkeypatch):
+    reservas = _contar_reservas(monkeypatch, backend._repo)
+    bloque = backend.IDS_BLOQUE_EVENTOS
+
+    ids = [backend.obtener_siguiente_id("mie_eventos", "mie_id") for _ in range(bloque + 1)]
+
+    assert ids == list(range(1, bloque + 2))
+    assert reservas == [("mie_eventos.mie_id", bloque)] * 2
+
+
+def test_pedido_mayor_que_el_bloque_reserva_lo_que_falta(backend, monkeypatch):
+    reservas = _contar_reservas(monkeypatch, backend._repo)
+    secuencia = backend._secuencias[("mie_fotos", "id")]
+
+    ids = secuencia.siguientes(secuencia.bloque + 7)
+
+    assert ids == list(range(1, secuencia.bloque + 8))
+    assert reservas == [("mie_fotos.id", secuencia.bloque + 7)]
+
+
+def test_dos_procesos_reciben_bloques_disjuntos(backend):
+    # Dos _Secuencia sobre la misma base = dos instancias de la app
+    original = backend._secuencias[("mie_eventos", "mie_id")]
+    otra = backend._Secuencia(original.nombre, original.semilla, original.bloque)
+
+    a = [original.siguiente() for _ in range(original.bloque * 2)]
+    b = [otra.siguiente() for _ in range(original.bloque * 2)]
+
+    assert not set(a) & set(b)
+    assert len(set(a + b)) == len(a) + len(b)
+
+
+def test_la_secuencia_arranca_despues_del_maximo_existente(backend):
+    backend._repo.insertar_evento({"mie_id": 41, "codigo_mie": "MIE-2000-0001"})
+
+    assert backend.obtener_siguiente_id("mie_eventos", "mie_id") == 42
+
+
+def test_codigos_por_anio_siguen_a_los_existentes(backend, alta):
+    year = datetime.now().year
+    backend._repo.insertar_evento({"mie_id": 1, "codigo_mie": formato_codigo(year, 7)})
+
+    _, codigo = alta()
+
+    assert codigo == formato_codigo(year, 8)
+
+
+def test_codigos_de_un_bloque_sin_usar_dejan_hueco(backend, alta):
+    # Otra instancia que reservó un bloque de códigos y no lo usó
+    year = datetime.now().year
+    backend._repo.reservar_bloque(
+        backend.SECUENCIA_CODIGO, backend.IDS_BLOQUE_CODIGOS, ("codigo", year),
+        piso=year * CODIGO_BASE_ANIO,
+    )
+
+    codigos = [alta()[1] for _ in range(2)]
+
+    primero = backend.IDS_BLOQUE_CODIGOS + 1
+    assert codigos == [formato_codigo(year, primero), formato_codigo(year, primero + 1)]